@@ -0,0 +1,96 @@
+""" Measures how many model calls the adaptive ensemble saves, and how often it chooses a different move
+    from the full ensemble, on the positions in benchmarks/corpus.json.
+
+    usage (from the backend folder):
+        python benchmarks/bench_adaptive.py
+        python benchmarks/bench_adaptive.py --order whole_game_3,general_solver_1 --agreement 0 2 3
+        python benchmarks/bench_adaptive.py --synthetic                  # numpy stand-in, no TensorFlow
+
+    Every member is evaluated once for each position: each corpus position, and the position after a
+    human reply to it.  ensemble_decision.adaptive_decide() is then replayed on those predictions for each
+    agreement threshold, and compared with decide() on all of them.  With --agreement 0 only provably
+    decided moves end early, so the moves chosen are always the same. """
+
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_pipeline import CORPUS_PATH, human_move, load_app
+
+
+def corpus_positions(views, ct):
+    """ returns one-hot boards [1, 64, 13] for each corpus position and the human's reply to it """
+    with open(CORPUS_PATH) as file:
+        corpus = json.load(file)
+    positions = []
+    for fens in corpus.values():
+        for fen in fens:
+            app_fen, _ = ct.standard_fen_to_app(fen)
+            positions.append(ct.fen_to_one_hot(app_fen).reshape(1,64,13))
+            move = human_move(app_fen)
+            if move is not None:
+                error, board = views.apply_human_move(app_fen, move)
+                if error is None:
+                    positions.append(board)
+
+    return positions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--synthetic', action='store_true', help='use a numpy stand-in for the models')
+    parser.add_argument('--order', default='', help='members to evaluate first, comma separated')
+    parser.add_argument('--agreement', type=int, nargs='+', default=[0, 2], help='agreement thresholds to compare')
+    args = parser.parse_args()
+
+    es, views, _, members = load_app(args.synthetic, with_cache=False)
+    from webapp import chess_tools_local as ct
+    from webapp.ensemble_decision import adaptive_decide, decide
+    if not members:
+        sys.exit('the remote backend cannot run members one at a time, use keras or tflite')
+    names = list(members)
+    first = [names.index(name) for name in args.order.split(',') if name in names]
+    order = first + [i for i in range(len(names)) if i not in first]
+
+    # Every member's prediction and time for every position, and the full ensemble's decision
+    positions = []
+    member_ms = np.zeros(len(names))
+    for board in corpus_positions(views, ct):
+        predictions = []
+        for i, predict in enumerate(members.values()):
+            start = time.perf_counter()
+            predictions.append(np.asarray(predict(board)).reshape(64,13))
+            member_ms[i] += (time.perf_counter() - start) * 1000
+        candidates, moves = ct.find_legal_moves(ct.one_hot_to_fen(board))
+        predictions = np.stack(predictions)
+        positions.append((predictions, candidates, moves, decide(predictions, candidates, moves)))
+    member_ms /= len(positions)
+
+    print(f'{len(positions)} positions, members in order: {", ".join(names[i] for i in order)}')
+    print('  ' + ', '.join(f'{name} {ms:.2f}ms' for name, ms in zip(names, member_ms)))
+    print(f'\n{"agreement":>10}{"members":>10}{"saved":>8}{"saved ms":>10}{"moves differ":>14}{"tags differ":>13}  tags')
+    for agreement in args.agreement:
+        evaluated_total = 0
+        saved_ms = 0.0
+        moves_differ = 0
+        tags_differ = 0
+        tags = {}
+        for predictions, candidates, moves, full in positions:
+            result, evaluated = adaptive_decide(lambda i: predictions[i], order, candidates, moves, agreement)
+            evaluated_total += evaluated
+            saved_ms += member_ms[order[evaluated:]].sum()
+            moves_differ += result[1] != full[1]
+            tags_differ += result[2] != full[2]
+            tags[result[2]] = tags.get(result[2], 0) + 1
+        calls = len(positions) * len(names)
+        print(f'{agreement:>10}{evaluated_total / len(positions):>10.2f}{(calls - evaluated_total) / calls:>8.1%}'
+              f'{saved_ms / len(positions):>10.2f}{moves_differ:>14}{tags_differ:>13}  '
+              + ', '.join(f'{tag} {count}' for tag, count in sorted(tags.items())))
+
+
+if __name__ == '__main__':
+    main()
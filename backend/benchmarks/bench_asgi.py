@@ -0,0 +1,115 @@
+""" Compares a running sync (WSGI) server with a running async (ASGI) server under concurrent play.
+
+    usage (from the backend folder), with the cache and position book disabled so every move runs the models:
+        export CHESSNN_MOVE_CACHE_SIZE=0 CHESSNN_POSITION_BOOK=none
+        gunicorn --bind :8000 --workers 1 --timeout 0 django_wrapper.wsgi:application &
+        gunicorn --bind :8001 --workers 1 -k uvicorn.workers.UvicornWorker django_wrapper.asgi:application &
+        python benchmarks/bench_asgi.py --url http://localhost:8000 --url http://localhost:8001 --clients 8
+
+    Each client thread keeps its own session: it selects the Spassky-Fischer opening and posts the
+    suggested reply, over and over.  Meanwhile a probe thread fetches the opening's board image,
+    which is already rendered, to show whether cheap requests wait behind inference.  Prints moves/sec,
+    and p50/p95 latency of the moves and of the probe, for each server. """
+
+import argparse
+import http.cookiejar
+import re
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import numpy as np
+
+OPENING = 'option1'
+HUMAN_MOVE = 'g3h5'
+
+
+class Player:
+    """ a browser session: keeps cookies, and sends the CSRF token with each form """
+
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+        self.cookies = http.cookiejar.CookieJar()
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(self.cookies))
+        self.get('/play/')
+
+    def get(self, path):
+        with self.opener.open(self.url + path, timeout=300) as response:
+            return response.read().decode(errors='replace')
+
+    def post(self, path, form):
+        token = next(cookie.value for cookie in self.cookies if cookie.name == 'csrftoken')
+        data = urllib.parse.urlencode(dict(form, csrfmiddlewaretoken=token)).encode()
+        request = urllib.request.Request(self.url + path, data=data, headers={'Referer': self.url + path})
+        with self.opener.open(request, timeout=300) as response:
+            return response.read().decode(errors='replace')
+
+
+def percentiles(latencies):
+    if not latencies:
+        return 'n/a'
+    p50, p95 = np.percentile(np.array(latencies) * 1000, [50, 95])
+
+    return f'p50 {p50:7.1f} ms  p95 {p95:7.1f} ms'
+
+
+def run(url, clients, seconds):
+    """ returns (move latencies, probe latencies, errors) for one server """
+    board_path = re.search(r'(/board/\w+/[\w-]+\.png)', Player(url).post('/play/', {OPENING: 'Go'})).group(1)
+    stop = time.perf_counter() + seconds
+    move_latencies, probe_latencies, errors = [], [], []
+
+    def client():
+        try:
+            player = Player(url)
+        except (urllib.error.URLError, OSError) as error:
+            errors.append(error)
+            return
+        while time.perf_counter() < stop:
+            try:
+                player.post('/play/', {OPENING: 'Go'})
+                start = time.perf_counter()
+                player.post('/play/', {'human_move': HUMAN_MOVE})
+                move_latencies.append(time.perf_counter() - start)
+            except (urllib.error.URLError, OSError) as error:
+                errors.append(error)
+
+    def probe():
+        opener = urllib.request.build_opener()
+        while time.perf_counter() < stop:
+            start = time.perf_counter()
+            try:
+                with opener.open(url.rstrip('/') + board_path, timeout=300) as response:
+                    response.read()
+                probe_latencies.append(time.perf_counter() - start)
+            except (urllib.error.URLError, OSError) as error:
+                errors.append(error)
+            time.sleep(0.05)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)] + [threading.Thread(target=probe)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return move_latencies, probe_latencies, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', action='append', required=True, help='server to test, can be repeated')
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=20)
+    args = parser.parse_args()
+
+    for url in args.url:
+        move_latencies, probe_latencies, errors = run(url, args.clients, args.seconds)
+        print(f'{url}  ({args.clients} clients, {args.seconds:.0f}s)')
+        print(f'  moves:  {len(move_latencies) / args.seconds:7.1f} /sec  {percentiles(move_latencies)}')
+        print(f'  probe:  {len(probe_latencies):7d} reqs  {percentiles(probe_latencies)}')
+        print(f'  errors: {len(errors)}')
+
+
+if __name__ == '__main__':
+    main()
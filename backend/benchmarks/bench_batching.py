@@ -0,0 +1,114 @@
+""" Compares the per-request inference path with the micro-batching scheduler under concurrent load.
+
+    usage (from the backend folder):
+        python benchmarks/bench_batching.py --clients 16 --seconds 10 --window-ms 2
+        python benchmarks/bench_batching.py --synthetic      # numpy stand-in, no TensorFlow needed
+
+    Each client thread repeatedly submits a single board and waits for its predictions, as a
+    threaded Gunicorn worker would.  Prints positions/sec and p50/p99 latency for both paths. """
+
+import argparse
+import os
+import sys
+import threading
+import time
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+from webapp.inference_batcher import MicroBatcher
+
+
+def load_ensemble_predictor():
+    """ returns web_ensemble_solver.predict_batch, with the production models loaded """
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'django_wrapper.settings')
+    os.environ.setdefault('DJANGO_SECRET_KEY', 'benchmark')
+    import django
+    django.setup()
+    from webapp import web_ensemble_solver as es
+
+    return es.predict_batch
+
+
+def synthetic_predictor(n_models=3, hidden=1024, seed=0):
+    """ returns a numpy ensemble of fully-connected networks with the same input and output shapes """
+    rng = np.random.default_rng(seed)
+    weights = [(rng.standard_normal((832, hidden), dtype=np.float32) * 0.05,
+                rng.standard_normal((hidden, 832), dtype=np.float32) * 0.05) for _ in range(n_models)]
+
+    def predict_batch(boards):
+        x = np.asarray(boards, dtype=np.float32).reshape(-1, 832)
+        outputs = []
+        for w1, w2 in weights:
+            logits = (np.maximum(x @ w1, 0) @ w2).reshape(-1, 64, 13)
+            exp = np.exp(logits - logits.max(axis=-1, keepdims=True))
+            outputs.append(exp / exp.sum(axis=-1, keepdims=True))
+        return np.stack(outputs)
+
+    return predict_batch
+
+
+def random_boards(count, seed=1):
+    """ random one-hot boards [count, 64, 13] """
+    rng = np.random.default_rng(seed)
+    boards = np.zeros((count, 64, 13), dtype=bool)
+    pieces = rng.integers(0, 13, size=(count, 64))
+    np.put_along_axis(boards, pieces[..., None], True, axis=2)
+
+    return boards
+
+
+def run_load(predict_one, clients, seconds):
+    """ runs `clients` threads calling predict_one for `seconds`, returns throughput and latencies """
+    boards = random_boards(256)
+    latencies = [[] for _ in range(clients)]
+    stop = threading.Event()
+
+    def client(n):
+        i = n
+        while not stop.is_set():
+            start = time.perf_counter()
+            predict_one(boards[i % len(boards)][None])
+            latencies[n].append(time.perf_counter() - start)
+            i += clients
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    all_latencies = np.concatenate([np.array(l) for l in latencies]) * 1000
+
+    return {'positions_per_sec': len(all_latencies) / elapsed,
+            'p50_ms': float(np.percentile(all_latencies, 50)),
+            'p99_ms': float(np.percentile(all_latencies, 99))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--window-ms', type=float, default=2)
+    parser.add_argument('--max-batch', type=int, default=32)
+    parser.add_argument('--synthetic', action='store_true', help='use a numpy stand-in for the keras ensemble')
+    args = parser.parse_args()
+
+    predict_batch = synthetic_predictor() if args.synthetic else load_ensemble_predictor()
+    predict_batch(random_boards(1))   # warm up
+
+    direct = run_load(predict_batch, args.clients, args.seconds)
+    batcher = MicroBatcher(predict_batch, window=args.window_ms / 1000, max_batch=args.max_batch)
+    batched = run_load(batcher.predict, args.clients, args.seconds)
+
+    print(f'{"path":<12}{"positions/s":>14}{"p50 ms":>10}{"p99 ms":>10}')
+    for name, result in [('per-request', direct), ('batched', batched)]:
+        print(f'{name:<12}{result["positions_per_sec"]:>14.1f}{result["p50_ms"]:>10.2f}{result["p99_ms"]:>10.2f}')
+    print(f'mean batch size: {batcher.board_count / max(batcher.batch_count, 1):.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+""" Measures how long the web app's modules take to import, each in a fresh interpreter.
+
+    usage (from the backend folder):
+        python benchmarks/bench_imports.py
+        python benchmarks/bench_imports.py --repeat 10 --budget-ms 150     # exits with status 1 if over budget
+
+    Importing a module must not load the models, TensorFlow, or anything else only needed to serve moves:
+    the models are loaded by web_ensemble_solver.engine() on first use, or by the startup warm-up.  Each
+    import is timed after Django is set up, and reports the slowest modules it imported (python -X importtime). """
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = ['webapp.chess_tools_local', 'webapp.ensemble_decision', 'webapp.openings',
+           'webapp.web_ensemble_solver', 'webapp.views', 'django_wrapper.urls']
+
+# Run in a fresh interpreter: sets up Django, then times one import
+TIMER = '''
+import json, os, sys, time
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'django_wrapper.settings')
+os.environ.setdefault('DJANGO_SECRET_KEY', 'benchmark')
+import django
+django.setup()
+print('timed import', file=sys.stderr, flush=True)
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+from webapp import web_ensemble_solver as es
+print(json.dumps({{'seconds': seconds, 'tensorflow': 'tensorflow' in sys.modules, 'engine_loaded': es.registry.current is not None}}))
+'''
+
+
+def time_import(module):
+    """ imports a module in a fresh interpreter, returns (result dict, [(microseconds, imported module)]) """
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', TIMER.format(module=module)],
+                             cwd=BACKEND_DIR, capture_output=True, text=True, check=True)
+    slowest = []
+    timed_lines = process.stderr.split('timed import\n', 1)[-1]
+    for line in timed_lines.splitlines():
+        fields = line.removeprefix('import time:').split('|')
+        if len(fields) == 3 and fields[0].strip().isdigit():
+            slowest.append((int(fields[0]), fields[2].strip()))
+
+    return json.loads(process.stdout.strip().splitlines()[-1]), sorted(slowest, reverse=True)[:5]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5, help='fresh interpreters for each module')
+    parser.add_argument('--budget-ms', type=float, help='fail if any median import time is longer')
+    parser.add_argument('modules', nargs='*', default=MODULES)
+    args = parser.parse_args()
+
+    failed = False
+    print(f'{"module":<32}{"median ms":>10}{"min ms":>10}  slowest imports (self time)')
+    for module in args.modules:
+        runs = [time_import(module) for _ in range(args.repeat)]
+        times = np.array([result['seconds'] for result, _ in runs]) * 1000
+        slowest = ', '.join(f'{name} {us / 1000:.1f}ms' for us, name in runs[-1][1][:3])
+        print(f'{module:<32}{np.median(times):>10.1f}{times.min():>10.1f}  {slowest}')
+
+        if any(result['tensorflow'] or result['engine_loaded'] for result, _ in runs):
+            print(f'  {module} loaded the models on import')
+            failed = True
+        if args.budget_ms is not None and np.median(times) > args.budget_ms:
+            print(f'  {module} is over the {args.budget_ms:.0f}ms budget')
+            failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+""" Load test of a running server: simulated players each keep a session and play whole games through /play/.
+
+    usage (from the backend folder), against a server started as in production, eg.
+        docker compose up    or    gunicorn --config gunicorn.conf.py --bind :8000 django_wrapper.wsgi:application
+        python benchmarks/bench_load.py --url http://localhost:8000 --players 16 --seconds 60
+        python benchmarks/bench_load.py --host ec2-18-169-205-217.eu-west-2.compute.amazonaws.com     # an ALLOWED_HOSTS name
+        python benchmarks/bench_load.py --url http://localhost:8000 --players 64 --ramp 30 --output load.json
+
+    Each player opens the page, chooses one of the opening options at random, then plays random legal moves
+    chosen with python-chess until the computer is checkmated, the player has no legal move, or --max-moves,
+    and starts another game.  Like a browser, it fetches each board image it is shown, unless --no-images.
+    The board is read from each page (the image's key, or the FEN in the 'client' render mode), and the
+    computer's reply is played on the player's own board, so castling rights are kept as on the server.
+
+    Reports requests, error rate, throughput and p50/p95/p99 latency for each endpoint, and how the games
+    ended.  Rejected moves (error pages) count as errors, as they mean the server and player disagree. """
+
+import argparse
+import base64
+import http.cookiejar
+import json
+import os
+import re
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+from webapp import chess_tools_local as ct
+from webapp.game_state import Game
+from webapp.move_cache import key_to_board
+
+OPENING_OPTIONS = ['option1', 'option2', 'option3', 'option4', 'option5']
+REJECTED_PAGES = ('Invalid input!', 'Illegal move detected!')
+
+
+class Stats:
+    """ latencies and errors of every request, by endpoint, and how each game ended """
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.outcomes = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, seconds, error=None):
+        with self._lock:
+            self.latencies.setdefault(endpoint, []).append(seconds)
+            if error is not None:
+                self.errors.setdefault(endpoint, {}).setdefault(error, 0)
+                self.errors[endpoint][error] += 1
+
+    def game_over(self, outcome):
+        with self._lock:
+            self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+
+    def summary(self, seconds):
+        """ {endpoint: {requests, errors, error_rate, per_second, p50_ms, p95_ms, p99_ms, error kinds}} """
+        results = {}
+        for endpoint, latencies in self.latencies.items():
+            errors = self.errors.get(endpoint, {})
+            p50, p95, p99 = np.percentile(np.array(latencies) * 1000, [50, 95, 99])
+            results[endpoint] = {'requests': len(latencies), 'errors': sum(errors.values()),
+                                 'error_rate': sum(errors.values()) / len(latencies), 'per_second': len(latencies) / seconds,
+                                 'p50_ms': float(p50), 'p95_ms': float(p95), 'p99_ms': float(p99), 'error_kinds': errors}
+
+        return results
+
+
+def board_placement(page):
+    """ the FEN piece placement of the board shown on a page, or None """
+    match = re.search(r'data-fen="([^"]+)"', page)
+    if match:
+        return match.group(1)
+    match = re.search(r'/board/\w+/([\w-]+)\.(?:png|svg)', page)
+    if match:
+        return ct.one_hot_to_fen(key_to_board(base64.urlsafe_b64decode(match.group(1) + '='))).split(' ')[0]
+
+    return None
+
+
+class Player:
+    """ a browser session playing whole games: keeps cookies, and sends the CSRF token with each form """
+
+    def __init__(self, url, stats, seed, fetch_images=True, host=None):
+        self.url = url.rstrip('/')
+        self.host = host
+        self.stats = stats
+        self.rng = np.random.default_rng(seed)
+        self.fetch_images = fetch_images
+        self.cookies = http.cookiejar.CookieJar()
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(self.cookies))
+
+    def request(self, endpoint, path, form=None):
+        """ sends a request, recording its latency under endpoint.  Returns the page, or None after an error """
+        data, headers = None, {'Host': self.host} if self.host else {}
+        if form is not None:
+            token = next((cookie.value for cookie in self.cookies if cookie.name == 'csrftoken'), '')
+            data = urllib.parse.urlencode(dict(form, csrfmiddlewaretoken=token)).encode()
+            headers['Referer'] = self.url + path
+        start = time.perf_counter()
+        try:
+            with self.opener.open(urllib.request.Request(self.url + path, data=data, headers=headers), timeout=300) as response:
+                page = response.read().decode(errors='replace')
+        except urllib.error.HTTPError as error:
+            self.stats.record(endpoint, time.perf_counter() - start, f'HTTP {error.code}')
+            return None
+        except (urllib.error.URLError, OSError) as error:
+            self.stats.record(endpoint, time.perf_counter() - start, type(getattr(error, 'reason', error)).__name__)
+            return None
+        seconds = time.perf_counter() - start
+        if page.startswith(REJECTED_PAGES):
+            self.stats.record(endpoint, seconds, 'rejected move')
+            return None
+        self.stats.record(endpoint, seconds)
+
+        return page
+
+    def show_board(self, page):
+        """ fetches the board image on a page, as a browser would """
+        match = re.search(r'src="(/board/\w+/[\w-]+\.(?:png|svg))"', page)
+        if self.fetch_images and match:
+            self.request('GET /board/', match.group(1))
+
+    def play_game(self, max_moves, deadline):
+        """ plays one game from a random opening, returns how it ended """
+        if self.request('GET /play/', '/play/') is None:
+            return 'error'
+        page = self.request('POST /play/ opening', '/play/', {self.rng.choice(OPENING_OPTIONS): 'Go'})
+        if page is None:
+            return 'error'
+        self.show_board(page)
+        game = Game.from_fen(board_placement(page) + ' w KQkq - 0 1')    # as the session's FEN
+
+        for _ in range(max_moves):
+            if time.perf_counter() > deadline:
+                return 'stopped'
+            moves = game.legal_moves()
+            if not moves:
+                return 'player has no moves'
+            move = moves[self.rng.integers(len(moves))]
+            page = self.request('POST /play/ move', '/play/', {'human_move': move.uci()})
+            if page is None:
+                return 'error'
+            if page.startswith('Checkmate!'):
+                return 'checkmate'
+            self.show_board(page)
+
+            # Play the computer's reply, or follow the page if the boards disagree, eg. after en passant
+            game.push(move)
+            reply = re.search(r'my move: (\w+)', page)
+            reply = game.find_move(reply.group(1)) if reply else None
+            if reply is not None:
+                game.push(reply)
+            placement = board_placement(page)
+            if reply is None or game.placement() != placement:
+                castling_rights = game.board.castling_rights
+                game = Game.from_fen(placement + ' w KQkq - 0 1')
+                game.board.castling_rights &= castling_rights    # keep only the rights not yet lost
+
+        return 'max moves'
+
+
+def run(url, players, seconds, ramp, max_moves, fetch_images, host=None):
+    """ runs the players against a server until the time is up, returns their Stats """
+    stats = Stats()
+    deadline = time.perf_counter() + seconds
+
+    def play(i):
+        time.sleep(ramp * i / players)
+        player = Player(url, stats, seed=i, fetch_images=fetch_images, host=host)
+        while time.perf_counter() < deadline:
+            outcome = player.play_game(max_moves, deadline)
+            stats.game_over(outcome)
+            if outcome == 'error':
+                player = Player(url, stats, seed=i + players, fetch_images=fetch_images, host=host)    # a new session
+
+    threads = [threading.Thread(target=play, args=(i,), daemon=True) for i in range(players)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://localhost:8000', help='server to test')
+    parser.add_argument('--host', help="Host header to send, if the url's host is not in ALLOWED_HOSTS")
+    parser.add_argument('--players', type=int, default=8, help='concurrent players, each with its own session')
+    parser.add_argument('--seconds', type=float, default=30, help='how long to play for')
+    parser.add_argument('--ramp', type=float, default=0, help='seconds over which players join')
+    parser.add_argument('--max-moves', type=int, default=100, help="moves before a game is abandoned")
+    parser.add_argument('--no-images', action='store_true', help='do not fetch board images')
+    parser.add_argument('--output', help='JSON file to write')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    stats = run(args.url, args.players, args.seconds, args.ramp, args.max_moves, not args.no_images, args.host)
+    elapsed = time.perf_counter() - start
+    summary = stats.summary(elapsed)
+
+    print(f'{args.url}  ({args.players} players, {elapsed:.0f}s)')
+    print(f'{"endpoint":<22}{"requests":>9}{"errors":>8}{"error %":>9}{"req/s":>8}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}')
+    for endpoint, result in sorted(summary.items()):
+        print(f'{endpoint:<22}{result["requests"]:>9}{result["errors"]:>8}{result["error_rate"]:>9.2%}{result["per_second"]:>8.1f}'
+              f'{result["p50_ms"]:>9.1f}{result["p95_ms"]:>9.1f}{result["p99_ms"]:>9.1f}')
+        for kind, count in sorted(result['error_kinds'].items()):
+            print(f'  {kind}: {count}')
+    print('games: ' + ', '.join(f'{outcome} {count}' for outcome, count in sorted(stats.outcomes.items())))
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({'url': args.url, 'players': args.players, 'seconds': elapsed, 'endpoints': summary,
+                       'games': stats.outcomes}, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
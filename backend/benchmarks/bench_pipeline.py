@@ -0,0 +1,230 @@
+""" Times each stage of the move pipeline on a fixed corpus of opening, middlegame and endgame positions.
+
+    usage (from the backend folder):
+        python benchmarks/bench_pipeline.py --output pipeline.json
+        python benchmarks/bench_pipeline.py --synthetic --output pipeline.json      # numpy stand-in, no TensorFlow
+        python benchmarks/bench_pipeline.py --synthetic --compare pipeline.json      # ratios against an earlier run
+
+    Stages are timed separately for every position in benchmarks/corpus.json (standard FENs, converted
+    to the app's orientation), then the whole /play/ request is timed through the Django test client.
+    The move cache and position book are disabled unless --with-cache is given, so every call does
+    the full work.  Results are written as JSON: the median, mean, p95 and minimum of each stage, overall
+    and for each phase of the game, with the commit and library versions they were measured on. """
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCHMARK_DIR)
+sys.path.insert(0, BACKEND_DIR)
+from webapp import chess_tools_local as ct
+from webapp.ensemble_decision import decide
+from webapp.game_state import Game
+from webapp.model_server import ModelServer
+from bench_batching import synthetic_predictor
+
+CORPUS_PATH = os.path.join(BENCHMARK_DIR, 'corpus.json')
+
+
+class SyntheticBackend:
+    """ numpy stand-in for the ensemble, served to the app through the model server """
+    name = 'synthetic'
+
+    def __init__(self, n_models=3):
+        self.member_names = [f'synthetic_{i + 1}' for i in range(n_models)]
+        self.model_set = (self.name, tuple(self.member_names))
+        self.members = [synthetic_predictor(n_models=1, seed=i) for i in range(n_models)]
+
+    def predict_batch(self, boards):
+        return np.concatenate([member(boards) for member in self.members])
+
+
+def load_app(synthetic, with_cache):
+    """ sets up Django with the chosen models, returns (web_ensemble_solver, views, test client, member predictors) """
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'django_wrapper.settings')
+    os.environ.setdefault('DJANGO_SECRET_KEY', 'benchmark')
+    if not with_cache:
+        os.environ['CHESSNN_MOVE_CACHE_SIZE'] = '0'
+        os.environ['CHESSNN_POSITION_BOOK'] = 'none'
+    if synthetic:
+        backend = SyntheticBackend()
+        socket_path = os.path.join(tempfile.mkdtemp(), 'models.sock')
+        server = ModelServer(socket_path, backend)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        os.environ['CHESSNN_INFERENCE_BACKEND'] = 'remote'
+        os.environ['CHESSNN_MODEL_SOCKET'] = socket_path
+
+    import django
+    from django.test import Client
+    from django.test.utils import setup_test_environment
+    django.setup()
+    setup_test_environment()
+    from webapp import views
+    from webapp import web_ensemble_solver as es
+
+    members = dict(zip(backend.member_names, backend.members)) if synthetic else member_predictors(es.engine().backend)
+
+    return es, views, Client(), members
+
+
+def member_predictors(backend):
+    """ returns {name: predict function} for each member the backend can run on its own """
+    if backend.name == 'keras':
+        return {name: (lambda boards, member=member: np.asarray(member(boards.astype('float32'), training=False)))
+                for name, member in zip(backend.member_names, backend.members)}
+    if backend.name == 'tflite':
+        def invoke(boards, interpreter):
+            interpreter.set_tensor(interpreter.get_input_details()[0]['index'], boards.astype('float32'))
+            interpreter.invoke()
+            return interpreter.get_tensor(interpreter.get_output_details()[0]['index'])
+        backend.predict_batch(np.zeros((1,64,13), dtype='float32'))    # interpreters sized for one board
+        return {name: (lambda boards, interpreter=interpreter: invoke(boards, interpreter))
+                for name, interpreter in zip(backend.member_names, backend.interpreters)}
+
+    return {}    # the remote backend's members run in the model server
+
+
+def human_move(fen):
+    """ the first legal human move from an app FEN with the human to move, as play.html holds it, in a
+        format play.html accepts.  Moves are found as the view finds them """
+    moves = Game.from_fen(fen).legal_moves()
+
+    return moves[0].uci() if moves else None
+
+
+def time_call(function, repeat):
+    """ calls function() `repeat` times, returns the time of each call in ms """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append((time.perf_counter() - start) * 1000)
+
+    return times
+
+
+def summarise(samples):
+    """ summary statistics of a list of times in ms """
+    samples = np.asarray(samples)
+
+    return {'n': len(samples), 'median_ms': float(np.median(samples)), 'mean_ms': float(samples.mean()),
+            'p95_ms': float(np.percentile(samples, 95)), 'min_ms': float(samples.min())}
+
+
+def run(es, views, client, members, repeat):
+    """ times every stage for every corpus position, returns {stage: {phase: [times in ms]}} """
+    from django.conf import settings
+
+    with open(CORPUS_PATH) as file:
+        corpus = json.load(file)
+    timings = {}
+
+    def record(stage, phase, times):
+        timings.setdefault(stage, {}).setdefault(phase, []).extend(times)
+
+    for phase, fens in corpus.items():
+        for fen in fens:
+            app_fen, mirrored = ct.standard_fen_to_app(fen)
+            board = ct.fen_to_one_hot(app_fen)[None]
+            record('fen_to_ascii+one_hot_encode', phase, time_call(lambda: ct.one_hot_encode(ct.fen_to_ascii(app_fen)), repeat))
+            record('fen_to_one_hot', phase, time_call(lambda: ct.fen_to_one_hot(app_fen), repeat))
+            record('find_legal_moves', phase, time_call(lambda: ct.find_legal_moves(app_fen), repeat))
+            candidates, moves = ct.find_legal_moves(app_fen)
+
+            es.predict_batch(board)
+            record('inference_ensemble', phase, time_call(lambda: es.predict_batch(board), repeat))
+            for name, predict in members.items():
+                record(f'inference_{name}', phase, time_call(lambda: predict(board), repeat))
+            predictions = es.predict_batch(board)[:, 0]
+            record('decide', phase, time_call(lambda: decide(predictions, candidates, moves), repeat))
+            record('ensemble_solver', phase, time_call(lambda: es.ensemble_solver(board), repeat))
+
+            record('one_hot_to_png', phase, time_call(lambda: ct.one_hot_to_png(board), repeat))
+            image = ct.one_hot_to_png(board)
+            record('image_to_base64', phase, time_call(lambda: views.image_to_base64(image), repeat))
+
+            key = views.onehot_to_url_key(board)
+            def get_board_image():
+                views.board_png.cache_clear()
+                assert client.get(views.board_url(key)).status_code == 200
+            record('board_image_view', phase, time_call(get_board_image, repeat))
+
+            # The whole /play/ request, from the human's move to the rendered page
+            move = human_move(app_fen)
+            if move is None:
+                continue
+            times = []
+            for _ in range(repeat):
+                session = client.session
+                session['session_fen'] = app_fen
+                session.save()
+                client.cookies[settings.SESSION_COOKIE_NAME] = session.session_key
+                times += time_call(lambda: client.post('/play/', {'human_move': move}), 1)
+            record('play_view', phase, times)
+
+    return timings
+
+
+def environment(es, synthetic, repeat):
+    """ what the results were measured on """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR,
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    import chess
+    import django
+
+    return {'commit': commit, 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+            'numpy': np.__version__, 'chess': chess.__version__, 'django': django.__version__,
+            'machine': platform.machine(), 'cpus': os.cpu_count(), 'backend': es.engine().backend.name,
+            'synthetic': synthetic, 'repeat': repeat}
+
+
+def compare(results, baseline):
+    """ prints each stage's median against an earlier run's """
+    print(f'\n{"stage":<32}{"baseline ms":>14}{"now ms":>10}{"ratio":>8}')
+    for stage, summary in results['stages'].items():
+        if stage in baseline['stages']:
+            before = baseline['stages'][stage]['all']['median_ms']
+            now = summary['all']['median_ms']
+            print(f'{stage:<32}{before:>14.3f}{now:>10.3f}{now / before:>8.2f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5, help='calls of each stage per position')
+    parser.add_argument('--synthetic', action='store_true', help='use a numpy stand-in for the models')
+    parser.add_argument('--with-cache', action='store_true', help='keep the move cache and position book enabled')
+    parser.add_argument('--output', help='JSON file to write')
+    parser.add_argument('--compare', help='JSON file from an earlier run')
+    args = parser.parse_args()
+
+    es, views, client, members = load_app(args.synthetic, args.with_cache)
+    timings = run(es, views, client, members, args.repeat)
+    results = {'environment': environment(es, args.synthetic, args.repeat), 'stages': {}}
+    for stage, phases in timings.items():
+        results['stages'][stage] = {'all': summarise(np.concatenate(list(phases.values())))}
+        results['stages'][stage].update({phase: summarise(times) for phase, times in phases.items()})
+
+    print(f'{"stage":<32}{"median ms":>10}{"p95 ms":>10}')
+    for stage, summary in results['stages'].items():
+        print(f'{stage:<32}{summary["all"]["median_ms"]:>10.3f}{summary["all"]["p95_ms"]:>10.3f}')
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+    if args.compare:
+        with open(args.compare) as file:
+            compare(results, json.load(file))
+
+
+if __name__ == '__main__':
+    main()
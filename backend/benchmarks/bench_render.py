@@ -0,0 +1,113 @@
+""" Compares the sprite-atlas board renderer with the original per-request PIL drawing, then the CPU time
+    and response size of each board render mode (settings.BOARD_RENDER) on the benchmark corpus.
+
+    usage (from the backend folder):
+        python benchmarks/bench_render.py --boards 200 """
+
+import argparse
+import base64
+import gzip
+import json
+import os
+import re
+import sys
+import time
+from io import BytesIO
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+from webapp import chess_tools_local as ct
+
+
+def original_one_hot_to_png(array):
+    """ the original renderer: draws every square with PIL, reloading the font for each one """
+    board = [ct.PNG_SYMBOLS[piece] for piece in np.argmax(np.asarray(array).reshape(64,13), axis=-1)]
+    pil_image = Image.fromarray(np.full((338, 340, 3), fill_value=255, dtype=np.uint8))
+    draw = ImageDraw.Draw(pil_image)
+    draw.rectangle((9, 8, 329, 329), fill=(245, 245, 245), outline=(225, 225, 225))
+    for i in range(0, 8, 1):
+        for j in range(0, 8, 1):
+            if (i % 2 == 0 and j % 2 == 1) or (i % 2 == 1 and j % 2 == 0):
+                draw.rectangle((j*40+9, i*40+8, (j*40)+40+9, (i*40)+40+8), fill=(225, 225, 225), outline=(225, 225, 225))
+    index = 0
+    for i in range(0, 320, 40):
+        for j in range(10, 330, 40):
+            draw.text((j, i), board[index], fill=(0,0,0,255), align='center', font=ImageFont.truetype(ct.PIECES_FONT, 50))
+            index = index + 1
+
+    return pil_image
+
+
+def time_renderer(render, boards):
+    start = time.perf_counter()
+    images = [render(board) for board in boards]
+
+    return (time.perf_counter() - start) / len(boards) * 1000, images
+
+
+def png_bytes(board):
+    """ the 'png' mode: rasterises the board and compresses it, as views.board_png() """
+    buffer = BytesIO()
+    ct.one_hot_to_png(board).save(buffer, format='PNG')
+
+    return buffer.getvalue()
+
+
+def client_script_size():
+    """ bytes of the drawing script play.html includes in the 'client' mode """
+    with open(os.path.join(BACKEND_DIR, 'webapp', 'templates', 'play.html')) as file:
+        script = re.search(r'<script>.*?</script>', file.read(), re.S).group()
+
+    return len(script.encode())
+
+
+def compare_render_modes(repeat):
+    """ prints the CPU time and size of each render mode's output for the corpus positions """
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus.json')) as file:
+        fens = [fen for phase in json.load(file).values() for fen in phase]
+    boards = [ct.fen_to_one_hot(ct.standard_fen_to_app(fen)[0]) for fen in fens]
+    modes = {'png': png_bytes,
+             'png (base64)': lambda board: base64.b64encode(png_bytes(board)),
+             'svg': lambda board: ct.one_hot_to_svg(board).encode(),
+             'client (FEN)': lambda board: ct.one_hot_to_fen(board).split(' ')[0].encode()}
+
+    print(f'\n{len(boards)} corpus positions')
+    print(f'{"render mode":<16}{"cpu ms/board":>14}{"bytes":>8}{"gzip bytes":>12}')
+    for mode, render in modes.items():
+        start = time.process_time()
+        for _ in range(repeat):
+            outputs = [render(board) for board in boards]
+        cpu_ms = (time.process_time() - start) / (repeat * len(boards)) * 1000
+        size = np.mean([len(output) for output in outputs])
+        gzip_size = np.mean([len(gzip.compress(output)) for output in outputs])
+        print(f'{mode:<16}{cpu_ms:>14.3f}{size:>8.0f}{gzip_size:>12.0f}')
+    print(f'the client mode adds a {client_script_size()} byte script to each page')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--boards', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=20, help='renders of each corpus position for each render mode')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    boards = [np.eye(13, dtype=bool)[rng.integers(0, 13, size=64)] for _ in range(args.boards)]
+    start = time.perf_counter()
+    ct.board_sprites()
+    print(f'sprite atlas built in {(time.perf_counter() - start) * 1000:.1f} ms')
+
+    pil_ms, pil_images = time_renderer(original_one_hot_to_png, boards)
+    sprite_ms, sprite_images = time_renderer(ct.one_hot_to_png, boards)
+    identical = all(np.array_equal(np.array(a), np.array(b)) for a, b in zip(pil_images, sprite_images))
+
+    print(f'PIL drawing:   {pil_ms:8.3f} ms/board')
+    print(f'sprite atlas:  {sprite_ms:8.3f} ms/board  ({pil_ms / sprite_ms:.0f}x faster)')
+    print(f'pixel-identical: {identical}')
+
+    compare_render_modes(args.repeat)
+
+
+if __name__ == '__main__':
+    main()
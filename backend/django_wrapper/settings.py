@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 
 import os
 from pathlib import Path
+from django.core.exceptions import ImproperlyConfigured
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -48,8 +49,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'webapp.metrics.MetricsMiddleware',
+    'webapp.health.HealthCheckMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
+    'webapp.metrics.TimedSessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -137,8 +140,73 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # SESSION_ENGINE = 'django.contrib.sessions.backends.cache'
 # SESSION_CACHE_ALIAS = 'default'
 
-# Force session data to refresh after each POST
-SESSION_SAVE_EVERY_REQUEST = True
+# Where each player's game is kept:
+#   'signed_cookies'  in the browser, as a compressed token signed with SECRET_KEY, so moves need no database I/O
+#   'memory'          in a bounded in-process store, only for a single worker process, eg. the ASGI server
+#   'db'              in db.sqlite3, written on every move
+SESSION_STORE = os.environ.get('CHESSNN_SESSION_STORE', 'signed_cookies')
+if SESSION_STORE == 'signed_cookies':
+    SESSION_ENGINE = 'django.contrib.sessions.backends.signed_cookies'
+elif SESSION_STORE == 'memory':
+    SESSION_ENGINE = 'django.contrib.sessions.backends.cache'
+    SESSION_CACHE_ALIAS = 'sessions'
+    CACHES = {
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        'sessions': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'sessions',
+            'TIMEOUT': 60 * 60 * 24 * 14,
+            'OPTIONS': {'MAX_ENTRIES': int(os.environ.get('CHESSNN_SESSION_MAX_ENTRIES', 10000))},
+        },
+    }
+elif SESSION_STORE != 'db':
+    raise ImproperlyConfigured(f"CHESSNN_SESSION_STORE must be 'signed_cookies', 'memory' or 'db', not '{SESSION_STORE}'")
+
+# Sessions are saved when a game starts or a move is played, not on every request
+SESSION_SAVE_EVERY_REQUEST = False
+
+# number of games in progress whose python-chess board each worker keeps between moves, 0 rebuilds it
+# from the session on every move
+GAME_CACHE_SIZE = int(os.environ.get('CHESSNN_GAME_CACHE_SIZE', 1000))
+
+
+# Ensemble inference
+# 'keras' runs the SavedModels with TensorFlow, 'tflite' runs models converted by 'manage.py convert_models',
+# 'remote' sends boards to the process started by 'manage.py run_model_server' on MODEL_SERVER_SOCKET
+INFERENCE_BACKEND = os.environ.get('CHESSNN_INFERENCE_BACKEND', 'keras')
+INFERENCE_QUANTIZATION = os.environ.get('CHESSNN_QUANTIZATION', 'float16')     # 'none', 'float16' or 'int8'
+MODEL_SERVER_SOCKET = os.environ.get('CHESSNN_MODEL_SOCKET', '/tmp/chessnn-models.sock')
+
+# ensemble members and where to find them, see model_registry.py.  Changes to the file are checked for
+# every few seconds, and the new models are loaded in the background, then replace the old ones
+MODEL_REGISTRY_PATH = os.environ.get('CHESSNN_MODEL_REGISTRY', os.path.join(BASE_DIR, 'webapp', 'ml_models', 'registry.json'))
+MODEL_REGISTRY_CHECK_SECONDS = float(os.environ.get('CHESSNN_MODEL_REGISTRY_CHECK_SECONDS', 5))
+
+# boards posted by concurrent requests are evaluated together if they arrive within the batch window,
+# needs a threaded worker, eg. GUNICORN_CMD_ARGS="--threads 8".  A window of 0 disables batching
+INFERENCE_BATCH_WINDOW_MS = float(os.environ.get('CHESSNN_BATCH_WINDOW_MS', 0))
+INFERENCE_MAX_BATCH = int(os.environ.get('CHESSNN_MAX_BATCH', 32))
+
+# evaluate members one at a time, in ADAPTIVE_ORDER (names, the rest follow), and stop once the move is
+# decided whatever the others predict, or once ADAPTIVE_AGREEMENT members predicted the same legal move
+# (0 disables that heuristic).  Needs the keras or tflite backend, and bypasses the batch window
+ADAPTIVE_ENSEMBLE = os.environ.get('CHESSNN_ADAPTIVE_ENSEMBLE', '0') == '1'
+ADAPTIVE_ORDER = [name for name in os.environ.get('CHESSNN_ADAPTIVE_ORDER', '').split(',') if name]
+ADAPTIVE_AGREEMENT = int(os.environ.get('CHESSNN_ADAPTIVE_AGREEMENT', 0))
+
+# number of boards whose chosen move is remembered by each worker, 0 disables the cache
+MOVE_CACHE_SIZE = int(os.environ.get('CHESSNN_MOVE_CACHE_SIZE', 10000))
+
+# moves precomputed by 'manage.py build_position_book', checked before running the models
+POSITION_BOOK_PATH = os.environ.get('CHESSNN_POSITION_BOOK', os.path.join(BASE_DIR, 'webapp', 'ml_models', 'position_book.bin'))
+
+# How play.html shows the board:
+#   'png'     an image rendered by the server at /board/<version>/<key>.png
+#   'svg'     an image at /board/<version>/<key>.svg, built from each piece's symbol without rasterising
+#   'client'  the FEN, drawn by a script in the page, so the server does no rendering
+BOARD_RENDER = os.environ.get('CHESSNN_BOARD_RENDER', 'png')
+if BOARD_RENDER not in ('png', 'svg', 'client'):
+    raise ImproperlyConfigured(f"CHESSNN_BOARD_RENDER must be 'png', 'svg' or 'client', not '{BOARD_RENDER}'")
 
 
 # Static files (CSS, JavaScript, Images)
@@ -154,3 +222,16 @@ STATIC_ROOT = os.path.join(os.path.dirname(os.path.dirname(BASE_DIR)), 'static')
 
 # same for media files, it must match /services/djangoapp/media/
 MEDIA_ROOT = os.path.join(os.path.dirname(os.path.dirname(BASE_DIR)), 'media')
+
+# positions accepted by each /api/analyse request, and solved together in each model call
+ANALYSIS_MAX_POSITIONS = int(os.environ.get('CHESSNN_ANALYSIS_MAX_POSITIONS', 10000))
+ANALYSIS_BATCH_SIZE = int(os.environ.get('CHESSNN_ANALYSIS_BATCH_SIZE', 256))
+
+# serve the async views, set by asgi.py.  Their moves and board images are computed in pools of these sizes
+ASYNC_VIEWS = os.environ.get('CHESSNN_ASYNC_VIEWS', '0') == '1'
+MOVE_WORKER_THREADS = int(os.environ.get('CHESSNN_MOVE_THREADS', 4))
+RENDER_WORKER_THREADS = int(os.environ.get('CHESSNN_RENDER_THREADS', 2))
+
+# each worker's metrics are written to this directory, so /metrics can report every worker's.
+# Only needed with several worker processes, cleared by gunicorn.conf.py when the server starts
+METRICS_DIR = os.environ.get('CHESSNN_METRICS_DIR') or None
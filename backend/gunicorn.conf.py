@@ -0,0 +1,32 @@
+""" gunicorn settings, used by the Docker image:  gunicorn --config backend/gunicorn.conf.py ...
+
+    With the tflite and remote inference backends, the app and models are loaded and warmed up in the
+    master process, then workers are forked and share the model weights copy-on-write.  TensorFlow's
+    thread pools do not survive fork(), so the keras backend is instead loaded and warmed up in each
+    worker, before it accepts requests.  Either way, the first player does not wait for the models. """
+
+import os
+import shutil
+
+preload_app = os.environ.get('CHESSNN_INFERENCE_BACKEND', 'keras') != 'keras'
+
+
+def on_starting(server):
+    """ removes the previous server's metrics, if workers share them through CHESSNN_METRICS_DIR """
+    metrics_dir = os.environ.get('CHESSNN_METRICS_DIR')
+    if metrics_dir:
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+
+
+def when_ready(server):
+    """ runs in the master, before the first worker is forked """
+    if server.cfg.preload_app:
+        from webapp.health import warm_up
+        warm_up()
+        server.log.info('models loaded and warmed up before forking workers')
+
+
+def post_worker_init(worker):
+    """ runs in each worker, before it accepts requests """
+    from webapp.health import warm_up
+    warm_up()
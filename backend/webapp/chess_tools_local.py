@@ -1,24 +1,23 @@
 import numpy as np
-from PIL import Image,ImageDraw, ImageFont
+import functools
 import math
+import os
+import re
 import chess
 
 
+# Lookup tables between piece characters, piece indices and one-hot vectors
+PIECE_CHARS = np.array(list('rnbqkpRNBQKP.'))
+PIECE_INDEX = np.full(128, -1, dtype=np.int8)
+PIECE_INDEX[[ord(char) for char in PIECE_CHARS]] = np.arange(13)
+ONE_HOT = np.eye(13, dtype=bool)
+EXPAND_GAPS = str.maketrans({str(n): '.' * n for n in range(1, 9)} | {'/': None})
+
+
 def fen_to_ascii(FEN):
     """ Converts Forysth-Edwards notation to board with ASCII characters """
-    board = ''
-    for character in FEN:
-        if character.isalpha():
-            board = board + ' ' + character  
-        if character.isnumeric():
-            for n in range(int(character)):
-                board = board + ' ' + '.' 
-        if character == '/':
-            continue
-        if character == ' ':
-            break
-    list = board.split()
-    arr = np.array(list)
+    placement = FEN.split(' ')[0].translate(EXPAND_GAPS)
+    arr = np.array(list(placement))
     arr = arr.reshape(-1, 8)
 
     return arr
@@ -26,31 +25,44 @@ def fen_to_ascii(FEN):
 
 def one_hot_encode(array):
     """ Converts ASCII board to 64x13 one-hot tensor:  array[squares, piece_vectors] """
-    input = array.flatten()
-    one_hot = np.zeros(shape=(64,13), dtype=bool)
-    encoding = {'r':0, 'n':1, 'b':2, 'q':3, 'k':4, 'p':5, 'R':6, 'N':7, 'B':8, 'Q':9, 'K':10, 'P':11, '.':12}
-    for square, char in enumerate(input):
-        one_hot[square][encoding[char]] = 1 
+    codes = np.asarray(array).astype('S1').view(np.uint8).ravel()
+    indices = PIECE_INDEX[codes]
+    if np.any(indices < 0):
+        raise KeyError(f'unknown piece in board: {array}')
 
-    return one_hot
+    return ONE_HOT[indices]
 
 
 def one_hot_decode(array):
     """ Converts one-hot array to board with ASCII characters """
-    decoding = {0:'r', 1:'n', 2:'b', 3:'q', 4:'k', 5:'p', 6:'R', 7:'N', 8:'B', 9:'Q', 10:'K', 11:'P', 12:'.'}
-    board = ''
-    arr1 = array.reshape(64,13)
-    for square in arr1:
-        index = np.argmax(square)
-        piece = decoding[index]
-        board = board + str(piece) + ' '
-    list = board.split()
-    arr2 = np.array(list)
+    arr2 = PIECE_CHARS[np.argmax(np.asarray(array).reshape(64,13), axis=-1)]
     arr2 = arr2.reshape(-1, 8)
 
     return arr2
 
 
+def fen_to_one_hot(FEN):
+    """ Converts Forysth-Edwards notation directly to 64x13 one-hot tensor """
+    placement = FEN.split(' ')[0].translate(EXPAND_GAPS).encode()
+    indices = PIECE_INDEX[np.frombuffer(placement, dtype=np.uint8)]
+    if len(indices) != 64 or np.any(indices < 0):
+        raise ValueError(f'invalid FEN: {FEN}')
+
+    return ONE_HOT[indices]
+
+
+def board_to_one_hot(board, swap_colours=False):
+    """ Converts python-chess Board to 64x13 one-hot tensor, optionally swapping the colour of every piece """
+    indices = np.full(64, 12, dtype=np.int8)
+    for colour in (chess.WHITE, chess.BLACK):
+        for piece_type in chess.PIECE_TYPES:
+            symbol = chess.Piece(piece_type, colour != swap_colours).symbol()
+            squares = np.unpackbits(np.array([board.pieces_mask(piece_type, colour)], dtype='<u8').view(np.uint8), bitorder='little')
+            indices[squares.reshape(8,8)[::-1].ravel() == 1] = PIECE_INDEX[ord(symbol)]    # tensor starts from 8th rank
+
+    return ONE_HOT[indices]
+
+
 def one_hot_to_unicode(array):
     """ Converts one-hot array to board with unicode chess piece symbols """
     decoding = {0:' \u2656', 1:' \u2658', 2:' \u2657', 3:' \u2655', 4:' \u2654', 5:' \u2659', 6:' \u265C', 7:' \u265E', 8:' \u265D', 9:' \u265B', 10:' \u265A', 11:' \u265F', 12:' .'}
@@ -68,25 +80,9 @@ def one_hot_to_unicode(array):
 
 def one_hot_to_fen(array, turn='black'):
     """ converts one-hot array to Forsyth-Edwards Notation string """
-    board = one_hot_decode(array).flatten()
-    FEN = []
-    gap_count = 1
-
-    for index, piece in enumerate(board):
-        if piece != '.':
-            FEN.append(str(piece))
-            gap_count = 1
-        if piece == '.':
-            if gap_count > 1:
-                del FEN[-1]
-            FEN.append(gap_count)
-            gap_count += 1
-        if (index+1) % 8 == 0 and index != 63 and index != 0:
-            FEN.append('/')
-            gap_count = 1
-
-    string = ' '.join([str(elem) for elem in FEN])
-    string = string.replace(' ', '')
+    ranks = [''.join(rank) for rank in one_hot_decode(array)]
+    string = '/'.join(ranks)
+    string = re.sub(r'\.+', lambda gap: str(len(gap.group())), string)
     if turn == 'black':
         string = string + ' b KQkq - 0 1'
     if turn == 'white':
@@ -94,15 +90,15 @@ def one_hot_to_fen(array, turn='black'):
     return string
 
 
-def one_hot_to_png(array):
-    """ Converts one-hot array to graphic output """
-    decoding = {0:'\u265C', 1:'\u265E', 2:'\u265D', 3:'\u265B', 4:'\u265A', 5:'\u265F', 6:'\u2656', 7:'\u2658', 8:'\u2657', 9:'\u2655', 10:'\u2654', 11:'\u2659', 12:' '}
-    board = []
-    arr1 = array.reshape(64,13)
-    for i, square in enumerate(arr1):
-        index = np.argmax(square)
-        piece = decoding[index]
-        board.append(piece)
+PIECES_FONT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pieces_font', 'FreeSerif.ttf')
+PNG_SYMBOLS = ['\u265C', '\u265E', '\u265D', '\u265B', '\u265A', '\u265F', '\u2656', '\u2658', '\u2657', '\u2655', '\u2654', '\u2659', ' ']
+DARK_SQUARES = np.indices((8,8)).sum(axis=0) % 2
+
+
+def draw_board(symbols):
+    """ Draws a board image with PIL, given a list of the 64 unicode symbols to place on the squares """
+    from PIL import Image, ImageDraw, ImageFont
+    font = ImageFont.truetype(PIECES_FONT, 50)
 
     # Create image file
     image = np.full((338, 340, 3),fill_value=255, dtype=np.uint8)
@@ -122,13 +118,62 @@ def one_hot_to_png(array):
     index = 0
     for i in range(0, 320, 40):
         for j in range(10, 330, 40):
-            piece = board[index]
-            draw.text((j, i), piece, fill=(0,0,0,255), align='center', font=ImageFont.truetype('/services/backend/webapp/pieces_font/FreeSerif.ttf', 50))
+            piece = symbols[index]
+            draw.text((j, i), piece, fill=(0,0,0,255), align='center', font=font)
             index = index + 1
 
     return pil_image
 
 
+@functools.lru_cache(maxsize=None)
+def board_sprites():
+    """ Renders each piece once on a light and a dark square.  Returns the empty board image, and 
+        the 40x40 pixel tile around each square for every piece index and square colour [13, 2, 40, 40, 3].
+        Glyphs never extend beyond these tiles, so a board can be assembled from them """
+    background = np.array(draw_board([' '] * 64))
+    tiles = np.empty((13, 2, 40, 40, 3), dtype=np.uint8)
+    for index, symbol in enumerate(PNG_SYMBOLS):
+        image = np.array(draw_board([symbol, symbol] + [' '] * 62))
+        tiles[index, 0] = image[8:48, 10:50]     # a8 is a light square
+        tiles[index, 1] = image[8:48, 50:90]     # b8 is a dark square
+    background.setflags(write=False)
+    tiles.setflags(write=False)
+
+    return background, tiles
+
+
+def one_hot_to_png(array):
+    """ Converts one-hot array to graphic output, by copying pre-rendered tiles into the board image """
+    from PIL import Image
+    background, tiles = board_sprites()
+    pieces = np.argmax(np.asarray(array).reshape(8,8,13), axis=-1)
+    image = background.copy()
+    image[8:328, 10:330] = tiles[pieces, DARK_SQUARES].transpose(0,2,1,3,4).reshape(320,320,3)
+
+    return Image.fromarray(image)
+
+
+# SVG boards define each piece's symbol once, then place it on its squares.  The squares and symbols
+# follow one_hot_to_png(), and play.html draws the same board from a FEN in the 'client' render mode
+SVG_HEADER = ('<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 320 320" width="375" height="375">'
+              '<defs><pattern id="d" width="80" height="80" patternUnits="userSpaceOnUse">'
+              '<rect x="40" width="40" height="40" fill="#e1e1e1"/><rect y="40" width="40" height="40" fill="#e1e1e1"/>'
+              '</pattern>'
+              + ''.join(f'<text id="p{index}" x="20" y="20">{symbol}</text>' for index, symbol in enumerate(PNG_SYMBOLS[:12]))
+              + '</defs><rect width="320" height="320" fill="#f5f5f5"/><rect width="320" height="320" fill="url(#d)"/>'
+              '<g font-family="FreeSerif,serif" font-size="36" text-anchor="middle" dominant-baseline="central">')
+SVG_FOOTER = '</g></svg>'
+
+
+def one_hot_to_svg(array):
+    """ Converts one-hot array to an SVG image, with a reference to its piece's symbol on each occupied square """
+    pieces = np.argmax(np.asarray(array).reshape(64,13), axis=-1)
+    squares = np.flatnonzero(pieces != 12)
+    uses = ''.join(f'<use href="#p{pieces[square]}" x="{square % 8 * 40}" y="{square // 8 * 40}"/>' for square in squares)
+
+    return SVG_HEADER + uses + SVG_FOOTER
+
+
 def index_to_algebraic(square):
     """ Converts square index number (0-63) to algebraic notation (a8-h1) """
     letter = 'abcdefgh'
@@ -176,98 +221,116 @@ def confidence_score(y_array, exp=False):
     return total
 
 
-def update_one_hot(tensor, alg_move):
-    """ Updates one-hot array with an algebraic notation move """
-    board = one_hot_decode(tensor)
-    move = str(alg_move).lower()
+# Castling moves, as (move, square index, piece index) of the king before moving, and the (square index, piece index) changes 
+CASTLING = {('d1a1', 59, 4):  [(56, 12), (57, 4), (58, 0), (59, 12)],     # black kingside castling
+            ('d1h1', 59, 4):  [(59, 12), (61, 0), (62, 4), (63, 12)],     # black queenside castling
+            ('d8a8', 3, 10):  [(0, 12), (1, 10), (2, 6), (3, 12)],        # white kingside castling
+            ('d8h8', 3, 10):  [(3, 12), (5, 6), (6, 10), (7, 12)]}        # white queenside castling
+FILES = {'a':0, 'b':1, 'c':2, 'd':3, 'e':4, 'f':5, 'g':6, 'h':7}
+PAWNS = (5, 11)
+
 
-    if move == 'd1a1' and board[7][3] == 'k':
-        # black kingside castling  
-        board[7][0] = '.'
-        board[7][1] = 'k'
-        board[7][2] = 'r'
-        board[7][3] = '.'
-
-    elif move == 'd1h1'and board[7][3] == 'k':
-        # black queenside castling  
-        board[7][3] = '.'
-        board[7][5] = 'r'
-        board[7][6] = 'k'
-        board[7][7] = '.'
-
-    elif move == 'd8a8' and board[0][3] == 'K':
-        # white kingside castling  
-        board[0][0] = '.'
-        board[0][1] = 'K'
-        board[0][2] = 'R'
-        board[0][3] = '.'
-
-    elif move == 'd8h8'and board[0][3] == 'K':
-        # white queenside castling  
-        board[0][3] = '.'
-        board[0][5] = 'R'
-        board[0][6] = 'K'
-        board[0][7] = '.'
-
-    else:   
-        # apply algebraic move  
-        dict = {'a':0, 'b':1, 'c':2, 'd':3, 'e':4, 'f':5, 'g':6, 'h':7}        
-        x_from = dict[move[0]]
-        y_from = 8 - int(move[1])
-        x_to = dict[move[2]]
-        y_to = 8 - int(move[3])
-        piece = board[y_from][x_from]
-        board[y_from][x_from] = '.'
-        board[y_to][x_to] = piece
+def move_changes(pieces, alg_move):
+    """ returns the (square index, piece index) changes made by an algebraic notation move, given the piece index on each square """
+    move = str(alg_move).lower()
+    from_square = (8 - int(move[1])) * 8 + FILES[move[0]]
+    to_square = (8 - int(move[3])) * 8 + FILES[move[2]]
+    castling = CASTLING.get((move[:4], from_square, pieces[from_square]))
+    if castling is not None:
+        return castling
+
+    piece = pieces[from_square]
+    changes = [(from_square, 12)]
+    if piece in PAWNS:
+        # en passant: a pawn taking diagonally onto an empty square takes the pawn beside it
+        if from_square % 8 != to_square % 8 and pieces[to_square] == 12:
+            changes.append((from_square - from_square % 8 + to_square % 8, 12))
 
         # promote any pawns on last rank to queen
-        if piece == 'p' and y_to == 0:
-            board[y_to][x_to] = 'q'
-        if piece == 'P' and y_to == 7:
-            board[y_to][x_to] = 'Q'
+        if piece == 5 and to_square < 8:
+            piece = 3
+        if piece == 11 and to_square >= 56:
+            piece = 9
+
+    return changes + [(to_square, piece)]
+
+
+def playable_moves(board):
+    """ a python-chess board's legal moves, with pawns only promoting to queens, as players can only enter
+        those and move_changes() promotes to a queen """
+    return [move for move in board.legal_moves if move.promotion in (None, chess.QUEEN)]
 
-    tensor = one_hot_encode(board)
+
+def apply_moves(tensor, alg_moves):
+    """ Applies each algebraic notation move to a copy of a one-hot array, returning a contiguous array [moves, 64, 13] """
+    current_tensor = np.asarray(tensor, dtype=bool).reshape(64,13)
+    pieces = np.argmax(current_tensor, axis=-1)
+    candidates = np.empty((len(alg_moves), 64, 13), dtype=bool)
+    candidates[:] = current_tensor
+
+    # Collect the few changed squares of every move, then write them all at once
+    rows, squares, new_pieces = [], [], []
+    for row, alg_move in enumerate(alg_moves):
+        for square, piece in move_changes(pieces, alg_move):
+            rows.append(row)
+            squares.append(square)
+            new_pieces.append(piece)
+    candidates[rows, squares] = ONE_HOT[new_pieces]
+
+    return candidates
+
+
+def update_one_hot(tensor, alg_move):
+    """ Updates one-hot array with an algebraic notation move """
+    tensor = apply_moves(tensor, [alg_move])[0]
     return tensor
 
 
 def swap_fen_colours(fen, turn='black'):
     """ Swaps colour of pieces in Forysth-Edwards notation """
-    FEN = ''
-    for char in str(fen):
-        if char.isupper():
-            FEN = FEN + char.lower()
-        elif char.islower():
-            FEN = FEN + char.upper()
-        elif char == '/' or char.isnumeric():
-            FEN = FEN + char
-        else:
-            if turn == 'black':
-                FEN = FEN + ' b KQkq - 0 1'
-            if turn == 'white':
-                FEN = FEN + ' w KQkq - 0 1'
-            break
+    fen = str(fen)
+    placement = re.match(r'[A-Za-z0-9/]*', fen).group()
+    FEN = placement.swapcase()
+    if len(placement) < len(fen):
+        if turn == 'black':
+            FEN = FEN + ' b KQkq - 0 1'
+        if turn == 'white':
+            FEN = FEN + ' w KQkq - 0 1'
 
     return FEN
 
 
-# Unicode chess pieces 
-print('\u265A ' '\u265B ' '\u265C ' '\u265D ' '\u265E ' '\u265F ' '\u2654 ' '\u2655 ' '\u2656 ' '\u2657 ' '\u2658 ' '\u2659' )
+def standard_fen_to_app(fen):
+    """ converts a FEN in standard orientation to this app's orientation, with the side to move as the
+        computer's uppercase pieces.  Returns (FEN, mirrored), where mirrored is True if black was to move.
+        Like the web app, castling rights and en passant squares are not kept """
+    board = chess.Board(fen)
+    mirrored = board.turn == chess.BLACK
+    if mirrored:
+        board = board.mirror()
+    placement = '/'.join(row[::-1] for row in reversed(board.board_fen().split('/')))
+
+    return placement + ' w KQkq - 0 1', mirrored
+
+
+def app_move_to_standard(move, mirrored):
+    """ converts a move chosen by ensemble_solver() back to the standard orientation of standard_fen_to_app() """
+    from_square, to_square = 63 - move.from_square, 63 - move.to_square
+    if mirrored:
+        from_square, to_square = chess.square_mirror(from_square), chess.square_mirror(to_square)
+
+    return chess.Move(from_square, to_square, promotion=move.promotion)
 
 
 def find_legal_moves(FEN):
-    """ returns a list of candidate board tensors with available moves applied """
-    candidates = []
-    algebraic_moves = []
-    ascii_board = fen_to_ascii(FEN)
-    current_tensor = one_hot_encode(ascii_board)
+    """ returns an array of candidate board tensors [moves, 64, 13] with available moves applied, and the list of moves """
+    current_tensor = fen_to_one_hot(FEN)
     FEN = swap_fen_colours(FEN, turn='black') 
 
     # analyse position with python-chess   
     board = chess.Board(FEN, chess960=True)
-    for i, move in enumerate(board.legal_moves):
-        candidate = update_one_hot(current_tensor, move)
-        candidates.append(candidate)
-        algebraic_moves.append(move)
+    algebraic_moves = playable_moves(board)
+    candidates = apply_moves(current_tensor, algebraic_moves)
 
     return candidates, algebraic_moves
 
@@ -290,10 +353,6 @@ def most_similar_move(candidates, target_tensor, algebraic_moves):
 
 def booleanise(tensor):
     """ convert tensors probability vectors to one-hot tensor [1,64,13] -> [64,13] """
-    tensor = np.squeeze(tensor) 
-    one_hot_tensor = np.zeros(shape=(64,13), dtype=bool) 
-    for square, piece_vector in enumerate(tensor):
-        index = np.argmax(piece_vector)
-        one_hot_tensor[square][index] = 1 
+    one_hot_tensor = ONE_HOT[np.argmax(np.asarray(tensor).reshape(64,13), axis=-1)]
 
     return one_hot_tensor
\ No newline at end of file
@@ -0,0 +1,119 @@
+""" decision criteria used by ensemble_solver(), evaluated on stacked arrays rather than python loops """
+
+import numpy as np
+
+
+def piece_indices(tensors):
+    """ converts stacked probability or one-hot tensors [..., 64, 13] to piece indices [..., 64] """
+    return np.asarray(tensors).reshape(-1,64,13).argmax(axis=-1)
+
+
+def confidence_scores(predictions):
+    """ vectorised confidence_score() for a stack of predictions [M, 64, 13] -> [M] """
+    highest = predictions.max(axis=-1)
+    others = predictions.sum(axis=-1) - highest
+
+    return (highest - others).sum(axis=-1)
+
+
+def first_match(board_indices, candidate_indices):
+    """ returns index of the first candidate with the same piece on every square, or None """
+    hits = np.all(candidate_indices == board_indices, axis=-1)
+    if hits.any():
+        return int(np.argmax(hits))
+
+    return None
+
+
+def decide(predictions, candidates, moves):
+    """ applies the ensemble decision criteria to every model's prediction of one board
+
+        predictions: [M, 64, 13] model outputs
+        candidates:  [N, 64, 13] one-hot boards, one for each legal move
+        moves:       the N legal moves
+        returns (ensemble_predict, ai_move, tag, checkmate), as ensemble_solver() """
+    predictions = np.asarray(predictions).reshape(-1,64,13)
+    candidates = np.asarray(candidates, dtype=bool).reshape(-1,64,13)
+    f_predictions = predictions.astype(float)
+    candidate_indices = piece_indices(candidates)    # [N, 64]
+
+    # Compare every prediction with every legal move at once  [M, N]
+    matches = np.all(piece_indices(predictions)[:, None, :] == candidate_indices[None, :, :], axis=-1)
+    match_counts = matches.sum(axis=1)
+
+    # Sum all predictions, and all legal predictions (no need to divide due to later argmax()'s)
+    avg_raw_predict = f_predictions.sum(axis=0, keepdims=True)
+    avg_leg_predict = (match_counts[:, None, None] * f_predictions).sum(axis=0, keepdims=True)
+
+    # Use average of all ensemble predictions
+    i = first_match(piece_indices(avg_raw_predict), candidate_indices)
+    if i is not None:
+        return avg_raw_predict, moves[i], 'avrw', False
+
+    # Use average of legal ensemble predictions
+    i = first_match(piece_indices(avg_leg_predict), candidate_indices)
+    if i is not None:
+        return avg_leg_predict, moves[i], 'avlg', False
+
+    # Use most confident solo prediction, if any prediction was legal
+    if match_counts.sum() >= 1:
+        mcf_predict = predictions[np.argmax(confidence_scores(f_predictions))][None]
+        i = first_match(piece_indices(mcf_predict), candidate_indices)
+        if i is not None:
+            return mcf_predict, moves[i], 'mclg', False
+
+    # Find most similar legal move to average of raw predictions
+    if len(candidates) > 0:
+        scores = candidates.reshape(len(candidates), -1).astype('float32') @ avg_raw_predict.ravel()
+        i = int(np.argmax(scores))
+        return candidates[i], moves[i], 'mslm', False
+
+    # No legal moves available
+    return None, None, 'chkm', True
+
+
+def early_decision(predictions, remaining, candidates, moves, agreement=0):
+    """ returns decide()'s result from the first members' predictions [K, 64, 13] if it cannot change
+        whatever the `remaining` members predict, or if `agreement` members predicted the same legal move,
+        tagged 'agrm' as decide() might not have chosen it.  Otherwise returns None.
+
+        Each member outputs a probability distribution for every square, so it adds at most 1 to any piece's
+        sum.  If on every square the leading piece is ahead by more than `remaining`, the raw average of the
+        whole ensemble has the same pieces, and when those are a legal move, decide() returns it as 'avrw' """
+    predictions = np.asarray(predictions, dtype=float).reshape(-1,64,13)
+    candidate_indices = piece_indices(candidates)
+    raw_total = predictions.sum(axis=0)
+    ranked = np.sort(raw_total, axis=-1)
+    if np.all(ranked[:, -1] - ranked[:, -2] > remaining):
+        i = first_match(piece_indices(raw_total), candidate_indices)
+        if i is not None:
+            return raw_total[None], moves[i], 'avrw', False
+
+    # Heuristic exit: enough members predicted the same legal move
+    if agreement > 0 and len(predictions) >= agreement:
+        matches = np.all(piece_indices(predictions)[:, None, :] == candidate_indices[None, :, :], axis=-1)    # [K, N]
+        votes = matches.sum(axis=0)
+        if len(votes) > 0 and votes.max() >= agreement:
+            i = int(np.argmax(votes))
+            return predictions[matches[:, i]].sum(axis=0, keepdims=True), moves[i], 'agrm', False
+
+    return None
+
+
+def adaptive_decide(predict_member, order, candidates, moves, agreement=0):
+    """ decide(), evaluating members one at a time in `order` and stopping as soon as early_decision() can.
+        predict_member(i) returns member i's prediction [64, 13].  Returns (decide() result, members evaluated),
+        where the result is the same as decide() on every member's prediction, unless `agreement` ended it """
+    candidates = np.asarray(candidates, dtype=bool).reshape(-1,64,13)
+    if len(candidates) == 0:
+        return decide(np.zeros((0,64,13)), candidates, moves), 0    # no legal moves, whatever the members predict
+
+    predictions = {}
+    for evaluated, member in enumerate(order, 1):
+        predictions[member] = np.asarray(predict_member(member)).reshape(64,13)
+        result = early_decision(list(predictions.values()), len(order) - evaluated, candidates, moves, agreement)
+        if result is not None:
+            return result, evaluated
+
+    # Not settled early: the full ensemble, in member order as decide() would see it
+    return decide(np.stack([predictions[member] for member in sorted(predictions)]), candidates, moves), len(order)
@@ -0,0 +1,149 @@
+""" games in progress, kept as python-chess boards between moves so each position is analysed once
+
+    The session holds each game's FEN and moves, which is all any worker needs to play on.  Rebuilding the
+    board from the FEN on every move loses castling rights and the move stack though, and parsed it several
+    times per move, so each worker also keeps the boards of its recent games, keyed by a game id stored in
+    the session.  A game this worker has not seen, or one that another worker has moved on, is rebuilt by
+    replaying its moves from the opening, or from the FEN if they are incomplete. """
+
+import threading
+from collections import OrderedDict
+import chess
+import numpy as np
+from . import chess_tools_local as ct
+
+
+def placement(fen):
+    """ the piece placement field of a FEN """
+    return str(fen).split(' ')[0]
+
+
+class Game:
+    """ A game in the orientation is_move_legal() uses: the human plays white, from the bottom of the board,
+        and the computer black.  Moves are the same in the app's orientation, so ensemble_solver()'s moves
+        can be played directly.  python-chess decides which moves are legal, found once for each position,
+        but castling puts the king and rook on the app's squares, as ct.move_changes() """
+
+    def __init__(self, board):
+        self.board = board
+        self._legal_moves = None
+
+    @classmethod
+    def from_fen(cls, fen):
+        """ starts from a FEN in the app's orientation, with the human to move and every castling right """
+        return cls(chess.Board(ct.swap_fen_colours(fen, turn='white'), chess960=True))
+
+    @classmethod
+    def restore(cls, fen, start_fen=None, moves=()):
+        """ replays moves from start_fen, keeping castling rights and the move stack, or starts from fen
+            if there is no start_fen, or the moves do not reach fen """
+        if start_fen is not None:
+            game = cls.from_fen(start_fen)
+            for text in moves:
+                move = game.find_move(text)
+                if move is None:
+                    break
+                game.push(move)
+            else:
+                if game.placement() == placement(fen) and game.board.turn == chess.WHITE:
+                    return game
+
+        return cls.from_fen(fen)
+
+    def placement(self):
+        """ the piece placement in the app's orientation, as the session's FEN """
+        return self.board.board_fen().swapcase()
+
+    def legal_moves(self):
+        """ the legal moves of the side to move, as ct.playable_moves() """
+        if self._legal_moves is None:
+            self._legal_moves = ct.playable_moves(self.board)
+
+        return self._legal_moves
+
+    def find_move(self, text):
+        """ returns the legal move for a move string, eg. 'e2e4' or 'a7a8q', or None.  As is_move_legal(),
+            the squares may be given either way round """
+        text = str(text).lower()
+        for move in self.legal_moves():
+            uci = move.uci()
+            if uci == text or uci == text[2:] + text[:2]:
+                return move
+
+        return None
+
+    def push(self, move):
+        castled_rank = None
+        if self.board.is_castling(move):
+            castled_rank = self.castled_rank(move)
+        self.board.push(move)
+        if castled_rank is not None:
+            for square, piece in castled_rank:
+                chess.BaseBoard.set_piece_at(self.board, square, piece)    # Board.set_piece_at() would clear the move stack
+        self._legal_moves = None
+
+    def castled_rank(self, move):
+        """ the (square, piece) of each square on the king's rank after castling, as the app places them """
+        pieces = np.argmax(self.onehot(), axis=-1)
+        for square, piece in ct.move_changes(pieces, move):
+            pieces[square] = piece
+        rank = chess.square_rank(move.from_square)
+        app_rank = pieces[(7 - rank) * 8:(8 - rank) * 8]    # the app's squares start from the 8th rank
+
+        return [(chess.square(file, rank), None if piece == 12 else chess.Piece.from_symbol(ct.PIECE_CHARS[piece].swapcase()))
+                for file, piece in enumerate(app_rank)]
+
+    def onehot(self):
+        """ the board as a one-hot tensor [64, 13] in the app's orientation """
+        return ct.board_to_one_hot(self.board, swap_colours=True)
+
+    def candidates(self, onehot):
+        """ (candidate boards [moves, 64, 13], moves) for the side to move, as find_legal_moves().  Each board is
+            the one push() reaches """
+        moves = self.legal_moves()
+
+        return ct.apply_moves(onehot, moves), moves
+
+
+class GameCache:
+    """ Maps game ids to the Game of each session's game in progress, discarding the least recently used
+        once `max_size` are held.  A game is taken out while a move is played, so two requests for the
+        same session never change one board at once """
+
+    def __init__(self, max_size=1000):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._games = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._games)
+
+    def take(self, game_id, fen):
+        """ removes and returns the game if it is at the session's FEN with the human to move, or None """
+        with self._lock:
+            game = self._games.pop(game_id, None)
+            if game is None or game.placement() != placement(fen) or game.board.turn != chess.WHITE:
+                self.misses += 1
+                return None
+            self.hits += 1
+
+            return game
+
+    def put(self, game_id, game):
+        """ stores a game, evicting the least recently used if the cache is full """
+        if self.max_size <= 0 or game_id is None:
+            return
+        with self._lock:
+            self._games[game_id] = game
+            self._games.move_to_end(game_id)
+            while len(self._games) > self.max_size:
+                self._games.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        """ counters for monitoring, as a dict """
+        return {'size': len(self._games), 'max_size': self.max_size, 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions}
@@ -0,0 +1,74 @@
+""" startup warm-up, and the /healthz and /readyz probes that report it """
+
+import threading
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse
+
+ready = threading.Event()
+_warm_up_lock = threading.Lock()
+
+
+def warm_up():
+    """ loads the models and runs every stage of a move once, so the first player does not wait for them.
+        Called by gunicorn.conf.py before workers accept requests, does nothing if already warm """
+    with _warm_up_lock:
+        if ready.is_set():
+            return
+        from . import chess_tools_local as ct
+        from . import metrics
+        from . import openings
+        from . import views
+        from . import web_ensemble_solver as es
+
+        es.engine()
+        boards = [ct.fen_to_one_hot(fen) for fen in openings.opening_fens()]
+        es.predict_batch(boards[0])
+        es.solve_batch(boards)
+        if settings.BOARD_RENDER == 'png':
+            ct.board_sprites()
+            views.board_png(views.onehot_to_url_key(boards[0]))
+        elif settings.BOARD_RENDER == 'svg':
+            views.board_svg(views.onehot_to_url_key(boards[0]))
+        metrics.reset()    # report players' moves only
+        ready.set()
+
+
+class HealthCheckMiddleware:
+    """ Answers the probes before any other middleware, so they need no session, CSRF token or allowed host.
+        /healthz reports the process is serving requests, /readyz that warm_up() has finished.  Works under
+        WSGI and ASGI alike, so probes never make Django switch between sync and async """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def _probe(self, request):
+        """ returns the response to a probe, or None for any other request """
+        if request.path == '/healthz':
+            return HttpResponse('ok', content_type='text/plain')
+        if request.path == '/readyz':
+            if ready.is_set():
+                return HttpResponse('ready', content_type='text/plain')
+            return HttpResponse('warming up', content_type='text/plain', status=503)
+
+        return None
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        probe_response = self._probe(request)
+        if probe_response is not None:
+            return probe_response
+
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        probe_response = self._probe(request)
+        if probe_response is not None:
+            return probe_response
+
+        return await self.get_response(request)
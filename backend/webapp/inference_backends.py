@@ -0,0 +1,221 @@
+""" interchangeable inference backends for the ensemble, each returning predictions [models, boards, 64, 13]
+    from predict_batch(), and identifying the models it serves with a hashable model_set """
+
+import json
+import os
+import threading
+import time
+import numpy as np
+from .metrics import record_model
+from .model_server import ModelClient
+
+# Models from chess_trainer.py, used when there is no model_registry config  (general_solver_3 and
+# general_solver_4 are not used)
+MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ml_models')
+MEMBER_NAMES = ['general_solver_1', 'general_solver_2', 'whole_game_3']
+QUANTIZATIONS = ['none', 'float16', 'int8']
+
+
+def fused_model_path(model_dir):
+    """ location of the SavedModel written by 'manage.py build_fused_model' """
+    return os.path.join(model_dir, 'fused_ensemble')
+
+
+def fused_model_info(model_dir):
+    """ {'member_names', 'version'} of the models a fused model was built from, or None if there is no fused model """
+    path = fused_model_path(model_dir)
+    if not os.path.isdir(path):
+        return None
+    try:
+        with open(os.path.join(path, 'members.json')) as file:
+            info = json.load(file)
+    except FileNotFoundError:
+        return {'member_names': list(MEMBER_NAMES), 'version': None}    # built before the members were recorded
+    if isinstance(info, list):
+        return {'member_names': info, 'version': None}    # built before the version was recorded
+
+    return {'member_names': info['members'], 'version': info.get('version')}
+
+
+def fused_model_matches(model_dir, member_names, version=None):
+    """ whether the fused model in model_dir was built from these members, at this registry version """
+    return fused_model_info(model_dir) == {'member_names': list(member_names), 'version': version}
+
+
+def tflite_path(model_dir, member_name, quantization='none'):
+    """ location of a member converted by 'manage.py convert_models' """
+    suffix = '' if quantization == 'none' else '_' + quantization
+
+    return os.path.join(model_dir, 'tflite', member_name + suffix + '.tflite')
+
+
+def load_members(model_dir=MODEL_DIR, member_names=MEMBER_NAMES):
+    """ loads each ensemble member as a separate keras model """
+    from tensorflow import keras
+
+    return [keras.models.load_model(os.path.join(model_dir, name)) for name in member_names]
+
+
+def build_fused_model(members):
+    """ combines ensemble members into one multi-output keras model with a shared input """
+    from tensorflow import keras
+
+    inputs = keras.Input(shape=members[0].input_shape[1:], name='board')
+    outputs = []
+    for i, member in enumerate(members):
+        member._name = f'member_{i+1}'    # layer names must be unique within the fused model
+        outputs.append(member(inputs))
+
+    return keras.Model(inputs=inputs, outputs=outputs, name='fused_ensemble')
+
+
+class KerasBackend:
+    """ Runs the SavedModels with full TensorFlow.  Members are fused into one multi-output model,
+        traced once as a tf.function with a fixed input signature, and warmed up with a dummy board.
+        Each member can also be run on its own, for the adaptive ensemble """
+    name = 'keras'
+
+    def __init__(self, model_dir=MODEL_DIR, member_names=MEMBER_NAMES, version=None):
+        import tensorflow as tf
+        from tensorflow import keras
+
+        if fused_model_matches(model_dir, member_names, version):
+            self.fused_model = keras.models.load_model(fused_model_path(model_dir))
+        else:
+            self.fused_model = build_fused_model(load_members(model_dir, member_names))
+        self.members = [layer for layer in self.fused_model.layers if isinstance(layer, keras.Model)]
+        self.member_names = list(member_names)
+        self.version = version
+        self.model_set = (self.name, model_dir, tuple(member_names), version)
+        self.input_shape = tuple(self.fused_model.input_shape[1:])
+        signature = [tf.TensorSpec((None,) + self.input_shape, tf.float32)]
+        self.fused_call = tf.function(self.fused_model, input_signature=signature)
+        self.fused_call(tf.zeros((1,) + self.input_shape))
+        self.member_calls = [tf.function(member, input_signature=signature) for member in self.members]    # traced on first use
+
+    def predict_batch(self, onehot_board_tensors):
+        boards = np.asarray(onehot_board_tensors, dtype='float32').reshape((-1,) + self.input_shape)
+        start = time.perf_counter()
+        predictions = self.fused_call(boards)
+        record_model('fused_ensemble', time.perf_counter() - start)    # members run in one call
+        if not isinstance(predictions, (list, tuple)):
+            predictions = [predictions]
+
+        return np.stack([np.array(y_predict).reshape(-1,64,13) for y_predict in predictions])
+
+    def predict_members(self, onehot_board_tensors, indices):
+        """ evaluates a stack of boards with the members at `indices`, returns predictions [len(indices), boards, 64, 13] """
+        boards = np.asarray(onehot_board_tensors, dtype='float32').reshape((-1,) + self.input_shape)
+        predictions = []
+        for i in indices:
+            start = time.perf_counter()
+            y_predict = self.member_calls[i](boards)
+            record_model(self.member_names[i], time.perf_counter() - start)
+            predictions.append(np.array(y_predict).reshape(-1,64,13))
+
+        return np.stack(predictions)
+
+
+class TFLiteBackend:
+    """ Runs members converted by 'manage.py convert_models' with the CPU-only TFLite interpreter.
+        Only needs the tflite-runtime package, or falls back to the interpreter bundled with TensorFlow """
+    name = 'tflite'
+
+    def __init__(self, model_dir=MODEL_DIR, member_names=MEMBER_NAMES, quantization='float16', version=None):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            from tensorflow.lite import Interpreter
+
+        self.interpreters = [Interpreter(model_path=tflite_path(model_dir, name, quantization))
+                             for name in member_names]
+        for interpreter in self.interpreters:
+            interpreter.allocate_tensors()
+        self.input_shape = tuple(self.interpreters[0].get_input_details()[0]['shape'][1:])
+        self.member_names = list(member_names)
+        self.version = version
+        self.model_set = (self.name, model_dir, tuple(member_names), quantization, version)
+        self._batch_sizes = [1] * len(self.interpreters)
+        self._lock = threading.Lock()    # interpreters hold their tensors, so calls must not overlap
+        self.predict_batch(np.zeros((1,64,13), dtype='float32'))
+
+    def _invoke(self, i, boards):
+        """ runs member i on a stack of boards, while holding self._lock """
+        start = time.perf_counter()
+        interpreter = self.interpreters[i]
+        input_index = interpreter.get_input_details()[0]['index']
+        if len(boards) != self._batch_sizes[i]:
+            interpreter.resize_tensor_input(input_index, boards.shape)
+            interpreter.allocate_tensors()
+            self._batch_sizes[i] = len(boards)
+        interpreter.set_tensor(input_index, boards)
+        interpreter.invoke()
+        y_predict = interpreter.get_tensor(interpreter.get_output_details()[0]['index'])
+        record_model(self.member_names[i], time.perf_counter() - start)
+
+        return np.array(y_predict).reshape(-1,64,13)
+
+    def predict_batch(self, onehot_board_tensors):
+        return self.predict_members(onehot_board_tensors, range(len(self.interpreters)))
+
+    def predict_members(self, onehot_board_tensors, indices):
+        """ evaluates a stack of boards with the members at `indices`, returns predictions [len(indices), boards, 64, 13] """
+        boards = np.asarray(onehot_board_tensors, dtype='float32').reshape((-1,) + self.input_shape)
+        with self._lock:
+            return np.stack([self._invoke(i, boards) for i in indices])
+
+
+def as_tuple(value):
+    """ converts JSON lists back to the nested tuples of a model_set """
+    if isinstance(value, list):
+        return tuple(as_tuple(item) for item in value)
+
+    return value
+
+
+class RemoteBackend:
+    """ Sends boards to the process started by 'manage.py run_model_server', which owns the models.
+        Never imports TensorFlow, so every web worker can use it without its own copy of the models """
+    name = 'remote'
+
+    def __init__(self, socket_path, connect_timeout=60, check_interval=1.0):
+        self.client = ModelClient(socket_path, connect_timeout)
+        self.client.connect()
+        self.check_interval = check_interval
+        self._next_check = time.monotonic() + check_interval
+
+    @property
+    def member_names(self):
+        return self.client.info['member_names']
+
+    @property
+    def version(self):
+        return self.client.info.get('version')
+
+    @property
+    def model_set(self):
+        """ the served models.  Checked with the server at most every check_interval seconds, so moves
+            cached for models it has since replaced are dropped even if no boards are sent to it """
+        if time.monotonic() > self._next_check:
+            self._next_check = time.monotonic() + self.check_interval
+            self.client.check()
+
+        return (self.name, as_tuple(self.client.info['model_set']))
+
+    def predict_batch(self, onehot_board_tensors):
+        start = time.perf_counter()
+        predictions = self.client.predict_batch(onehot_board_tensors)
+        record_model('remote', time.perf_counter() - start)    # members run in the model server
+
+        return predictions
+
+
+BACKENDS = {'keras': KerasBackend, 'tflite': TFLiteBackend, 'remote': RemoteBackend}
+
+
+def load_backend(name='keras', **kwargs):
+    """ creates the named inference backend """
+    if name not in BACKENDS:
+        raise ValueError(f"unknown inference backend '{name}', choose from {list(BACKENDS)}")
+
+    return BACKENDS[name](**kwargs)
@@ -0,0 +1,88 @@
+""" micro-batching scheduler that combines boards from concurrent requests into one model call """
+
+import os
+import queue
+import threading
+import time
+import numpy as np
+
+
+class _PendingBoard:
+    """ a single caller's board, waiting for its slice of a batched prediction """
+    def __init__(self, board):
+        self.board = board
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class MicroBatcher:
+    """ Collects boards submitted by concurrent threads for up to `window` seconds (or until
+        `max_batch` boards are waiting), passes the stacked boards to `predict_fn` in a single
+        call, then returns each caller its own slice of the predictions.
+
+        predict_fn receives an array [boards, 64, 13] and must return an array whose second
+        axis indexes the boards, eg. [models, boards, 64, 13] """
+
+    def __init__(self, predict_fn, window=0.002, max_batch=32):
+        self.predict_fn = predict_fn
+        self.window = window
+        self.max_batch = max_batch
+        self.batch_count = 0
+        self.board_count = 0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def predict(self, board):
+        """ blocks until the batch containing this board has been evaluated, returns its predictions """
+        pending = _PendingBoard(np.asarray(board).reshape(1,64,13))
+        self._ensure_worker()
+        self._queue.put(pending)
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+
+        return pending.result
+
+    def _ensure_worker(self):
+        """ starts the scheduling thread on first use, and again in any forked child process """
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._queue = queue.Queue()
+                self._thread = threading.Thread(target=self._run, name='inference-batcher', daemon=True)
+                self._pid = os.getpid()
+                self._thread.start()
+
+    def _collect(self):
+        """ waits for a first board, then gathers any others that arrive within the window """
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                boards = np.concatenate([pending.board for pending in batch])
+                predictions = self.predict_fn(boards)
+                for i, pending in enumerate(batch):
+                    pending.result = predictions[:, i:i+1]
+            except Exception as error:
+                for pending in batch:
+                    pending.error = error
+            finally:
+                self.batch_count += 1
+                self.board_count += len(batch)
+                for pending in batch:
+                    pending.done.set()
@@ -0,0 +1,41 @@
+""" python manage.py build_fused_model
+
+    Combines the ensemble members listed in the model registry config into a single multi-output
+    SavedModel, which is then loaded in place of the separate models.  Re-run after changing the
+    members or retraining one; until then, the separate models are loaded and fused at startup. """
+
+import json
+import os
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from webapp import inference_backends as ib
+from webapp.model_registry import read_config
+
+
+class Command(BaseCommand):
+    help = 'Builds ml_models/fused_ensemble from the separate ensemble members'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help='SavedModel directory to write, by default fused_ensemble in the model directory')
+
+    def handle(self, *args, **options):
+        config = read_config(settings.MODEL_REGISTRY_PATH)
+        output = options['output'] or ib.fused_model_path(config['model_dir'])
+        members = ib.load_members(config['model_dir'], config['member_names'])    # renamed by build_fused_model()
+        fused_model = ib.build_fused_model(members)
+
+        # Check the fused model reproduces every member's prediction
+        board = np.zeros((1,64,13), dtype='float32')
+        board[0, :, 12] = 1
+        fused_outputs = fused_model(board)
+        if not isinstance(fused_outputs, (list, tuple)):
+            fused_outputs = [fused_outputs]
+        for name, member, fused_output in zip(config['member_names'], members, fused_outputs):
+            if not np.allclose(np.array(member(board)), np.array(fused_output), atol=1e-6):
+                raise RuntimeError(f'fused output differs from {name}')
+
+        fused_model.save(output)
+        with open(os.path.join(output, 'members.json'), 'w') as file:
+            json.dump({'members': config['member_names'], 'version': config['version']}, file)
+        self.stdout.write(f'saved {len(members)}-member fused model to {output}')
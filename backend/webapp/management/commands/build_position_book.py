@@ -0,0 +1,52 @@
+""" python manage.py build_position_book [--depth 2]
+
+    Plays every legal human move from each opening option, lets the ensemble reply, and repeats
+    for `depth` human moves.  Every board the ensemble was asked to solve is written, with its
+    reply, to a sorted book file that web_ensemble_solver memory-maps and checks before
+    running the models.  Rebuild after changing the ensemble members. """
+
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from webapp import chess_tools_local as ct
+from webapp import openings
+from webapp import web_ensemble_solver as es
+from webapp.move_cache import board_key
+from webapp.position_book import write_book
+
+
+class Command(BaseCommand):
+    help = 'Precomputes ensemble moves for positions reachable from the opening options'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--depth', type=int, default=2, help='number of human moves to follow from each opening')
+        parser.add_argument('--batch-size', type=int, default=256)
+        parser.add_argument('--output', default=settings.POSITION_BOOK_PATH)
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        entries = {}
+        frontier = openings.opening_fens()
+
+        for ply in range(options['depth']):
+            # Boards the ensemble must reply to, after each legal human move
+            boards = {}
+            for fen in frontier:
+                for board in openings.human_replies(fen):
+                    key = board_key(board)
+                    if key not in entries:
+                        boards[key] = board
+            keys = list(boards)
+
+            frontier = []
+            for i in range(0, len(keys), options['batch_size']):
+                batch = keys[i:i + options['batch_size']]
+                for key, result in zip(batch, es.solve_batch([boards[key] for key in batch])):
+                    entries[key] = result
+                    if not result[3]:
+                        frontier.append(ct.one_hot_to_fen(result[0]))
+            self.stdout.write(f'depth {ply + 1}: {len(keys)} new positions, {len(entries)} in total')
+
+        write_book(options['output'], entries, es.engine().backend.member_names, es.engine().backend.version,
+                   depth=options['depth'])
+        self.stdout.write(f'wrote {len(entries)} positions to {options["output"]} in {time.perf_counter() - start:.0f}s')
@@ -0,0 +1,79 @@
+""" python manage.py convert_models [--quantize none|float16|int8]
+
+    Converts the ensemble members listed in the model registry config from SavedModels to
+    TFLite flatbuffers in the model directory's tflite/ folder, for the lightweight 'tflite' inference backend.
+    The converted models are then checked against the keras models on positions reachable
+    from the opening options. """
+
+import os
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from webapp import chess_tools_local as ct
+from webapp import inference_backends as ib
+from webapp import openings
+from webapp.ensemble_decision import decide
+from webapp.model_registry import read_config
+
+
+def sample_boards():
+    """ boards reached by every legal human move from each opening [boards, 64, 13] """
+    boards = []
+    for fen in openings.opening_fens():
+        boards.extend(openings.human_replies(fen))
+
+    return np.array(boards, dtype='float32')
+
+
+class Command(BaseCommand):
+    help = 'Converts the ensemble SavedModels to (optionally quantized) TFLite models'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--quantize', choices=ib.QUANTIZATIONS, default='float16')
+        parser.add_argument('--skip-check', action='store_true', help='do not compare with the keras models')
+
+    def handle(self, *args, **options):
+        import tensorflow as tf
+
+        quantization = options['quantize']
+        config = read_config(settings.MODEL_REGISTRY_PATH)
+        model_dir = config['model_dir']
+        boards = sample_boards()
+        os.makedirs(os.path.join(model_dir, 'tflite'), exist_ok=True)
+
+        for name in config['member_names']:
+            converter = tf.lite.TFLiteConverter.from_saved_model(os.path.join(model_dir, name))
+            if quantization == 'float16':
+                converter.optimizations = [tf.lite.Optimize.DEFAULT]
+                converter.target_spec.supported_types = [tf.float16]
+            if quantization == 'int8':
+                # weights and activations are int8, calibrated on sample positions; inputs and outputs stay float32
+                converter.optimizations = [tf.lite.Optimize.DEFAULT]
+                converter.representative_dataset = lambda: ([board[None]] for board in boards)
+            path = ib.tflite_path(model_dir, name, quantization)
+            with open(path, 'wb') as file:
+                file.write(converter.convert())
+            self.stdout.write(f'{name}: {os.path.getsize(path) / 1024:.0f} KB -> {path}')
+
+        if not options['skip_check']:
+            self.check_accuracy(boards, quantization, config)
+
+    def check_accuracy(self, boards, quantization, config):
+        """ compares keras and tflite predictions square by square, and the ensemble's chosen moves """
+        model_dir, member_names = config['model_dir'], config['member_names']
+        keras_predictions = np.stack([np.array(member(boards)).reshape(-1,64,13) for member in ib.load_members(model_dir, member_names)])
+        tflite_predictions = ib.TFLiteBackend(model_dir, member_names, quantization=quantization).predict_batch(boards)
+
+        self.stdout.write(f'\n{"model":<20}{"max abs error":>15}{"squares agree":>15}{"boards agree":>15}')
+        for name, expected, actual in zip(member_names, keras_predictions, tflite_predictions):
+            squares = expected.argmax(axis=-1) == actual.argmax(axis=-1)
+            self.stdout.write(f'{name:<20}{np.abs(expected - actual).max():>15.5f}'
+                              f'{squares.mean():>15.2%}{squares.all(axis=-1).mean():>15.2%}')
+
+        same_move = 0
+        for i, board in enumerate(boards):
+            candidates, moves = ct.find_legal_moves(ct.one_hot_to_fen(board))
+            keras_choice = decide(keras_predictions[:, i], candidates, moves)
+            tflite_choice = decide(tflite_predictions[:, i], candidates, moves)
+            same_move += keras_choice[1:3] == tflite_choice[1:3]
+        self.stdout.write(f'\nensemble chose the same move and tag for {same_move / len(boards):.2%} of {len(boards)} positions')
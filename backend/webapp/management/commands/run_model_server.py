@@ -0,0 +1,65 @@
+""" python manage.py run_model_server [--backend keras] [--socket /tmp/chessnn-models.sock]
+
+    Loads the ensemble once and serves predictions on a Unix socket, for web workers started with
+    CHESSNN_INFERENCE_BACKEND=remote.  Single boards from different workers arriving within
+    --batch-window-ms are evaluated in one model call.  When the model registry config changes, the new
+    models are loaded while the old ones keep serving, then web workers reconnect to the new set. """
+
+import threading
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from webapp import inference_backends as ib
+from webapp.inference_batcher import MicroBatcher
+from webapp.model_registry import ModelRegistry
+from webapp.model_server import ModelServer
+
+
+class Command(BaseCommand):
+    help = 'Serves ensemble predictions to web workers over a Unix socket'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--socket', default=settings.MODEL_SERVER_SOCKET)
+        parser.add_argument('--backend', choices=['keras', 'tflite'], default='keras')
+        parser.add_argument('--quantization', choices=ib.QUANTIZATIONS, default=settings.INFERENCE_QUANTIZATION)
+        parser.add_argument('--batch-window-ms', type=float, default=settings.INFERENCE_BATCH_WINDOW_MS)
+        parser.add_argument('--max-batch', type=int, default=settings.INFERENCE_MAX_BATCH)
+        parser.add_argument('--registry', default=settings.MODEL_REGISTRY_PATH, help='model registry config to serve')
+
+    def handle(self, *args, **options):
+        def load(config):
+            """ returns (backend, batcher) for the models in a registry config """
+            models = {'model_dir': config['model_dir'], 'member_names': config['member_names'], 'version': config['version']}
+            if options['backend'] == 'tflite':
+                backend = ib.load_backend('tflite', quantization=options['quantization'], **models)
+            else:
+                backend = ib.load_backend(options['backend'], **models)
+
+            batcher = None
+            if options['batch_window_ms'] > 0:
+                batcher = MicroBatcher(backend.predict_batch,
+                                       window=options['batch_window_ms'] / 1000,
+                                       max_batch=options['max_batch'])
+
+            return backend, batcher
+
+        def swap(models, config):
+            server.serve_models(*models)
+            self.stdout.write(f'now serving {", ".join(config["member_names"])}')
+
+        registry = ModelRegistry(options['registry'], load, check_interval=settings.MODEL_REGISTRY_CHECK_SECONDS,
+                                 on_swap=swap)
+        backend, batcher = registry.get()
+        server = ModelServer(options['socket'], backend, batcher)
+        self.stdout.write(f'serving {", ".join(backend.member_names)} ({backend.name}) on {options["socket"]}')
+
+        # Serve from a thread, while this one watches the registry config for new models
+        thread = threading.Thread(target=server.serve_forever, name='model-server', daemon=True)
+        thread.start()
+        try:
+            while thread.is_alive():
+                time.sleep(settings.MODEL_REGISTRY_CHECK_SECONDS)
+                registry.check()
+        finally:
+            server.shutdown()
+            server.server_close()
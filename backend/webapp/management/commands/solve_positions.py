@@ -0,0 +1,191 @@
+""" python manage.py solve_positions positions.epd --output results.jsonl [--workers 8] [--resume]
+
+    Solves each position in a FEN/EPD list (one per line) or a PGN file (every position in each game's
+    main line) for the side to move, with the web app's legal-move generation, models and decision
+    criteria.  Positions are in standard orientation, and are converted with
+    chess_tools_local.standard_fen_to_app(), so castling is always allowed, as in the web app.
+
+    Positions are read as they are needed and passed to worker processes in chunks.  Each worker loads
+    the ensemble once and evaluates a chunk with a single model call.  Results are written to JSONL in
+    input order, so an interrupted run can continue after the last complete line with --resume. """
+
+import itertools
+import json
+import multiprocessing
+import os
+import time
+from collections import deque
+import chess
+import chess.pgn
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from webapp import chess_tools_local as ct
+from webapp.ensemble_decision import confidence_scores, piece_indices
+
+es = None    # web_ensemble_solver, imported by each worker process
+
+
+def read_fen_lines(file):
+    """ yields (id, FEN) for each line of a FEN or EPD list, using the EPD 'id' operation if given """
+    for line_number, line in enumerate(file, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        try:
+            yield str(line_number), chess.Board(line).fen()
+        except ValueError:
+            try:
+                board, operations = chess.Board.from_epd(line)
+                yield str(operations.get('id', line_number)), board.fen()
+            except ValueError:
+                yield str(line_number), line    # reported as an error by the worker
+
+
+def read_pgn(file):
+    """ yields ('game:ply', FEN) for each position in each game's main line, before each move """
+    game_number = 0
+    while True:
+        game = chess.pgn.read_game(file)
+        if game is None:
+            return
+        game_number += 1
+        board = game.board()
+        for ply, move in enumerate(game.mainline_moves()):
+            yield f'{game_number}:{ply}', board.fen()
+            board.push(move)
+
+
+def completed_lines(path):
+    """ counts the complete lines of a previous run's output, removing any partly written last line """
+    with open(path, 'rb+') as file:
+        data = file.read()
+        complete = data.rfind(b'\n') + 1
+        file.truncate(complete)
+
+    return data.count(b'\n', 0, complete)
+
+
+def init_worker():
+    """ loads the ensemble once in each worker process """
+    global es
+    import django
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'django_wrapper.settings')
+    django.setup()
+    from webapp import web_ensemble_solver
+    es = web_ensemble_solver
+    es.engine()
+
+
+def describe_move(fen, move, mirrored):
+    """ converts a move chosen in the app's orientation to standard UCI and SAN for the original position.
+        Castling that the real position does not allow is returned with SAN None """
+    standard_move = ct.app_move_to_standard(move, mirrored)
+    board = chess.Board(fen)
+    try:
+        standard_move = board.parse_uci(standard_move.uci())
+    except ValueError:
+        return standard_move.uci(), None
+
+    return standard_move.uci(), board.san(standard_move)
+
+
+def solve_chunk(chunk):
+    """ solves a list of (index, id, FEN), returns (JSONL text, positions read, seconds taken) """
+    start = time.perf_counter()
+    lines = []
+    boards = []
+    solvable = []
+    for index, position_id, fen in chunk:
+        line = {'index': index, 'id': position_id, 'fen': fen}
+        lines.append(line)
+        try:
+            app_fen, mirrored = ct.standard_fen_to_app(fen)
+        except ValueError as error:
+            line['error'] = str(error)
+            continue
+        boards.append(ct.fen_to_one_hot(app_fen))
+        solvable.append((line, mirrored))
+    prepared = time.perf_counter()
+
+    if boards:
+        boards = np.stack(boards)
+        predictions = es.predict_batch(boards)
+        inferred = time.perf_counter()
+        results = es.decide_batch(boards, predictions)
+        decided = time.perf_counter()
+        timings = {'prepare_ms': (prepared - start) * 1000 / len(boards),
+                   'inference_ms': (inferred - prepared) * 1000 / len(boards),
+                   'decision_ms': (decided - inferred) * 1000 / len(boards)}
+
+        for i, ((line, mirrored), (predicted_board, move, tag, checkmate)) in enumerate(zip(solvable, results)):
+            member_predictions = np.asarray(predictions[:, i], dtype=float)
+            line.update({'move': None, 'san': None, 'tag': tag, 'checkmate': checkmate,
+                         'confidence': float(confidence_scores(member_predictions).mean()), 'agreement': 0})
+            if move is not None:
+                line['move'], line['san'] = describe_move(line['fen'], move, mirrored)
+                line['agreement'] = int(np.all(piece_indices(member_predictions) == piece_indices(predicted_board), axis=-1).sum())
+            line['timings'] = timings
+
+    text = ''.join(json.dumps(line) + '\n' for line in lines)
+
+    return text, len(lines), time.perf_counter() - start
+
+
+class Command(BaseCommand):
+    help = 'Solves positions from a FEN/EPD list or PGN file with a pool of worker processes, writing JSONL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help='FEN or EPD list, or PGN file')
+        parser.add_argument('--output', required=True, help='JSONL file to write')
+        parser.add_argument('--format', choices=['auto', 'fen', 'pgn'], default='auto')
+        parser.add_argument('--workers', type=int, default=os.cpu_count())
+        parser.add_argument('--chunk-size', type=int, default=256)
+        parser.add_argument('--resume', action='store_true', help='continue after the positions already in --output')
+
+    def handle(self, *args, **options):
+        output = options['output']
+        done = 0
+        if os.path.exists(output):
+            if not options['resume']:
+                raise CommandError(f'{output} already exists, use --resume to continue it')
+            done = completed_lines(output)
+            self.stdout.write(f'resuming after {done} positions')
+
+        file_format = options['format']
+        if file_format == 'auto':
+            file_format = 'pgn' if options['input'].lower().endswith('.pgn') else 'fen'
+        reader = read_pgn if file_format == 'pgn' else read_fen_lines
+
+        workers = options['workers']
+        started = time.perf_counter()
+        solved = 0
+        busy = 0.0
+        with open(options['input'], encoding='utf-8', errors='replace') as file, open(output, 'a') as out:
+            positions = itertools.islice(((index, position_id, fen) for index, (position_id, fen) in enumerate(reader(file))), done, None)
+            chunks = iter(lambda: list(itertools.islice(positions, options['chunk_size'])), [])
+
+            with multiprocessing.get_context('spawn').Pool(workers, initializer=init_worker) as pool:
+                pending = deque()
+
+                def write_next():
+                    nonlocal solved, busy
+                    text, count, seconds = pending.popleft().get()
+                    out.write(text)
+                    out.flush()
+                    solved += count
+                    busy += seconds
+                    rate = solved / (time.perf_counter() - started)
+                    self.stdout.write(f'{done + solved} positions, {rate:.1f}/sec, {rate / workers:.1f}/sec per core')
+
+                # Keep every worker busy, without reading far ahead of the output
+                for chunk in chunks:
+                    pending.append(pool.apply_async(solve_chunk, (chunk,)))
+                    if len(pending) >= 2 * workers:
+                        write_next()
+                while pending:
+                    write_next()
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f'solved {solved} positions in {elapsed:.1f}s with {workers} workers: '
+                          f'{solved / elapsed:.1f}/sec, {solved / elapsed / workers:.1f}/sec per core, '
+                          f'{solved / busy if busy else 0:.1f}/sec per busy core (excluding model loading)')
@@ -0,0 +1,281 @@
+""" Stage timings for each request, returned in a Server-Timing header, and latency histograms and counters
+    for the whole server, served at /metrics in the Prometheus text format.
+
+    Each worker process keeps its own metrics.  With several workers, set CHESSNN_METRICS_DIR to a directory
+    they share: every worker writes its metrics there each second, and /metrics adds up all of them. """
+
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.http import HttpResponse
+
+# Upper bounds of the latency histograms' buckets, in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Decision criteria in the order ensemble_decision.decide() tries them, and the adaptive ensemble's agreement
+# exit, which chooses a move before any of them
+CRITERIA = ('avrw', 'avlg', 'mclg', 'mslm', 'chkm')
+AGREEMENT = 'agrm'
+
+_lock = threading.Lock()
+
+
+class Histogram:
+    """ latency histogram with one label, eg. the stage timed """
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, label):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.values = {}    # label value: [count in each bucket ... in +Inf, sum, count]
+
+    def observe(self, label_value, seconds):
+        with _lock:
+            values = self.values.setdefault(label_value, [0] * (len(BUCKETS) + 3))
+            bucket = next((i for i, bound in enumerate(BUCKETS) if seconds <= bound), len(BUCKETS))
+            values[bucket] += 1
+            values[-2] += seconds
+            values[-1] += 1
+
+    def exposition(self, values):
+        lines = []
+        for label_value, counts in sorted(values.items()):
+            total = 0
+            for bound, count in zip(BUCKETS + ('+Inf',), counts):
+                total += count
+                lines.append(f'{self.name}_bucket{{{self.label}="{label_value}",le="{bound}"}} {total}')
+            lines.append(f'{self.name}_sum{{{self.label}="{label_value}"}} {counts[-2]}')
+            lines.append(f'{self.name}_count{{{self.label}="{label_value}"}} {counts[-1]}')
+
+        return lines
+
+
+class Counter:
+    """ count with one label, eg. the decision criterion reached """
+    kind = 'counter'
+
+    def __init__(self, name, help_text, label):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.values = {}    # label value: [count]
+
+    def inc(self, label_value, amount=1):
+        with _lock:
+            self.values.setdefault(label_value, [0])[0] += amount
+
+    def exposition(self, values):
+        return [f'{self.name}{{{self.label}="{label_value}"}} {count[0]}' for label_value, count in sorted(values.items())]
+
+
+STAGE_SECONDS = Histogram('chessnn_stage_seconds', 'Time spent in each stage of a request', 'stage')
+MODEL_SECONDS = Histogram('chessnn_model_seconds', 'Time spent evaluating a stack of boards with each model', 'model')
+DECISION_SECONDS = Histogram('chessnn_decision_seconds', 'Time spent applying the decision criteria, by the criterion '
+                             'that chose the move', 'tag')
+CRITERIA_REACHED = Counter('chessnn_decision_criteria_reached_total', 'Moves for which each decision criterion was '
+                           'reached, after every earlier criterion failed', 'criterion')
+ADAPTIVE_MEMBERS = Counter('chessnn_adaptive_member_calls_total', 'Member evaluations run or skipped by the adaptive '
+                           'ensemble', 'outcome')
+METRICS = [STAGE_SECONDS, MODEL_SECONDS, DECISION_SECONDS, CRITERIA_REACHED, ADAPTIVE_MEMBERS]
+
+# The current request's timings, as [(name, description, seconds)], or None outside a request
+_request_timings = contextvars.ContextVar('request_timings', default=None)
+
+
+def _add_to_request(name, seconds, description=None):
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((name, description, seconds))
+
+
+@contextmanager
+def stage(name):
+    """ times a block of code as a stage of the current request """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        STAGE_SECONDS.observe(name, seconds)
+        _add_to_request(name, seconds)
+
+
+def record_model(name, seconds):
+    """ records the time one model, or one fused call to every model, took to evaluate a stack of boards """
+    MODEL_SECONDS.observe(name, seconds)
+    _add_to_request('model', seconds, name)
+
+
+def record_decision(tag, seconds):
+    """ records the time decide() took to choose a move by the criterion tagged, and the criteria it reached """
+    DECISION_SECONDS.observe(tag, seconds)
+    STAGE_SECONDS.observe('decision', seconds)
+    _add_to_request('decision', seconds, tag)
+    if tag == AGREEMENT:
+        CRITERIA_REACHED.inc(AGREEMENT)
+        return
+    for criterion in CRITERIA[:CRITERIA.index(tag) + 1]:
+        CRITERIA_REACHED.inc(criterion)
+
+
+def record_adaptive(evaluated, members):
+    """ records how many of the members the adaptive ensemble evaluated for one board """
+    ADAPTIVE_MEMBERS.inc('evaluated', evaluated)
+    ADAPTIVE_MEMBERS.inc('skipped', members - evaluated)
+
+
+def server_timing(timings, total):
+    """ formats a request's timings as a Server-Timing header, eg. 'inference;dur=12.3, total;dur=15.0'.
+        Repeated stages, eg. one for each board of an analysis, are added together """
+    durations = {}
+    for name, description, seconds in timings:
+        durations[(name, description)] = durations.get((name, description), 0) + seconds
+    entries = []
+    for (name, description), seconds in durations.items():
+        entry = name if description is None else f'{name};desc="{description}"'
+        entries.append(f'{entry};dur={seconds * 1000:.3f}')
+    entries.append(f'total;dur={total * 1000:.3f}')
+
+    return ', '.join(entries)
+
+
+def snapshot():
+    """ this process's metrics, as {metric name: {label value: values}} """
+    with _lock:
+        return {metric.name: {label_value: list(values) for label_value, values in metric.values.items()}
+                for metric in METRICS}
+
+
+def reset():
+    """ forgets every metric recorded so far, eg. by the startup warm-up """
+    with _lock:
+        for metric in METRICS:
+            metric.values.clear()
+
+
+def _add_snapshot(totals, other):
+    for name, values in other.items():
+        for label_value, counts in values.items():
+            total = totals.setdefault(name, {}).setdefault(label_value, [0] * len(counts))
+            totals[name][label_value] = [a + b for a, b in zip(total, counts)]
+
+
+def collect(metrics_dir=None):
+    """ adds up the metrics of this process and those written to metrics_dir by other processes """
+    totals = snapshot()
+    if metrics_dir is not None and os.path.isdir(metrics_dir):
+        for filename in os.listdir(metrics_dir):
+            if filename.endswith('.json') and filename != f'{os.getpid()}.json':
+                try:
+                    with open(os.path.join(metrics_dir, filename)) as file:
+                        _add_snapshot(totals, json.load(file))
+                except (OSError, ValueError):
+                    continue    # being replaced, or written by an older version
+
+    return totals
+
+
+def exposition(totals):
+    """ formats metrics in the Prometheus text format """
+    lines = []
+    for metric in METRICS:
+        lines.append(f'# HELP {metric.name} {metric.help_text}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        lines.extend(metric.exposition(totals.get(metric.name, {})))
+
+    return '\n'.join(lines) + '\n'
+
+
+def write_snapshot(metrics_dir):
+    """ writes this process's metrics to metrics_dir, replacing its previous snapshot """
+    path = os.path.join(metrics_dir, f'{os.getpid()}.json')
+    with open(path + '.tmp', 'w') as file:
+        json.dump(snapshot(), file)
+    os.replace(path + '.tmp', path)
+
+
+_writer_pid = None
+
+
+def _start_snapshot_writer(metrics_dir, interval=1.0):
+    """ writes this process's metrics every `interval` seconds, started once in each worker process """
+    global _writer_pid
+    with _lock:
+        if _writer_pid == os.getpid():
+            return
+        _writer_pid = os.getpid()
+
+    def run():
+        os.makedirs(metrics_dir, exist_ok=True)
+        while True:
+            time.sleep(interval)
+            try:
+                write_snapshot(metrics_dir)
+            except OSError:
+                pass
+
+    threading.Thread(target=run, name='metrics-writer', daemon=True).start()
+
+
+class MetricsMiddleware:
+    """ Serves /metrics, and times every other request, adding its stage timings in a Server-Timing header.
+        First in settings.MIDDLEWARE, so scrapes need no session, CSRF token or allowed host """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def _start(self, request):
+        """ returns the /metrics response, or starts timing the request and returns None """
+        if settings.METRICS_DIR is not None and _writer_pid != os.getpid():
+            _start_snapshot_writer(settings.METRICS_DIR)
+        if request.path == '/metrics':
+            return HttpResponse(exposition(collect(settings.METRICS_DIR)), content_type='text/plain; version=0.0.4')
+        _request_timings.set([])
+
+        return None
+
+    def _finish(self, response, start):
+        response['Server-Timing'] = server_timing(_request_timings.get(), time.perf_counter() - start)
+        _request_timings.set(None)
+
+        return response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        start = time.perf_counter()
+        metrics_response = self._start(request)
+        if metrics_response is not None:
+            return metrics_response
+
+        return self._finish(self.get_response(request), start)
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        metrics_response = self._start(request)
+        if metrics_response is not None:
+            return metrics_response
+
+        return self._finish(await self.get_response(request), start)
+
+
+class TimedSessionMiddleware(SessionMiddleware):
+    """ Django's SessionMiddleware, timing the session save of each request that used its session """
+
+    def process_response(self, request, response):
+        session = getattr(request, 'session', None)
+        if session is None or not session.accessed:
+            return super().process_response(request, response)
+        with stage('session_save'):
+            return super().process_response(request, response)
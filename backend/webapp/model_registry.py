@@ -0,0 +1,116 @@
+""" ensemble membership read from a config file, and replacement of the loaded models when it changes
+
+    ml_models/registry.json (or the file named by CHESSNN_MODEL_REGISTRY) lists the members, eg.
+
+        {"model_dir": ".", "members": ["general_solver_1", "general_solver_2", "whole_game_3"], "version": "1"}
+
+    where model_dir is relative to the config file, and the optional version distinguishes retrained
+    members with the same names.  When the file changes (edit it, or mv a new one into place), the new
+    set is loaded in a background thread while the old set keeps serving, and then replaces it in a single
+    assignment, so moves are never held up by a model load. """
+
+import json
+import logging
+import os
+import threading
+import time
+from .inference_backends import MEMBER_NAMES, MODEL_DIR
+
+logger = logging.getLogger(__name__)
+
+
+def read_config(path):
+    """ returns {'model_dir', 'member_names', 'version'} from a registry file, or the built-in ensemble if there is none """
+    if path is None or not os.path.exists(path):
+        return {'model_dir': MODEL_DIR, 'member_names': list(MEMBER_NAMES), 'version': None}
+
+    with open(path) as file:
+        config = json.load(file)
+    members = config.get('members')
+    if not isinstance(members, list) or not members or not all(isinstance(name, str) and name for name in members):
+        raise ValueError(f"{path}: 'members' must be a list of model names")
+    model_dir = os.path.join(os.path.dirname(os.path.abspath(path)), config.get('model_dir', '.'))
+
+    return {'model_dir': os.path.normpath(model_dir), 'member_names': members, 'version': config.get('version')}
+
+
+class ModelRegistry:
+    """ Holds the models loaded by `load(config)` for the config file at `path`.  get() loads them on first
+        use; after that, the file is checked at most every `check_interval` seconds, and if it has changed
+        the new models are loaded in a background thread.  Once loaded they replace the current ones, and
+        on_swap(models, config) is called.  If loading fails, the current models are kept """
+
+    def __init__(self, path, load, check_interval=5.0, on_swap=None):
+        self.path = path
+        self.load = load
+        self.check_interval = check_interval
+        self.on_swap = on_swap
+        self.current = None
+        self.config = None
+        self.swaps = 0
+        self.last_error = None
+        self._signature = None
+        self._next_check = 0.0
+        self._loading = False
+        self._lock = threading.Lock()
+
+    def _file_signature(self):
+        """ changes whenever the config file is edited or replaced """
+        try:
+            stat = os.stat(self.path)
+        except (OSError, TypeError):
+            return None
+
+        return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    def get(self):
+        """ returns the current models, loading them on first use """
+        if self.current is None:
+            with self._lock:
+                if self.current is None:
+                    self._signature = self._file_signature()
+                    self._next_check = time.monotonic() + self.check_interval
+                    self.config = read_config(self.path)
+                    self.current = self.load(self.config)
+        else:
+            self.check()
+
+        return self.current
+
+    def check(self):
+        """ starts loading new models in a background thread if the config file has changed, returns True if so """
+        if self.path is None or time.monotonic() < self._next_check:
+            return False
+        with self._lock:
+            if self._loading or time.monotonic() < self._next_check:
+                return False
+            self._next_check = time.monotonic() + self.check_interval
+            signature = self._file_signature()
+            if signature == self._signature:
+                return False
+            self._signature = signature
+            self._loading = True
+        threading.Thread(target=self.reload, name='model-registry', daemon=True).start()
+
+        return True
+
+    def reload(self):
+        """ loads the models in the config file, then replaces the current ones.  Returns True if they were replaced """
+        try:
+            config = read_config(self.path)
+            models = self.load(config)
+        except Exception as error:
+            self.last_error = error
+            logger.exception('could not load the models in %s, keeping the current ones', self.path)
+            return False
+        finally:
+            self._loading = False
+
+        self.config = config
+        self.current = models
+        self.swaps += 1
+        logger.info('now serving %s', ', '.join(config['member_names']))
+        if self.on_swap is not None:
+            self.on_swap(models, config)
+
+        return True
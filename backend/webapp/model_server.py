@@ -0,0 +1,198 @@
+""" local inference server that owns the ensemble, so web workers can share one copy of the models
+
+    Started by 'manage.py run_model_server', and used by web workers through the 'remote' inference
+    backend.  Messages on the Unix socket are little-endian:
+
+        on connect, server sends:  uint32 length | JSON {member_names, model_set, version}
+        client request:            uint32 boards | boards x 32 bytes, packed as move_cache.board_key()
+                                   (0 boards checks the connection is to the models being served)
+        server reply:              uint32 status | uint32 models | float32 predictions [models, boards, 64, 13]
+                               or  uint32 status | uint32 length | utf-8 error message """
+
+import json
+import os
+import socket
+import socketserver
+import struct
+import threading
+import time
+import numpy as np
+
+HEADER = struct.Struct('<II')
+OK = 0
+ERROR = 1
+PACKED_BOARD_SIZE = 32
+
+
+class ModelServerError(RuntimeError):
+    """ raised by the client when the server could not evaluate the boards """
+
+
+def pack_boards(onehot_board_tensors):
+    """ packs boards [boards, 64, 13] two squares per byte, the same as move_cache.board_key() for each board """
+    pieces = np.asarray(onehot_board_tensors).reshape(-1,64,13).argmax(axis=-1).astype(np.uint8)
+
+    return (pieces[:, 0::2] << 4 | pieces[:, 1::2]).tobytes()
+
+
+def unpack_boards(data):
+    """ inverse of pack_boards(), returns float32 one-hot boards [boards, 64, 13] """
+    packed = np.frombuffer(data, dtype=np.uint8).reshape(-1, PACKED_BOARD_SIZE)
+    pieces = np.empty((len(packed), 64), dtype=np.uint8)
+    pieces[:, 0::2] = packed >> 4
+    pieces[:, 1::2] = packed & 15
+
+    return np.eye(13, dtype='float32')[pieces]
+
+
+def recv_exactly(sock, size):
+    """ reads exactly `size` bytes, or raises ConnectionError if the other end closes first """
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:])
+        if count == 0:
+            raise ConnectionError('model server connection closed')
+        received += count
+
+    return bytes(buffer)
+
+
+class _RequestHandler(socketserver.BaseRequestHandler):
+    """ serves one client connection, which may send any number of requests """
+
+    def handle(self):
+        generation, _, _, info = self.server.models
+        info = json.dumps(info).encode()
+        self.request.sendall(struct.pack('<I', len(info)) + info)
+        while True:
+            try:
+                count = struct.unpack('<I', recv_exactly(self.request, 4))[0]
+                data = recv_exactly(self.request, count * PACKED_BOARD_SIZE)
+            except ConnectionError:
+                return
+            if self.server.models[0] != generation:
+                return    # the models were replaced: the client reconnects, and receives the new set's info
+            if count == 0:
+                self.request.sendall(HEADER.pack(OK, 0))
+                continue
+            try:
+                predictions = self.server.predict(unpack_boards(data))
+                reply = HEADER.pack(OK, len(predictions)) + np.ascontiguousarray(predictions, dtype='<f4').tobytes()
+            except Exception as error:
+                message = f'{type(error).__name__}: {error}'.encode()
+                reply = HEADER.pack(ERROR, len(message)) + message
+            self.request.sendall(reply)
+
+
+class ModelServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """ Serves an inference backend's predict_batch() on a Unix socket, one thread per connection.
+        Single boards are passed through `batcher` if given, so requests from different workers
+        share model calls """
+    daemon_threads = True
+
+    def __init__(self, socket_path, backend, batcher=None, version=None):
+        if os.path.exists(socket_path):
+            os.remove(socket_path)    # left behind by a previous server
+        super().__init__(socket_path, _RequestHandler)
+        os.chmod(socket_path, 0o660)
+        self.models = None
+        self.serve_models(backend, batcher, version)
+
+    def serve_models(self, backend, batcher=None, version=None):
+        """ starts serving another set of models.  Connections opened before are closed at their next
+            request, so clients reconnect and see the new model_set, which includes `version` if given.
+            Otherwise the version is the backend's own, if it has one """
+        model_set = backend.model_set if version is None else (backend.model_set, version)
+        if version is None:
+            version = getattr(backend, 'version', None)
+        info = {'member_names': list(backend.member_names), 'model_set': model_set, 'version': version}
+        generation = 0 if self.models is None else self.models[0] + 1
+        self.models = (generation, backend, batcher, info)    # replaced in one assignment
+
+    @property
+    def backend(self):
+        return self.models[1]
+
+    @property
+    def info(self):
+        return self.models[3]
+
+    def predict(self, boards):
+        _, backend, batcher, _ = self.models
+        if batcher is not None and len(boards) == 1:
+            return batcher.predict(boards)
+
+        return backend.predict_batch(boards)
+
+
+class ModelClient:
+    """ Connection to a ModelServer.  Each thread keeps its own connection, opened on first use and
+        reopened after the server restarts or the process forks """
+
+    def __init__(self, socket_path, connect_timeout=60):
+        self.socket_path = socket_path
+        self.connect_timeout = connect_timeout
+        self.info = None
+        self._local = threading.local()
+
+    def _connect(self):
+        """ opens a connection, waiting up to connect_timeout for the server to start """
+        deadline = time.monotonic() + self.connect_timeout
+        while True:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(self.socket_path)
+                length = struct.unpack('<I', recv_exactly(sock, 4))[0]
+                self.info = json.loads(recv_exactly(sock, length))
+                return sock
+            except (FileNotFoundError, ConnectionError):
+                sock.close()
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.5)
+
+    def _socket(self):
+        pid, sock = getattr(self._local, 'connection', (None, None))
+        if pid != os.getpid():
+            sock = self._connect()
+            self._local.connection = (os.getpid(), sock)
+
+        return sock
+
+    def _close(self):
+        pid, sock = getattr(self._local, 'connection', (None, None))
+        if pid == os.getpid():
+            sock.close()
+        self._local.connection = (None, None)
+
+    def connect(self):
+        """ connects now rather than on the first request, returns the server's info """
+        self._socket()
+
+        return self.info
+
+    def check(self):
+        """ reconnects if the server has replaced its models since this thread connected, updating info """
+        self.predict_batch(np.zeros((0,64,13), dtype=bool))
+
+    def predict_batch(self, onehot_board_tensors):
+        """ returns predictions [models, boards, 64, 13] from the server """
+        data = pack_boards(onehot_board_tensors)
+        count = len(data) // PACKED_BOARD_SIZE
+        for attempt in range(2):
+            try:
+                sock = self._socket()
+                sock.sendall(struct.pack('<I', count) + data)
+                status, value = HEADER.unpack(recv_exactly(sock, HEADER.size))
+                payload = recv_exactly(sock, value if status == ERROR else value * count * 64 * 13 * 4)
+                break
+            except ConnectionError:
+                self._close()
+                if attempt == 1:
+                    raise
+        if status == ERROR:
+            raise ModelServerError(payload.decode())
+
+        return np.frombuffer(payload, dtype='<f4').reshape(value, count, 64, 13)
@@ -0,0 +1,76 @@
+""" size-bounded LRU cache of ensemble moves, keyed by board state """
+
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+def board_key(onehot_board_tensor):
+    """ compact hashable key for a one-hot board: the piece index of each square, packed two squares per byte """
+    pieces = np.asarray(onehot_board_tensor).reshape(64,13).argmax(axis=-1).astype(np.uint8)
+
+    return (pieces[0::2] << 4 | pieces[1::2]).tobytes()
+
+
+def key_to_board(key):
+    """ inverse of board_key(), returns a one-hot board [64, 13] """
+    packed = np.frombuffer(key, dtype=np.uint8)
+    pieces = np.empty(64, dtype=np.uint8)
+    pieces[0::2] = packed >> 4
+    pieces[1::2] = packed & 15
+
+    return np.eye(13, dtype=bool)[pieces]
+
+
+class MoveCache:
+    """ Maps board keys to ensemble_solver() results, discarding the least recently used entry once
+        `max_size` entries are held.  Entries belong to one model set, and are all dropped when
+        invalidate() is called with a different one """
+
+    def __init__(self, max_size=10000, model_set=None):
+        self.max_size = max_size
+        self.model_set = model_set
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """ returns the cached result for key, or None """
+        with self._lock:
+            result = self._entries.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+            return result
+
+    def put(self, key, result):
+        """ stores a result, evicting the least recently used entry if the cache is full """
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, model_set=None):
+        """ drops every entry, eg. when the models that produced them have been replaced """
+        with self._lock:
+            self._entries.clear()
+            self.model_set = model_set
+            self.invalidations += 1
+
+    def stats(self):
+        """ counters for monitoring, as a dict """
+        return {'size': len(self._entries), 'max_size': self.max_size, 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'invalidations': self.invalidations}
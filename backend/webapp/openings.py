@@ -0,0 +1,36 @@
+""" opening positions offered by play.html, and positions reachable from them """
+
+import chess
+from . import chess_tools_local as ct
+
+# Selected from play.html: option -> (FEN, message)
+OPENINGS = {
+    'option1': ('1KR2B1R/1PPQ1PP1/P1N3B1/3N3P/3P1n1p/1p4n1/pbpp1pp1/1krq1b1r w KQkq - 0 1',    # Spassky-Fischer
+                ' ...g3h5 suggested (Fischer)'),
+    'option2': ('1KR1QB1R/PPPB2PP/2N2N2/3PPP2/3p4/1pn1p3/pbp2ppp/1kr1qbnr w KQkq - 0 1',      # King's Indian Defence
+                ' ...play g1f3 to finish opening'),
+    'option3': ('1KR1QB1R/PPP3PP/2NPBN2/4PPb1/4pp2/2np4/ppp3pp/1kr1qbnr w KQkq - 0 1',        # Nimzo-Indian Defence
+                ' ...play g1f3 to finish opening'),
+    'option4': ('1K1RQBNR/PPP1P1PP/2N2PB1/3P4/3p2p1/2n2n1p/pppbpp2/1kr1qb1r w KQkq - 0 1',    # Ruy Lopez
+                ' ...play e2e4 to finish opening'),
+}
+
+# Standard position, after the computer's first move
+FIRST_MOVES = ['RNBKQBNR/PPPP1PPP/8/4P3/8/8/pppppppp/rnbkqbnr w KQkq - 0 1',   #1.d4
+               'RNBKQBNR/PPP1PPPP/8/3P4/8/8/pppppppp/rnbkqbnr w KQkq - 0 1',   #1.e4
+               'R1BKQBNR/PPPPPPPP/2N5/8/8/8/pppppppp/rnbkqbnr w KQkq - 0 1',   #1.Nf3
+               'RNBKQBNR/PPPPP1PP/8/5P2/8/8/pppppppp/rnbkqbnr w KQkq - 0 1']   #1.c4
+FIRST_MOVES_MESSAGE = '  ...whole-game mode is experimental !'
+
+
+def opening_fens():
+    """ every position a game can start from, with the human to move """
+    return [fen for fen, message in OPENINGS.values()] + FIRST_MOVES
+
+
+def human_replies(fen):
+    """ returns the one-hot boards reached by each legal human move, ready for ensemble_solver() """
+    onehot = ct.fen_to_one_hot(fen)
+    board = chess.Board(ct.swap_fen_colours(fen, turn='white'), chess960=True)
+
+    return list(ct.apply_moves(onehot, ct.playable_moves(board)))
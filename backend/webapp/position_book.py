@@ -0,0 +1,69 @@
+""" precomputed ensemble moves, stored as a sorted table that is memory-mapped by every worker
+
+    file layout:  MAGIC | uint32 header length | JSON header | records sorted by key
+    each record holds the board given to ensemble_solver() and the board, move, tag and
+    checkmate flag it returned.  Boards are packed with move_cache.board_key() """
+
+import json
+import struct
+import numpy as np
+from .move_cache import board_key, key_to_board
+
+MAGIC = b'CHESSNNBOOK1'
+RECORD = np.dtype([('key', 'S32'), ('board', 'S32'), ('move', 'S5'), ('tag', 'S4'), ('checkmate', '?')])
+
+
+def write_book(path, entries, members, version=None, **info):
+    """ writes a book from a dict of {board_key: (predicted_board, move, tag, checkmate)}, made by the
+        members at the given model registry version """
+    records = np.zeros(len(entries), dtype=RECORD)
+    for i, (key, (predicted_board, move, tag, checkmate)) in enumerate(entries.items()):
+        records[i] = (key,
+                      board_key(predicted_board) if predicted_board is not None else b'',
+                      str(move) if move is not None else b'',
+                      tag,
+                      checkmate)
+    records.sort(order='key')
+
+    header = json.dumps(dict(info, members=list(members), version=version, count=len(records))).encode()
+    with open(path, 'wb') as file:
+        file.write(MAGIC + struct.pack('<I', len(header)) + header)
+        file.write(records.tobytes())
+
+
+class PositionBook:
+    """ Read-only view of a book file.  Records are memory-mapped rather than read, so workers share
+        the same pages through the OS page cache, and lookups are a binary search on the keys """
+
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            if file.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f'{path} is not a position book')
+            header_length = struct.unpack('<I', file.read(4))[0]
+            self.info = json.loads(file.read(header_length))
+        self.members = self.info['members']
+        self.version = self.info.get('version')
+        self.hits = 0
+        self.misses = 0
+        offset = len(MAGIC) + 4 + header_length
+        if self.info['count'] > 0:
+            self._records = np.memmap(path, dtype=RECORD, mode='r', offset=offset, shape=(self.info['count'],))
+        else:
+            self._records = np.zeros(0, dtype=RECORD)
+
+    def __len__(self):
+        return len(self._records)
+
+    def lookup(self, key):
+        """ returns (predicted_board [1, 64, 13], uci move, tag, checkmate) for a board key, or None """
+        keys = self._records['key']
+        i = np.searchsorted(keys, key)
+        if i == len(keys) or keys[i].ljust(32, b'\0') != key:    # numpy strips trailing null bytes
+            self.misses += 1
+            return None
+        self.hits += 1
+        record = self._records[i]
+        if record['checkmate']:
+            return None, None, record['tag'].decode(), True
+
+        return key_to_board(record['board'].ljust(32, b'\0'))[None], record['move'].decode(), record['tag'].decode(), False
@@ -1,5 +1,6 @@
 import numpy as np
 import pytest
+import chess
 import os
 import sys
 import inspect
@@ -101,3 +102,101 @@ def test_most_similar_move():
 
 
 
+
+
+def test_one_hot_to_png_matches_pil_drawing():
+    rng = np.random.default_rng(0)
+    for _ in range(20):
+        pieces = rng.integers(0, 13, size=64)
+        one_hot = np.eye(13, dtype=bool)[pieces]
+        image = ct.one_hot_to_png(one_hot)
+        expected = ct.draw_board([ct.PNG_SYMBOLS[piece] for piece in pieces])
+        assert image.size == expected.size
+        assert np.all(np.array(image) == np.array(expected))
+
+
+def test_one_hot_to_svg_places_each_piece():
+    import xml.etree.ElementTree as ET
+    svg = ET.fromstring(ct.one_hot_to_svg(ct.fen_to_one_hot(FEN)))
+    symbols = {'#' + text.get('id'): text.text for text in svg.iter('{http://www.w3.org/2000/svg}text')}
+    placed = {(int(use.get('x')) // 40, int(use.get('y')) // 40): symbols[use.get('href')]
+              for use in svg.iter('{http://www.w3.org/2000/svg}use')}
+    assert len(placed) == 32
+    assert placed[(4, 0)] == ct.PNG_SYMBOLS[4] and placed[(4, 7)] == ct.PNG_SYMBOLS[10]    # e8 king, e1 king
+
+
+CORPUS = ['1KR2B1R/1PPQ1PP1/P1N3B1/3N3P/3P1n1p/1p4n1/pbpp1pp1/1krq1b1r w KQkq - 0 1',
+          'RNBKQBNR/PPPP1PPP/8/4P3/8/8/pppppppp/rnbkqbnr w KQkq - 0 1',
+          '8/8/8/8/8/8/p7/8 w KQkq - 0 1',
+          '8/8/8/8/8/8/8/8 w KQkq - 0 1',
+          FEN]
+
+
+@pytest.mark.parametrize('fen', CORPUS)
+def test_fen_to_one_hot(fen):
+    one_hot = ct.fen_to_one_hot(fen)
+    assert one_hot.shape == (64,13)
+    assert np.all(one_hot == ct.one_hot_encode(ct.fen_to_ascii(fen)))
+    assert ct.one_hot_to_fen(one_hot, turn='white') == fen
+
+
+@pytest.mark.parametrize('fen', CORPUS)
+def test_board_to_one_hot(fen):
+    board = chess.Board(fen, chess960=True)
+    assert np.all(ct.board_to_one_hot(board) == ct.fen_to_one_hot(fen))
+    swapped = ct.fen_to_one_hot(ct.swap_fen_colours(fen, turn='white'))
+    assert np.all(ct.board_to_one_hot(board, swap_colours=True) == swapped)
+
+
+def test_swap_fen_colours():
+    assert ct.swap_fen_colours(FEN, turn='black') == 'RNBQKBNR/PPPPPPPP/8/8/8/8/pppppppp/rnbqkbnr b KQkq - 0 1'
+    assert ct.swap_fen_colours('3K4/8/8/8/8/8/8/3k4', turn='white') == '3k4/8/8/8/8/8/8/3K4'
+
+
+def test_find_legal_moves_returns_contiguous_array():
+    fen = 'R2K3R/8/8/8/8/8/p7/r2k3r w KQkq - 0 1'
+    candidates, algebraic_moves = ct.find_legal_moves(fen)
+    assert isinstance(candidates, np.ndarray)
+    assert candidates.flags['C_CONTIGUOUS']
+    assert candidates.shape == (len(algebraic_moves), 64, 13)
+    one_hot = ct.fen_to_one_hot(fen)
+    for candidate, move in zip(candidates, algebraic_moves):
+        assert np.all(candidate == ct.update_one_hot(one_hot, move))
+        assert candidate.sum() == 64
+
+    # castling moves both king and rook
+    fens = [ct.one_hot_to_fen(candidate, turn='white') for candidate in candidates]
+    assert '1KR4R/8/8/8/8/8/p7/r2k3r w KQkq - 0 1' in fens
+    assert 'R4RK1/8/8/8/8/8/p7/r2k3r w KQkq - 0 1' in fens
+
+
+def test_apply_moves_without_moves():
+    assert ct.apply_moves(ct.fen_to_one_hot(FEN), []).shape == (0,64,13)
+
+
+@pytest.mark.parametrize('fen', ['rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1',
+                                 'rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq e3 0 1',
+                                 'r3k2r/pPpb1ppp/1n3n2/4p3/2B1P3/2N2N2/PPPP1pPP/R1BQK2R b - - 0 12'])
+def test_app_moves_convert_to_standard_moves(fen):
+    app_fen, mirrored = ct.standard_fen_to_app(fen)
+    assert mirrored == (' b ' in fen)
+    board = chess.Board(fen)
+    app_board = chess.Board(ct.swap_fen_colours(app_fen, turn='black'), chess960=True)
+    candidates, moves = ct.find_legal_moves(app_fen)
+    # the app always allows castling, so only compare other moves, and pawns only promote to queens
+    standard_moves = {board.parse_uci(ct.app_move_to_standard(move, mirrored).uci()) for move in moves if not app_board.is_castling(move)}
+    assert standard_moves == {move for move in ct.playable_moves(board) if not board.is_castling(move)}
+
+
+def test_standard_start_matches_app_orientation():
+    app_fen, mirrored = ct.standard_fen_to_app(chess.STARTING_FEN)
+    assert app_fen.split()[0] == 'RNBKQBNR/PPPPPPPP/8/8/8/8/pppppppp/rnbkqbnr'
+
+
+@pytest.mark.parametrize('fen', ['r3k2r/8/8/8/8/8/8/R3K2R w KQkq - 0 1', 'r3k2r/8/8/8/8/8/8/R3K2R b KQkq - 0 1'])
+def test_app_castling_converts_to_standard_castling(fen):
+    app_fen, mirrored = ct.standard_fen_to_app(fen)
+    app_board = chess.Board(ct.swap_fen_colours(app_fen, turn='black'), chess960=True)
+    board = chess.Board(fen)
+    castling = [move for move in ct.find_legal_moves(app_fen)[1] if app_board.is_castling(move)]
+    assert sorted(board.san(board.parse_uci(ct.app_move_to_standard(move, mirrored).uci())) for move in castling) == ['O-O', 'O-O-O']
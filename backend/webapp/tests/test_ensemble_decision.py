@@ -0,0 +1,134 @@
+import numpy as np
+import os
+import sys
+import inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+import chess_tools_local as ct
+from ensemble_decision import adaptive_decide, decide, confidence_scores
+
+
+CORPUS = ['1KR2B1R/1PPQ1PP1/P1N3B1/3N3P/3P1n1p/1p4n1/pbpp1pp1/1krq1b1r w KQkq - 0 1',
+          '1KR1QB1R/PPPB2PP/2N2N2/3PPP2/3p4/1pn1p3/pbp2ppp/1kr1qbnr w KQkq - 0 1',
+          '1KR1QB1R/PPP3PP/2NPBN2/4PPb1/4pp2/2np4/ppp3pp/1kr1qbnr w KQkq - 0 1',
+          '1K1RQBNR/PPP1P1PP/2N2PB1/3P4/3p2p1/2n2n1p/pppbpp2/1kr1qb1r w KQkq - 0 1',
+          'RNBKQBNR/PPPP1PPP/8/4P3/8/8/pppppppp/rnbkqbnr w KQkq - 0 1',
+          'R2K4/P7/8/8/8/8/8/8 w KQkq - 0 1']
+
+
+def legacy_decide(predictions, allowed_tensors, allowed_moves):
+    """ the original nested-loop decision criteria from web_ensemble_solver.py """
+    raw_total = np.zeros((64,13), dtype=float)
+    legal_total = np.zeros((64,13), dtype=float)
+    max_lc_score = float('-inf')
+    legal_count = 0
+    for y_predict in predictions:
+        y_predict = y_predict.reshape(1,64,13)
+        raw_total = np.add(raw_total, y_predict)
+        y_predict_bool = ct.booleanise(y_predict)
+        for tensor in allowed_tensors:
+            if np.all(y_predict_bool == tensor):
+                legal_total = np.add(legal_total, y_predict)
+                legal_count += 1
+            c_score = ct.confidence_score(y_predict)
+            if c_score > max_lc_score:
+                mcf_leg_predict = y_predict
+                max_lc_score = c_score
+    for i, tensor in enumerate(allowed_tensors):
+        if np.all(tensor == ct.booleanise(raw_total)):
+            return raw_total, allowed_moves[i], 'avrw', False
+    for i, tensor in enumerate(allowed_tensors):
+        if np.all(tensor == ct.booleanise(legal_total)):
+            return legal_total, allowed_moves[i], 'avlg', False
+    if legal_count >= 1:
+        for i, tensor in enumerate(allowed_tensors):
+            if np.all(tensor == ct.booleanise(mcf_leg_predict)):
+                return mcf_leg_predict, allowed_moves[i], 'mclg', False
+        return None
+    else:
+        try:
+            ensemble_predict, ai_move = ct.most_similar_move(allowed_tensors, raw_total, allowed_moves)
+            return ensemble_predict, ai_move, 'mslm', False
+        except:
+            return None, None, 'chkm', True
+
+
+def fake_predictions(rng, candidates, n_models=3):
+    """ softmax outputs that lean towards random candidates with varying strength and noise """
+    targets = [candidates[rng.integers(len(candidates))] for _ in range(n_models)]
+    if rng.random() < 0.3:
+        targets = [targets[0]] * n_models
+    logits = [rng.uniform(0, 6) * t + rng.normal(0, rng.uniform(0.5, 3), size=(64,13)) for t in targets]
+    logits = np.array(logits)
+    exp = np.exp(logits - logits.max(axis=-1, keepdims=True))
+
+    return (exp / exp.sum(axis=-1, keepdims=True)).astype('float32')
+
+
+def test_decide_matches_legacy_on_corpus():
+    rng = np.random.default_rng(2024)
+    tags = set()
+    compared = 0
+    for fen in CORPUS:
+        candidates, moves = ct.find_legal_moves(fen)
+        for _ in range(30):
+            predictions = fake_predictions(rng, candidates)
+            expected = legacy_decide(predictions, candidates, moves)
+            if expected is None:
+                continue
+            _, ai_move, tag, checkmate = decide(predictions, candidates, moves)
+            assert (ai_move, tag, checkmate) == expected[1:]
+            tags.add(tag)
+            compared += 1
+
+    assert compared > 150
+    assert {'avrw', 'avlg', 'mclg', 'mslm'} <= tags
+
+
+def test_decide_without_legal_moves_is_checkmate():
+    predictions = np.full((3,64,13), 1/13, dtype='float32')
+    assert decide(predictions, np.zeros((0,64,13), dtype=bool), [])[1:] == (None, 'chkm', True)
+
+
+def test_confidence_scores_match_confidence_score():
+    rng = np.random.default_rng(0)
+    predictions = rng.random((4,64,13))
+    expected = [ct.confidence_score(p) for p in predictions]
+    assert np.allclose(confidence_scores(predictions), expected)
+
+
+def test_adaptive_decide_matches_decide_on_corpus():
+    rng = np.random.default_rng(7)
+    saved = 0
+    for fen in CORPUS:
+        candidates, moves = ct.find_legal_moves(fen)
+        for _ in range(30):
+            predictions = fake_predictions(rng, candidates, n_models=5)
+            (_, ai_move, tag, checkmate), evaluated = adaptive_decide(lambda i: predictions[i], [4, 0, 2, 1, 3],
+                                                                      candidates, moves)
+            assert (ai_move, tag, checkmate) == decide(predictions, candidates, moves)[1:]
+            saved += 5 - evaluated
+
+    assert saved > 0
+
+
+def test_adaptive_decide_stops_when_decided():
+    candidates, moves = ct.find_legal_moves(CORPUS[4])
+    predictions = np.repeat(candidates[:1].astype('float32'), 3, axis=0)    # certain of the first move
+    calls = []    # the third member adds at most 1 to any square, so two certain members decide it
+    result, evaluated = adaptive_decide(lambda i: calls.append(i) or predictions[i], [2, 0, 1], candidates, moves)
+    assert result[1:] == (moves[0], 'avrw', False)
+    assert evaluated == 2 and calls == [2, 0]
+
+    # Without legal moves no member is needed
+    assert adaptive_decide(lambda i: predictions[i], [0, 1, 2], np.zeros((0,64,13), dtype=bool), []) == \
+        ((None, None, 'chkm', True), 0)
+
+
+def test_adaptive_decide_agreement():
+    candidates, moves = ct.find_legal_moves(CORPUS[4])
+    predictions = 0.4 * candidates[[0, 0, 1]] + 0.6 / 13    # two members lean towards the first move
+    (_, ai_move, tag, _), evaluated = adaptive_decide(lambda i: predictions[i], [0, 1, 2], candidates, moves, agreement=2)
+    assert (ai_move, tag, evaluated) == (moves[0], 'agrm', 2)
+    assert adaptive_decide(lambda i: predictions[i], [0, 1, 2], candidates, moves)[1] == 3
@@ -0,0 +1,98 @@
+import chess
+import numpy as np
+import os
+import sys
+import inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+backenddir = os.path.dirname(os.path.dirname(currentdir))
+sys.path.insert(0, backenddir)
+from webapp import chess_tools_local as ct
+from webapp.game_state import Game, GameCache
+
+
+OPENING = '1KR1QB1R/PPPB2PP/2N2N2/3PPP2/3p4/1pn1p3/pbp2ppp/1kr1qbnr w KQkq - 0 1'
+ROOKS = 'R2K3R/8/8/8/8/8/8/r2k3r w KQkq - 0 1'    # computer's king and rooks on top, the human's below
+PAWNS = 'R2K3R/pPPPPPP1/8/8/8/8/1pppppPp/r2k3r w KQkq - 0 1'    # pawns about to promote, and to pass each other
+EN_PASSANT = '3k4/8/8/3pP3/8/8/8/3K4 w - d6 0 1'    # python-chess's orientation, the human may take d5 en passant
+
+
+def test_game_matches_fen_tools():
+    game = Game.from_fen(OPENING)
+    move = game.find_move('f2f3')
+    assert move is not None and game.find_move('f3f2') == move
+    game.push(move)
+    onehot = ct.update_one_hot(ct.fen_to_one_hot(OPENING), 'f2f3')
+    assert np.all(game.onehot() == onehot)
+
+    candidates, moves = game.candidates(onehot)
+    expected_candidates, expected_moves = ct.find_legal_moves(ct.one_hot_to_fen(onehot))
+    assert moves == expected_moves
+    assert np.all(candidates == expected_candidates)
+
+
+def test_candidates_match_pushed_moves():
+    rng = np.random.default_rng(0)
+    seen = set()
+    starts = [lambda: Game(chess.Board(EN_PASSANT, chess960=True))] + [lambda fen=fen: Game.from_fen(fen) for fen in [ROOKS, PAWNS, OPENING]]
+    for start in starts:
+        for _ in range(6):
+            game = start()
+            for _ in range(40):
+                candidates, moves = game.candidates(game.onehot())
+                if not moves:
+                    break
+                for move, candidate in zip(moves, candidates):
+                    seen.update(kind for kind, found in [('castling', game.board.is_castling(move)),
+                                                         ('en passant', game.board.is_en_passant(move)),
+                                                         ('promotion', move.promotion is not None)] if found)
+                    after = Game(game.board.copy(stack=False))
+                    after.push(move)
+                    assert np.all(candidate == after.onehot()), move
+                game.push(moves[rng.integers(len(moves))])
+
+    assert seen == {'castling', 'en passant', 'promotion'}
+    assert all(move.promotion in (None, chess.QUEEN) for move in Game.from_fen(PAWNS).legal_moves())
+
+
+def test_game_castles_on_the_apps_squares():
+    game = Game.from_fen(ROOKS)
+    game.push(game.find_move('d1a1'))
+    assert game.placement() == 'R2K3R/8/8/8/8/8/8/1kr4r'
+    game.push(game.find_move('d8h8'))
+    assert game.placement() == 'R4RK1/8/8/8/8/8/8/1kr4r'
+    assert game.placement() == ct.one_hot_to_fen(ct.update_one_hot(ct.update_one_hot(ct.fen_to_one_hot(ROOKS), 'd1a1'), 'd8h8')).split(' ')[0]
+    assert not any(game.board.is_castling(move) for move in game.legal_moves())
+    assert len(game.board.move_stack) == 2
+
+    game.board.pop()
+    assert game.placement() == 'R2K3R/8/8/8/8/8/8/1kr4r'
+
+
+def test_game_keeps_castling_rights():
+    game = Game.from_fen(ROOKS)
+    for move in ['a1a2', 'h8h7', 'a2a1', 'h7h8']:
+        game.push(game.find_move(move))
+    assert game.placement() == ROOKS.split(' ')[0]
+    assert game.find_move('d1a1') is None             # the rook has moved
+    assert game.find_move('d1h1') is not None
+    assert Game.from_fen(ROOKS).find_move('d1a1') is not None
+
+    restored = Game.restore(ROOKS, ROOKS, ['a1a2', 'h8h7', 'a2a1', 'h7h8'])
+    assert restored.find_move('d1a1') is None and len(restored.board.move_stack) == 4
+
+    # Moves that do not reach the FEN are ignored
+    assert Game.restore(ROOKS, ROOKS, ['a1a2']).find_move('d1a1') is not None
+
+
+def test_game_cache_checks_position():
+    cache = GameCache(max_size=2)
+    cache.put('a', Game.from_fen(OPENING))
+    cache.put('b', Game.from_fen(ROOKS))
+    assert cache.take('a', ROOKS) is None               # another worker has moved this game on
+    assert cache.take('b', ROOKS) is not None
+    assert cache.take('b', ROOKS) is None               # taken while its move is played
+
+    cache.put('c', Game.from_fen(ROOKS))
+    cache.put('d', Game.from_fen(ROOKS))
+    cache.put('e', Game.from_fen(ROOKS))
+    assert cache.stats() == {'size': 2, 'max_size': 2, 'hits': 1, 'misses': 2, 'evictions': 1}
@@ -0,0 +1,26 @@
+import json
+import os
+import subprocess
+import sys
+import inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+backenddir = os.path.dirname(os.path.dirname(currentdir))
+
+
+def run_fresh(code):
+    """ runs code in a fresh interpreter from the backend folder, returns its output """
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE='django_wrapper.settings', DJANGO_SECRET_KEY='test')
+    return subprocess.run([sys.executable, '-c', code], cwd=backenddir, env=env,
+                          capture_output=True, text=True, check=True).stdout
+
+
+def test_chess_tools_import_is_silent():
+    assert run_fresh('import webapp.chess_tools_local') == ''
+
+
+def test_views_import_does_not_load_models():
+    output = run_fresh('import json, sys, django; django.setup(); import django_wrapper.urls; '
+                       'from webapp import web_ensemble_solver as es; '
+                       'print(json.dumps([es.registry.current is None, "tensorflow" in sys.modules, "PIL.Image" in sys.modules]))')
+
+    assert json.loads(output) == [True, False, False]
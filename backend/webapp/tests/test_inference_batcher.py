@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+import os
+import sys
+import inspect
+import threading
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+from inference_batcher import MicroBatcher
+
+
+def fake_predict_batch(boards):
+    """ two 'models' that echo the board, scaled differently """
+    boards = boards.astype(float)
+    return np.stack([boards, boards * 2])
+
+
+def test_single_board_gets_own_predictions():
+    batcher = MicroBatcher(fake_predict_batch, window=0.001)
+    board = np.zeros((1,64,13), dtype=bool)
+    board[0, 5, 3] = 1
+    result = batcher.predict(board)
+    assert result.shape == (2,1,64,13)
+    assert result[1, 0, 5, 3] == 2
+
+
+def test_concurrent_boards_share_a_batch():
+    batcher = MicroBatcher(fake_predict_batch, window=0.2, max_batch=8)
+    results = {}
+
+    def client(n):
+        board = np.zeros((64,13), dtype=bool)
+        board[n, n % 13] = 1
+        results[n] = batcher.predict(board)
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert batcher.board_count == 8
+    assert batcher.batch_count < 8
+    for n, result in results.items():
+        assert result[0, 0, n, n % 13] == 1
+        assert result[0, 0].sum() == 1
+
+
+def test_errors_are_raised_in_caller():
+    def failing_predict_batch(boards):
+        raise ValueError('model failed')
+
+    batcher = MicroBatcher(failing_predict_batch, window=0)
+    with pytest.raises(ValueError, match='model failed'):
+        batcher.predict(np.zeros((1,64,13)))
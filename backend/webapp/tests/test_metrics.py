@@ -0,0 +1,73 @@
+import pytest
+import os
+import sys
+import inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+backenddir = os.path.dirname(os.path.dirname(currentdir))
+sys.path.insert(0, backenddir)
+from webapp import metrics
+
+
+@pytest.fixture(autouse=True)
+def empty_metrics():
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+def test_histogram_buckets_are_cumulative():
+    metrics.STAGE_SECONDS.observe('inference', 0.003)
+    metrics.STAGE_SECONDS.observe('inference', 0.003)
+    metrics.STAGE_SECONDS.observe('inference', 20)
+    text = metrics.exposition(metrics.collect())
+
+    assert 'chessnn_stage_seconds_bucket{stage="inference",le="0.0025"} 0' in text
+    assert 'chessnn_stage_seconds_bucket{stage="inference",le="0.005"} 2' in text
+    assert 'chessnn_stage_seconds_bucket{stage="inference",le="10.0"} 2' in text
+    assert 'chessnn_stage_seconds_bucket{stage="inference",le="+Inf"} 3' in text
+    assert 'chessnn_stage_seconds_count{stage="inference"} 3' in text
+    assert '# TYPE chessnn_stage_seconds histogram' in text
+
+
+def test_decision_counts_every_criterion_reached():
+    metrics.record_decision('avrw', 0.001)
+    metrics.record_decision('mclg', 0.002)
+    reached = metrics.collect()['chessnn_decision_criteria_reached_total']
+
+    assert reached == {'avrw': [2], 'avlg': [1], 'mclg': [1]}
+    assert metrics.collect()['chessnn_decision_seconds']['mclg'][-1] == 1
+
+    # the adaptive ensemble's agreement exit is counted on its own, not as reaching avrw
+    metrics.record_decision('agrm', 0.001)
+    reached = metrics.collect()['chessnn_decision_criteria_reached_total']
+    assert reached == {'avrw': [2], 'avlg': [1], 'mclg': [1], 'agrm': [1]}
+
+
+def test_server_timing_adds_up_repeated_stages():
+    timings = [('legal_moves', None, 0.001), ('model', 'remote', 0.010), ('legal_moves', None, 0.002)]
+    header = metrics.server_timing(timings, 0.020)
+
+    assert header == 'legal_moves;dur=3.000, model;desc="remote";dur=10.000, total;dur=20.000'
+
+
+def test_stage_is_added_to_the_current_request_only():
+    with metrics.stage('outside'):
+        pass
+    token = metrics._request_timings.set([])
+    with metrics.stage('validate'):
+        pass
+    timings = metrics._request_timings.get()
+    metrics._request_timings.reset(token)
+
+    assert [name for name, _, _ in timings] == ['validate']
+    assert set(metrics.collect()['chessnn_stage_seconds']) == {'outside', 'validate'}
+
+
+def test_collect_adds_other_workers_snapshots(tmp_path):
+    metrics.record_model('fused_ensemble', 0.02)
+    metrics.write_snapshot(tmp_path)
+    os.rename(tmp_path / f'{os.getpid()}.json', tmp_path / '1.json')    # as if written by another worker
+    metrics.record_model('fused_ensemble', 0.02)
+
+    assert metrics.collect(tmp_path)['chessnn_model_seconds']['fused_ensemble'][-1] == 3
+    assert metrics.collect()['chessnn_model_seconds']['fused_ensemble'][-1] == 2
@@ -0,0 +1,90 @@
+import json
+import pytest
+import os
+import sys
+import inspect
+import time
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+backenddir = os.path.dirname(os.path.dirname(currentdir))
+sys.path.insert(0, backenddir)
+from webapp.inference_backends import MEMBER_NAMES, MODEL_DIR, fused_model_matches, fused_model_path
+from webapp.model_registry import ModelRegistry, read_config
+
+
+def write_config(path, members, **extra):
+    with open(path, 'w') as file:
+        json.dump({'members': members, **extra}, file)
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))    # a visible change, however fast the test
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_config_defaults_to_the_built_in_ensemble(tmp_path):
+    assert read_config(str(tmp_path / 'missing.json')) == {'model_dir': MODEL_DIR, 'member_names': MEMBER_NAMES, 'version': None}
+
+
+def test_config_model_dir_is_relative_to_the_file(tmp_path):
+    path = tmp_path / 'registry.json'
+    write_config(path, ['model_a'], model_dir='models', version='3')
+    assert read_config(str(path)) == {'model_dir': str(tmp_path / 'models'), 'member_names': ['model_a'], 'version': '3'}
+
+    write_config(path, [])
+    with pytest.raises(ValueError):
+        read_config(str(path))
+
+
+def test_fused_model_is_rebuilt_for_a_new_version(tmp_path):
+    path = tmp_path / 'registry.json'
+    write_config(path, ['model_a', 'model_b'], version='1')
+    config = read_config(str(path))
+    assert not fused_model_matches(config['model_dir'], config['member_names'], config['version'])
+
+    os.makedirs(fused_model_path(str(tmp_path)))
+    with open(os.path.join(fused_model_path(str(tmp_path)), 'members.json'), 'w') as file:
+        json.dump({'members': config['member_names'], 'version': config['version']}, file)
+    assert fused_model_matches(config['model_dir'], config['member_names'], config['version'])
+
+    # retrained members with the same names
+    write_config(path, ['model_a', 'model_b'], version='2')
+    config = read_config(str(path))
+    assert not fused_model_matches(config['model_dir'], config['member_names'], config['version'])
+
+
+def test_changed_config_is_loaded_in_the_background(tmp_path):
+    path = tmp_path / 'registry.json'
+    write_config(path, ['model_a'])
+    swapped = []
+    registry = ModelRegistry(str(path), lambda config: tuple(config['member_names']), check_interval=0,
+                             on_swap=lambda models, config: swapped.append(models))
+    assert registry.get() == ('model_a',)
+    assert registry.check() is False
+
+    write_config(path, ['model_a', 'model_b'])
+    registry.get()
+    wait_for(lambda: registry.swaps == 1)
+    assert registry.get() == ('model_a', 'model_b')
+    assert swapped == [('model_a', 'model_b')]
+
+
+def test_failed_load_keeps_the_current_models(tmp_path):
+    path = tmp_path / 'registry.json'
+    write_config(path, ['model_a'])
+
+    def load(config):
+        if 'broken' in config['member_names']:
+            raise OSError('no such model')
+        return tuple(config['member_names'])
+
+    registry = ModelRegistry(str(path), load, check_interval=0)
+    registry.get()
+    write_config(path, ['broken'])
+    assert registry.check() is True
+    wait_for(lambda: registry.last_error is not None)
+    assert registry.get() == ('model_a',)
+    assert registry.swaps == 0
@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+import os
+import sys
+import inspect
+import threading
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+backenddir = os.path.dirname(os.path.dirname(currentdir))
+sys.path.insert(0, backenddir)
+from webapp import chess_tools_local as ct
+from webapp.inference_backends import RemoteBackend
+from webapp.move_cache import board_key
+from webapp.model_server import ModelServer, ModelServerError, pack_boards, unpack_boards
+
+
+FEN = 'R2K4/P7/8/8/8/8/8/8 w KQkq - 0 1'
+
+
+class FakeBackend:
+    """ two 'models' that echo the board, scaled differently """
+    name = 'fake'
+    member_names = ['model_a', 'model_b']
+    model_set = ('fake', ('model_a', 'model_b'))
+
+    def predict_batch(self, boards):
+        boards = np.asarray(boards, dtype='float32')
+        if boards[:, :, 0].any():
+            raise ValueError('no rooks allowed')
+        return np.stack([boards, boards * 2])
+
+
+@pytest.fixture
+def server(tmp_path):
+    server = ModelServer(str(tmp_path / 'models.sock'), FakeBackend())
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_packed_boards_match_board_keys():
+    candidates, moves = ct.find_legal_moves(FEN)
+    data = pack_boards(candidates)
+    assert data == b''.join(board_key(candidate) for candidate in candidates)
+    assert np.array_equal(unpack_boards(data), candidates)
+
+
+def test_remote_backend_returns_server_predictions(server):
+    backend = RemoteBackend(server.server_address, connect_timeout=1)
+    assert backend.member_names == ['model_a', 'model_b']
+    assert backend.model_set == ('remote', ('fake', ('model_a', 'model_b')))
+
+    candidates, moves = ct.find_legal_moves(FEN)
+    predictions = backend.predict_batch(candidates)
+    assert predictions.shape == (2, len(candidates), 64, 13)
+    assert np.array_equal(predictions[1], candidates * 2)
+
+
+def test_remote_backend_raises_server_errors(server):
+    backend = RemoteBackend(server.server_address, connect_timeout=1)
+    board = ct.fen_to_one_hot('r7/8/8/8/8/8/8/8 w KQkq - 0 1')
+    with pytest.raises(ModelServerError, match='no rooks allowed'):
+        backend.predict_batch(board)
+
+    # the connection is still usable after an error
+    assert backend.predict_batch(ct.fen_to_one_hot(FEN)).shape == (2, 1, 64, 13)
+
+
+class OtherBackend(FakeBackend):
+    """ a replacement set of models, predicting three times the board """
+    model_set = ('other', ('model_a', 'model_b'))
+
+    def predict_batch(self, boards):
+        boards = np.asarray(boards, dtype='float32')
+        return np.stack([boards * 3, boards * 3])
+
+
+def test_clients_reconnect_to_new_models(server):
+    backend = RemoteBackend(server.server_address, connect_timeout=1)
+    board = ct.fen_to_one_hot(FEN)
+    assert backend.predict_batch(board).max() == 2
+
+    server.serve_models(OtherBackend(), version='2')
+    assert backend.predict_batch(board).max() == 3
+    assert backend.model_set == ('remote', (('other', ('model_a', 'model_b')), '2'))
+    assert backend.version == '2'
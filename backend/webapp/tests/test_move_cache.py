@@ -0,0 +1,45 @@
+import numpy as np
+import os
+import sys
+import inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+import chess_tools_local as ct
+from move_cache import MoveCache, board_key, key_to_board
+
+
+FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+
+
+def test_board_key_ignores_probability_values():
+    one_hot = ct.one_hot_encode(ct.fen_to_ascii(FEN))
+    probabilities = one_hot * 0.8 + 0.01
+    assert board_key(one_hot) == board_key(probabilities.reshape(1,64,13))
+    assert len(board_key(one_hot)) == 32
+
+
+def test_key_to_board_reverses_board_key():
+    one_hot = ct.one_hot_encode(ct.fen_to_ascii(FEN))
+    assert np.all(key_to_board(board_key(one_hot)) == one_hot)
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = MoveCache(max_size=2)
+    cache.put(b'a', 1)
+    cache.put(b'b', 2)
+    assert cache.get(b'a') == 1
+    cache.put(b'c', 3)
+    assert cache.get(b'b') is None
+    assert cache.get(b'a') == 1
+    assert cache.get(b'c') == 3
+    assert cache.stats() == {'size': 2, 'max_size': 2, 'hits': 3, 'misses': 1, 'evictions': 1, 'invalidations': 0}
+
+
+def test_invalidate_drops_entries_for_new_model_set():
+    cache = MoveCache(max_size=10, model_set='old')
+    cache.put(b'a', 1)
+    cache.invalidate('new')
+    assert cache.get(b'a') is None
+    assert cache.model_set == 'new'
+    assert len(cache) == 0
@@ -0,0 +1,52 @@
+import numpy as np
+import chess
+import os
+import sys
+import inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+backenddir = os.path.dirname(os.path.dirname(currentdir))
+sys.path.insert(0, backenddir)
+from webapp import chess_tools_local as ct
+from webapp.move_cache import board_key
+from webapp.position_book import PositionBook, write_book
+
+
+FEN = 'R2K4/P7/8/8/8/8/8/8 w KQkq - 0 1'
+
+
+def test_book_lookup_returns_stored_moves(tmp_path):
+    candidates, moves = ct.find_legal_moves(FEN)
+    entries = {board_key(candidate): (candidates[0], moves[0], 'avrw', False) for candidate in candidates[1:]}
+    entries[board_key(candidates[0])] = (None, None, 'chkm', True)
+    path = tmp_path / 'book.bin'
+    write_book(path, entries, ['model_a', 'model_b'], depth=1)
+
+    book = PositionBook(path)
+    assert len(book) == len(entries)
+    assert book.members == ['model_a', 'model_b']
+    assert book.info['depth'] == 1
+    for candidate in candidates[1:]:
+        predicted_board, move, tag, checkmate = book.lookup(board_key(candidate))
+        assert np.all(predicted_board[0] == candidates[0])
+        assert chess.Move.from_uci(move) == moves[0]
+        assert (tag, checkmate) == ('avrw', False)
+    assert book.lookup(board_key(candidates[0])) == (None, None, 'chkm', True)
+
+
+def test_book_lookup_misses_unknown_board(tmp_path):
+    path = tmp_path / 'book.bin'
+    write_book(path, {}, ['model_a'])
+    book = PositionBook(path)
+    assert book.lookup(board_key(ct.one_hot_encode(ct.fen_to_ascii(FEN)))) is None
+    assert book.misses == 1
+
+
+def test_book_records_registry_version(tmp_path):
+    path = tmp_path / 'book.bin'
+    write_book(path, {}, ['model_a'], version='1')
+    assert PositionBook(path).version == '1'
+
+    write_book(path, {}, ['model_a'], version='2')
+    assert PositionBook(path).version == '2'
+    write_book(path, {}, ['model_a'])
+    assert PositionBook(path).version is None
@@ -0,0 +1,266 @@
+import json
+import numpy as np
+import pytest
+import os
+import sys
+import inspect
+import threading
+import types
+from unittest import mock
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+backenddir = os.path.dirname(os.path.dirname(currentdir))
+sys.path.insert(0, backenddir)
+from webapp.game_state import Game
+from webapp.model_server import ModelServer
+
+
+OPENING = '1KR1QB1R/PPPB2PP/2N2N2/3PPP2/3p4/1pn1p3/pbp2ppp/1kr1qbnr w KQkq - 0 1'    # openings.py option2
+
+
+class FakeBackend:
+    """ two 'models' that predict the board they are given, so the computer plays a legal move quickly """
+    name = 'fake'
+    member_names = ['model_a', 'model_b']
+    model_set = ('fake', ('model_a', 'model_b'))
+
+    def predict_batch(self, boards):
+        boards = np.asarray(boards, dtype='float32').reshape(-1,64,13)
+        return np.stack([boards, boards])
+
+
+@pytest.fixture(scope='module')
+def views(tmp_path_factory):
+    """ the views module, with Django set up to use the fake models through a model server """
+    socket_path = str(tmp_path_factory.mktemp('models') / 'models.sock')
+    server = ModelServer(socket_path, FakeBackend())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    env = {'DJANGO_SETTINGS_MODULE': 'django_wrapper.settings', 'DJANGO_SECRET_KEY': 'test',
+           'CHESSNN_INFERENCE_BACKEND': 'remote', 'CHESSNN_MODEL_SOCKET': socket_path,
+           'CHESSNN_MOVE_CACHE_SIZE': '0', 'CHESSNN_POSITION_BOOK': 'none'}
+    with mock.patch.dict(os.environ, env):
+        import django
+        from django.test.utils import setup_test_environment, teardown_test_environment
+        django.setup()
+        setup_test_environment()
+        from webapp import views
+
+    yield views
+    teardown_test_environment()
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(params=['sync', 'async'])
+def urls(views, request):
+    """ the app's URLs, served by the WSGI views, or the ASGI views as with CHESSNN_ASYNC_VIEWS=1 """
+    from django.test import override_settings
+    from django.urls import path
+
+    urlconf = 'django_wrapper.urls'
+    if request.param == 'async':
+        urlconf = types.ModuleType('async_urls')
+        urlconf.urlpatterns = [
+            path('play/', views.play_async),
+            path(f'board/{views.BOARD_IMAGE_VERSION}/<str:key>.png', views.board_image_async),
+            path(f'board/{views.BOARD_IMAGE_VERSION}/<str:key>.svg', views.board_image_svg_async),
+            path('api/move', views.api_move_async),
+            path('api/analyse', views.api_analyse_async),
+        ]
+    with override_settings(ROOT_URLCONF=urlconf):
+        yield request.param
+
+
+def test_health_probes_need_no_sync_adapter(views):
+    from asgiref.sync import async_to_sync, iscoroutinefunction
+    from django.http import HttpResponse
+    from django.test import RequestFactory
+    from webapp.health import HealthCheckMiddleware
+
+    async def async_view(request):
+        return HttpResponse('view')
+
+    factory = RequestFactory()
+    middleware = HealthCheckMiddleware(async_view)
+    assert iscoroutinefunction(middleware)
+    assert async_to_sync(middleware)(factory.get('/healthz')).content == b'ok'
+    assert async_to_sync(middleware)(factory.get('/play/')).content == b'view'
+
+    middleware = HealthCheckMiddleware(lambda request: HttpResponse('view'))
+    assert not iscoroutinefunction(middleware)
+    response = middleware(factory.get('/readyz'))
+    assert (response.status_code, response.content) == (503, b'warming up')    # warm_up() has not run
+    assert middleware(factory.get('/play/')).content == b'view'
+
+
+def post_json(client, path, data, **extra):
+    return client.post(path, json.dumps(data), content_type='application/json', **extra)
+
+
+@pytest.mark.parametrize('image_format, content_type', [('png', 'image/png'), ('svg', 'image/svg+xml')])
+def test_board_images_are_cached_by_versioned_url(views, urls, image_format, content_type):
+    from django.test import Client, override_settings
+
+    client = Client()
+    key = views.fen_to_url_key(OPENING)
+    url = views.board_url(key, image_format)
+    assert url == f'/board/{views.BOARD_IMAGE_VERSION}/{key}.{image_format}'
+    response = client.get(url)
+    assert response.status_code == 200 and response['Content-Type'] == content_type
+    assert 'immutable' in response['Cache-Control']
+
+    response = client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+    assert response.status_code == 304 and not response.content
+
+    assert client.get(views.board_url('not-a-board', image_format)).status_code == 404
+    assert client.get(views.board_url(key[:-1], image_format)).status_code == 404
+    assert client.get(f'/board/0/{key}.{image_format}').status_code == 404    # made by an earlier renderer
+    assert client.post(url).status_code == 405
+
+    # play.html links to the same address
+    with override_settings(BOARD_RENDER=image_format):
+        response = client.post('/play/', {'option2': 'Go'})
+    assert f'src="{url}"' in response.content.decode()
+
+
+def test_play_replies_to_moves(urls):
+    from django.test import Client
+
+    client = Client()
+    assert client.get('/play/').status_code == 200
+    response = client.post('/play/', {'option2': 'Go'})
+    assert response.status_code == 200
+
+    response = client.post('/play/', {'human_move': 'f2f3'})
+    assert response.status_code == 200 and 'my move: ' in response.content.decode()
+    assert client.post('/play/', {'human_move': 'f2f3'}).content.decode().startswith('Illegal move detected!')
+    assert client.post('/play/', {'human_move': 'f2'}).content.decode().startswith('Invalid input!')
+
+
+def test_api_move_plays_posted_fen(urls):
+    from django.test import Client
+
+    client = Client(enforce_csrf_checks=True)    # no session is used, so no CSRF token is needed
+    response = post_json(client, '/api/move', {'fen': OPENING, 'move': 'f2f3'})
+    assert response.status_code == 200
+    result = response.json()
+    assert set(result) == {'fen', 'ai_move', 'tag', 'checkmate'} and result['checkmate'] is False
+    assert Game.from_fen(result['fen']).legal_moves()
+
+    # form data is accepted too
+    response = client.post('/api/move', {'fen': OPENING, 'move': 'f2f3'})
+    assert response.status_code == 200 and response.json() == result
+
+
+def test_api_move_castles_on_the_apps_squares(urls):
+    from django.test import Client
+
+    fen = 'R2K3R/PPPPPPPP/8/8/8/8/pppppppp/r2k3r w KQkq - 0 1'
+    response = post_json(Client(), '/api/move', {'fen': fen, 'move': 'd1a1'})
+    assert response.status_code == 200
+    assert response.json()['fen'].split(' ')[0].endswith('/pppppppp/1kr4r')    # king to b1, rook to c1
+
+
+def test_api_move_rejects_illegal_move(urls):
+    from django.test import Client
+
+    response = post_json(Client(), '/api/move', {'fen': OPENING, 'move': 'f2f5'})
+    assert response.status_code == 400
+    assert response.json()['error'] == 'illegal_move'
+
+
+@pytest.mark.parametrize('data, error', [
+    ({'fen': OPENING, 'move': 'f2'}, 'invalid_input'),
+    ({'fen': OPENING, 'move': None}, 'invalid_input'),
+    ({'fen': 'not a fen', 'move': 'f2f3'}, 'invalid_fen'),
+    (['f2f3'], 'invalid_request'),
+])
+def test_api_move_rejects_invalid_input(urls, data, error):
+    from django.test import Client
+
+    response = post_json(Client(), '/api/move', data)
+    assert response.status_code == 400
+    assert response.json()['error'] == error
+    assert response.json()['message']
+
+
+def test_api_move_plays_session_game_with_csrf_token(urls):
+    from django.test import Client
+
+    client = Client(enforce_csrf_checks=True)
+    client.get('/play/')
+    token = client.cookies['csrftoken'].value
+    response = post_json(client, '/api/move', {'move': 'f2f3'}, HTTP_X_CSRFTOKEN=token)
+    assert response.status_code == 400 and response.json()['error'] == 'no_game'
+
+    response = client.post('/play/', {'option2': 'Go', 'csrfmiddlewaretoken': token})
+    assert response.status_code == 200
+
+    # Another site can send the player's session cookie, but not the token
+    response = post_json(client, '/api/move', {'move': 'f2f3'})
+    assert response.status_code == 403 and response.json()['error'] == 'csrf_failed'
+
+    response = post_json(client, '/api/move', {'move': 'f2f3'}, HTTP_X_CSRFTOKEN=token)
+    assert response.status_code == 200
+    fen = response.json()['fen']
+
+    # The moves were recorded, so the game goes on from the computer's reply
+    move = Game.from_fen(fen).legal_moves()[0].uci()
+    response = post_json(client, '/api/move', {'move': move}, HTTP_X_CSRFTOKEN=token)
+    assert response.status_code == 200 and response.json()['fen'] != fen
+
+
+def analyse(client, positions):
+    """ posts positions to /api/analyse, returns (response, [the NDJSON chunks as they were streamed]) """
+    response = post_json(client, '/api/analyse', positions)
+    if not response.streaming:
+        return response, None
+    if response.is_async:
+        from asgiref.sync import async_to_sync
+
+        async def read():
+            return [chunk async for chunk in response.streaming_content]    # as an ASGI server does
+        return response, [chunk.decode() for chunk in async_to_sync(read)()]
+
+    return response, [chunk.decode() for chunk in response.streaming_content]
+
+
+def test_api_analyse_streams_each_batch(urls):
+    from django.test import Client, override_settings
+
+    positions = [OPENING, {'fen': OPENING, 'move': 'f2f3'}, 'not a fen', {'fen': OPENING, 'move': 'f2f5'},
+                 {'fen': OPENING, 'move': 'f2'}]
+    with override_settings(ANALYSIS_BATCH_SIZE=2):
+        response, chunks = analyse(Client(enforce_csrf_checks=True), {'positions': positions})
+    assert response.status_code == 200 and response['Content-Type'] == 'application/x-ndjson'
+
+    # one chunk per batch, one line per position, in order
+    assert [chunk.count('\n') for chunk in chunks] == [2, 2, 1]
+    lines = [json.loads(line) for line in ''.join(chunks).splitlines()]
+    assert [line['index'] for line in lines] == list(range(len(positions)))
+
+    for line in lines[:2]:
+        assert line['checkmate'] is False and Game.from_fen(line['fen']).legal_moves()
+    _, first_reply = analyse(Client(), [OPENING])
+    assert json.loads(first_reply[0]) == lines[0]
+
+    # bad positions get an error on their own line, without stopping the others
+    assert [line.get('error') for line in lines] == [None, None, 'invalid_fen', 'illegal_move', 'invalid_input']
+    assert all(line['message'] for line in lines[2:])
+
+
+def test_api_analyse_rejects_bad_requests(urls):
+    from django.test import Client, override_settings
+
+    client = Client()
+    with override_settings(ANALYSIS_MAX_POSITIONS=3):
+        response, _ = analyse(client, [OPENING] * 4)
+        assert response.status_code == 413 and response.json()['error'] == 'too_many_positions'
+        response, chunks = analyse(client, [OPENING] * 3)
+        assert response.status_code == 200 and ''.join(chunks).count('\n') == 3
+
+    for data in [{'fen': OPENING}, [OPENING, 3], 'not a list']:
+        response, _ = analyse(client, data)
+        assert response.status_code == 400 and response.json()['error'] == 'invalid_request'
+    response = client.post('/api/analyse', 'not json', content_type='application/json')
+    assert response.status_code == 400 and response.json()['error'] == 'invalid_request'
+    assert client.get('/api/analyse').status_code == 405
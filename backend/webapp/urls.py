@@ -1,7 +1,22 @@
+from django.conf import settings
 from django.urls import path, include
 from . import views
 
 
-urlpatterns = [
-path('play/', views.play),
-]
\ No newline at end of file
+# ASGI servers get the async views, which keep inference and rendering off the event loop
+if settings.ASYNC_VIEWS:
+    urlpatterns = [
+    path('play/', views.play_async),
+    path(f'board/{views.BOARD_IMAGE_VERSION}/<str:key>.png', views.board_image_async),
+    path(f'board/{views.BOARD_IMAGE_VERSION}/<str:key>.svg', views.board_image_svg_async),
+    path('api/move', views.api_move_async),
+    path('api/analyse', views.api_analyse_async),
+    ]
+else:
+    urlpatterns = [
+    path('play/', views.play),
+    path(f'board/{views.BOARD_IMAGE_VERSION}/<str:key>.png', views.board_image),
+    path(f'board/{views.BOARD_IMAGE_VERSION}/<str:key>.svg', views.board_image_svg),
+    path('api/move', views.api_move),
+    path('api/analyse', views.api_analyse),
+    ]
\ No newline at end of file
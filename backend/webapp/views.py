@@ -1,14 +1,31 @@
 """ Receives board setup and player's move data posted from play.html.  Returns a http response. """
 
+from asgiref.sync import sync_to_async
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
 from django.shortcuts import render
-from django.http import HttpResponse
+from django.http import HttpResponse, HttpResponseNotAllowed, Http404, JsonResponse, StreamingHttpResponse
+from django.views.decorators.cache import cache_control
+from django.middleware.csrf import CsrfViewMiddleware
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import etag, require_POST, require_safe
 from io import BytesIO
+import asyncio
 import base64
+import binascii
+import chess
+import contextvars
+import functools
+import json
 import numpy as np
 from . import chess_tools_local as ct 
 from . import web_ensemble_solver as es
+from . import openings
+from .game_state import Game, GameCache
+from .metrics import stage
+from .move_cache import board_key, key_to_board
 import random
-
+import secrets
 
 def check_input(move):
     """ checks whether move is of format 'a2a3' """
@@ -41,138 +58,567 @@ def check_input_q(move):
         return 'fail'
 
 
-def image_to_base64(image):
-    """ converts image to base64 string """
+# Part of each board image's URL, see board_url().  Images are cached for a year by URL, so bump this after
+# changing the renderer, and browsers and nginx will fetch the new images
+BOARD_IMAGE_VERSION = '1'
+
+
+def image_to_png(image):
+    """ converts image to PNG file contents """
     buffer = BytesIO()
     image.save(buffer, format="PNG")
-    img_str = base64.b64encode(buffer.getvalue())
+
+    return buffer.getvalue()
+
+
+def image_to_base64(image):
+    """ converts image to base64 string """
+    img_str = base64.b64encode(image_to_png(image))
     img_str = img_str.decode("utf-8")
 
     return img_str
 
 
-def fen_to_base64(fen):
-    """ converts FEN to base64 string """
-    board = ct.fen_to_ascii(fen)
-    onehot = ct.one_hot_encode(board)        
-    image = ct.one_hot_to_png(onehot)
-    img_str = image_to_base64(image)
+def onehot_to_url_key(onehot):
+    """ converts one-hot tensor to the canonical url-safe key of its board image, see board_url() """
+    return base64.urlsafe_b64encode(board_key(onehot)).decode().rstrip('=')
+
+
+def url_key_to_onehot(key):
+    """ converts a board image key back to a one-hot tensor, or returns None if the key is not a board """
+    try:
+        onehot = key_to_board(base64.urlsafe_b64decode(key + '='))
+    except (binascii.Error, ValueError, IndexError):
+        return None
+    if onehot_to_url_key(onehot) != key:
+        return None
+
+    return onehot
+
+
+def fen_to_url_key(fen):
+    """ converts FEN to the key of its board image """
+    onehot = ct.fen_to_one_hot(fen)
+
+    return onehot_to_url_key(onehot)
+
+
+def board_url(key, image_format='png'):
+    """ the address of a board image, eg. /board/1/<key>.png """
+    return f'/board/{BOARD_IMAGE_VERSION}/{key}.{image_format}'
+
+
+def board_context(fen, onehot=None):
+    """ template variables for play.html to show the board as chosen in settings.py: the address of its image,
+        or in the 'client' render mode the FEN piece placement, which the page draws """
+    if settings.BOARD_RENDER == 'client':
+        return {'board_render': 'client', 'board_fen': fen.split(' ')[0]}
+    board_url_key = fen_to_url_key(fen) if onehot is None else onehot_to_url_key(onehot)
+
+    return {'board_render': settings.BOARD_RENDER, 'board_url': board_url(board_url_key, settings.BOARD_RENDER)}
+
+
+@functools.lru_cache(maxsize=1024)
+def board_png(key):
+    """ renders the board image for a key, keeping the most recently requested images """
+    with stage('render_png'):
+        return image_to_png(ct.one_hot_to_png(url_key_to_onehot(key)))
+
+
+@require_safe
+@cache_control(public=True, max_age=31536000, immutable=True)
+@etag(lambda request, key: f'{BOARD_IMAGE_VERSION}-{key}')
+def board_image(request, key):
+    """ called by urls.py when a board image is requested by browser, returns the PNG image """
+    if url_key_to_onehot(key) is None:
+        raise Http404('unknown board')
+
+    return HttpResponse(board_png(key), content_type='image/png')
+
+
+@functools.lru_cache(maxsize=1024)
+def board_svg(key):
+    """ builds the SVG board image for a key, keeping the most recently requested images """
+    with stage('render_svg'):
+        return ct.one_hot_to_svg(url_key_to_onehot(key)).encode()
+
+
+@require_safe
+@cache_control(public=True, max_age=31536000, immutable=True)
+@etag(lambda request, key: f'{BOARD_IMAGE_VERSION}-{key}')
+def board_image_svg(request, key):
+    """ as board_image(), returning the SVG image """
+    if url_key_to_onehot(key) is None:
+        raise Http404('unknown board')
+
+    return HttpResponse(board_svg(key), content_type='image/svg+xml')
+
+
+# Starting position before an opening is chosen, and responses to rejected moves
+EMPTY_FEN = '8/8/8/8/8/8/8/8 w KQkq - 0 1'
+ERROR_PAGES = {
+    'invalid_input': "Invalid input! <br><br> \
+                      use format: 'a2a3', or 'a7a8q' if promoting a pawn <br> \
+                      use 'd1a1' or 'd1h1' for kingside or queenside castling",
+    'illegal_move': "Illegal move detected! <br><br> \
+                     NB: <br> undoing moves with 'back' button is cheating! <br> \
+                     if promoting a pawn, enter 'a7a8q'",
+}
+
+# CPU-bound work from async views runs in these pools, so the event loop keeps serving other requests.
+# Board images get their own pool, so they are not queued behind slow moves
+move_executor = ThreadPoolExecutor(max_workers=settings.MOVE_WORKER_THREADS, thread_name_prefix='chessnn-move')
+render_executor = ThreadPoolExecutor(max_workers=settings.RENDER_WORKER_THREADS, thread_name_prefix='chessnn-render')
+
+
+# Moves kept in each session, enough for a long game without outgrowing a cookie
+MAX_HISTORY = 300
+
+# This worker's boards of games in progress, see game_state.py
+games = GameCache(settings.GAME_CACHE_SIZE)
+
+
+def start_game(session, fen):
+    """ stores the opening position, and clears the previous game's moves """
+    session['session_fen'] = fen
+    session['start_fen'] = fen
+    session['game_id'] = secrets.token_hex(8)
+    session['history'] = []
+
+
+def record_moves(session, fen, *moves):
+    """ stores the position after a move, and adds the moves that reached it to the game's history """
+    session['session_fen'] = fen
+    session['history'] = (session.get('history', []) + [str(move) for move in moves])[-MAX_HISTORY:]
+
+
+def session_game(session, fen):
+    """ returns (game id, Game) for the session's game in progress at fen, from this worker's cache, or
+        rebuilt from the session's moves """
+    game_id = session.get('game_id')
+    game = games.take(game_id, fen) if game_id is not None else None
+    if game is None:
+        if game_id is None:
+            game_id = session['game_id'] = secrets.token_hex(8)    # a game started before games had ids
+        history = session.get('history', [])
+        start_fen = session.get('start_fen') if len(history) < MAX_HISTORY else None
+        with stage('game_restore'):
+            game = Game.restore(fen, start_fen, history)
+
+    return game_id, game
+
+
+def keep_game(game_id, game, result):
+    """ returns the session's game to this worker's cache after a move, unless it has ended """
+    if game is not None and not result.get('checkmate'):
+        games.put(game_id, game)
+
+
+def choose_opening(post_data):
+    """ returns (FEN, message) for the opening option selected in play.html, or None """
+    # If opening option 1-4 selected, use that opening
+    for option, (opening_fen, message) in openings.OPENINGS.items():
+        if post_data.get(option) == 'Go':
+            return opening_fen, message
+
+    # If opening option 5 selected, use standard position after a random first move
+    if post_data.get('option5') == 'Go':
+        return random.choice(openings.FIRST_MOVES), openings.FIRST_MOVES_MESSAGE
+
+    return None
+
+
+def apply_human_move(fen, move):
+    """ checks a human move is valid and legal, then applies it to the board.
+        Returns (error code, None), or (None, one-hot board [1, 64, 13] for the ensemble to reply to) """
+    # Check input string from play.html is valid, eg: 'b3c4' or 'd7d8q'
+    if check_input(move) == 'fail' and check_input_q(move) == 'fail':
+        return 'invalid_input', None
+
+    # Check move is legal according to chess rules
+    squares = [str(move[:2].lower()), str(move[2:].lower())]
+    flipped_fen = ct.swap_fen_colours(fen, turn='white') 
+    with stage('validate'):
+        if ct.is_move_legal(flipped_fen, squares) == False:
+            return 'illegal_move', None
+
+    # Convert FEN to one-hot tensor and apply human move
+    onehot = ct.fen_to_one_hot(fen)
+    onehot = ct.update_one_hot(onehot, move)
+
+    return None, np.array(onehot).reshape(1,64,13)
+
+
+def apply_game_move(game, move):
+    """ as apply_human_move(), checking the move against the game's legal moves, then playing it on its board """
+    if check_input(move) == 'fail' and check_input_q(move) == 'fail':
+        return 'invalid_input', None
+
+    with stage('validate'):
+        legal_move = game.find_move(move)
+        if legal_move is None:
+            return 'illegal_move', None
+        game.push(legal_move)
+
+    return None, game.onehot().reshape(1,64,13)
+
+
+def solver_result(result):
+    """ converts ensemble_solver() output to a dict of the new 'fen', 'ai_move', 'tag', 'checkmate' and 'onehot' """
+    onehot, ai_move, tag, checkmate = result
+    if checkmate == True:
+        return {'fen': None, 'ai_move': None, 'tag': tag, 'checkmate': True, 'onehot': None}
+
+    return {'fen': ct.one_hot_to_fen(onehot), 'ai_move': ai_move, 'tag': tag, 'checkmate': False, 'onehot': onehot}
+
+
+def respond_to_move(fen, move, game=None):
+    """ applies a human move to the board, then gets the ensemble's reply.  Given the session's game, both
+        moves are played on its board, and the legal moves of each position are found once.
+        Returns a dict with an 'error' code, or the solver_result() """
+    legal = None
+    if game is None:
+        error, onehot = apply_human_move(fen, move)
+    else:
+        error, onehot = apply_game_move(game, move)
+        if error is None:
+            with stage('legal_moves'):
+                legal = game.candidates(onehot)
+    if error is not None:
+        return {'error': error}
+
+    # Get ensemble prediction of best computer move
+    result = solver_result(es.ensemble_solver(onehot, legal))
+    if game is not None and not result['checkmate']:
+        game.push(result['ai_move'])
+
+    return result
+
+
+def opening_page(request):
+    """ if an opening option was selected, starts that game and returns the page showing it, or None """
+    opening = choose_opening(request.POST)
+    if opening is None:
+        return None
+    fen, move = opening
+    start_game(request.session, fen)
+    board = board_context(fen)
+
+    return render(request, "play.html", {'ai_move': '', 'move': move, **board, 'fen': fen, 'tag': ''})
+
+
+def move_page(request, move, result):
+    """ returns the response to a player's move: an error page, the checkmate page, or the page showing the
+        computer's reply, after saving the new position and both moves in the session """
+    if 'error' in result:
+
+        return HttpResponse(ERROR_PAGES[result['error']])
+
+    # Detect win condition
+    if result['checkmate'] == True:
+
+        return HttpResponse("Checkmate!")
+
+    # Save updated FEN, and both moves
+    fen = result['fen']
+    record_moves(request.session, fen, move.lower(), result['ai_move'])
+
+    # Convert onehot tensor to the address of its board image, or the FEN the page draws
+    board = board_context(fen, result['onehot'])
     
-    return img_str
+    with stage('render'):
+        return render(request, "play.html", {'ai_move': result['ai_move'], 'move': move, **board, 'fen': fen, 'tag': result['tag']})
 
 
 def play(request):
     """ called by urls.py when /play.html is requested by browser, returns http response """
-    move = ''
-    ai_move = ''
-    tag = ''
-    valid_input = False
-    fen = request.session.get('session_fen', '8/8/8/8/8/8/8/8 w KQkq - 0 1')
-
-    # If opening option 1 selected, set FEN to Spassky-Fischer and update browser
-    if request.POST.get('option1') == 'Go':
-        fen = '1KR2B1R/1PPQ1PP1/P1N3B1/3N3P/3P1n1p/1p4n1/pbpp1pp1/1krq1b1r w KQkq - 0 1'
-        request.session['session_fen'] = fen
-        move = ' ...g3h5 suggested (Fischer)'  
-        image64 = fen_to_base64(fen)
-
-        return render(request, "play.html", {'ai_move': ai_move, 'move': move, 'image64': image64, 'fen': fen, 'tag': tag})
-
-    # If opening option 2 selected, set FEN to King's Indian Defence and update browser
-    elif request.POST.get('option2') == 'Go':
-        fen = '1KR1QB1R/PPPB2PP/2N2N2/3PPP2/3p4/1pn1p3/pbp2ppp/1kr1qbnr w KQkq - 0 1'
-        request.session['session_fen'] = fen
-        move = ' ...play g1f3 to finish opening'
-        image64 = fen_to_base64(fen)
-
-        return render(request, "play.html", {'ai_move': ai_move, 'move': move, 'image64': image64, 'fen': fen, 'tag': tag})
-    
-    # If opening option 3 selected, set FEN to Nimzo-Indian Defence and update browser
-    elif request.POST.get('option3') == 'Go':
-        fen = '1KR1QB1R/PPP3PP/2NPBN2/4PPb1/4pp2/2np4/ppp3pp/1kr1qbnr w KQkq - 0 1'
-        request.session['session_fen'] = fen
-        move = ' ...play g1f3 to finish opening'   
-        image64 = fen_to_base64(fen)
-
-        return render(request, "play.html", {'ai_move': ai_move, 'move': move, 'image64': image64, 'fen': fen, 'tag': tag})
-    
-    # If opening option 4 selected, set FEN to Ruy Lopez and update browser
-    elif request.POST.get('option4') == 'Go':
-        fen = '1K1RQBNR/PPP1P1PP/2N2PB1/3P4/3p2p1/2n2n1p/pppbpp2/1kr1qb1r w KQkq - 0 1'
-        request.session['session_fen'] = fen
-        move = ' ...play e2e4 to finish opening'
-        image64 = fen_to_base64(fen)
-
-        return render(request, "play.html", {'ai_move': ai_move, 'move': move, 'image64': image64, 'fen': fen, 'tag': tag})
-    
-    # If opening option 5 selected, set FEN to standard position and update browser
-    elif request.POST.get('option5') == 'Go':
-        first_moves = ['RNBKQBNR/PPPP1PPP/8/4P3/8/8/pppppppp/rnbkqbnr w KQkq - 0 1',   #1.d4
-                       'RNBKQBNR/PPP1PPPP/8/3P4/8/8/pppppppp/rnbkqbnr w KQkq - 0 1',   #1.e4
-                       'R1BKQBNR/PPPPPPPP/2N5/8/8/8/pppppppp/rnbkqbnr w KQkq - 0 1',   #1.Nf3
-                       'RNBKQBNR/PPPPP1PP/8/5P2/8/8/pppppppp/rnbkqbnr w KQkq - 0 1']   #1.c4 
-        
-        fen = random.choice(first_moves)
-        request.session['session_fen'] = fen
-        move = '  ...whole-game mode is experimental !'
-        image64 = fen_to_base64(fen)
-
-        return render(request, "play.html", {'ai_move': ai_move, 'move': move, 'image64': image64, 'fen': fen, 'tag': tag})
-
-    # If player move posted, record move
-    elif request.method == "POST":
+    with stage('session_load'):
+        fen = request.session.get('session_fen', EMPTY_FEN)
+
+    # If opening option selected, set FEN to that opening and update browser
+    response = opening_page(request)
+    if response is not None:
+        return response
+
+    # If player move posted, record move and reply
+    if request.method == "POST":
         move = request.POST.get('human_move')
-        
-        # Check input string from play.html is valid, eg: 'b3c4' or 'd7d8q'
-        if check_input(move) == 'fail' and check_input_q(move) == 'fail':
-            
-            return HttpResponse("Invalid input! <br><br> \
-                                 use format: 'a2a3', or 'a7a8q' if promoting a pawn <br> \
-                                 use 'd1a1' or 'd1h1' for kingside or queenside castling")
-              
-        else:
-            valid_input = True 
-            # Check move is legal according to chess rules
-            fen = request.session.get('session_fen')
-            squares = [str(move[:2].lower()), str(move[2:].lower())]
-            flipped_fen = ct.swap_fen_colours(fen, turn='white') 
-            if ct.is_move_legal(flipped_fen, squares) == False:
-                
-                return HttpResponse("Illegal move detected! <br><br> \
-                                     NB: <br> undoing moves with 'back' button is cheating! <br> \
-                                     if promoting a pawn, enter 'a7a8q'")
-
-
-        # Convert FEN to one-hot tensor and apply human move
         fen = request.session.get('session_fen')
-        board = ct.fen_to_ascii(fen)
-        onehot = ct.one_hot_encode(board)
-        if valid_input == True:                
-            onehot = ct.update_one_hot(onehot, move)
+        game_id, game = session_game(request.session, fen) if fen is not None else (None, None)
+        result = respond_to_move(fen, move, game)
+        keep_game(game_id, game, result)
+
+        return move_page(request, move, result)
+
+    # Convert selected opening FEN to the address of its board image
+    board = board_context(fen)
+
+    return render(request, "play.html", {'ai_move': '', 'move': '', **board})
+
+
+async def run_cpu_bound(executor, function, *args):
+    """ runs a CPU-bound function in a bounded thread pool, without blocking the event loop.
+        The function sees the request's context, so its stage timings are added to the request's """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+
+    return await loop.run_in_executor(executor, functools.partial(context.run, function, *args))
+
+
+async def board_image_async(request, key):
+    """ as board_image(), for ASGI servers: images are rendered in the render thread pool """
+    return await run_cpu_bound(render_executor, board_image, request, key)
+
+
+async def board_image_svg_async(request, key):
+    """ as board_image_svg(), for ASGI servers """
+    return await run_cpu_bound(render_executor, board_image_svg, request, key)
+
+
+async def play_async(request):
+    """ as play(), for ASGI servers: session access runs in Django's sync thread, and move validation,
+        legal-move generation and inference run in the move thread pool """
+    with stage('session_load'):
+        fen = await sync_to_async(request.session.get)('session_fen', EMPTY_FEN)
+
+    # If opening option selected, set FEN to that opening and update browser
+    response = opening_page(request)
+    if response is not None:
+        return response
+
+    # If player move posted, record move and reply
+    if request.method == "POST":
+        move = request.POST.get('human_move')
+        fen = await sync_to_async(request.session.get)('session_fen')
+        game_id, game = await sync_to_async(session_game)(request.session, fen) if fen is not None else (None, None)
+        result = await run_cpu_bound(move_executor, respond_to_move, fen, move, game)
+        keep_game(game_id, game, result)
+
+        return move_page(request, move, result)
+
+    # Convert selected opening FEN to the address of its board image
+    board = board_context(fen)
+
+    return render(request, "play.html", {'ai_move': '', 'move': '', **board})
+
+
+# Explanations returned with /api/move error codes
+API_ERRORS = {
+    'invalid_request': "send JSON or form data with 'move', and optionally 'fen'",
+    'invalid_fen': "'fen' is not a position in this app's orientation",
+    'no_game': "no 'fen' given, and this session has no game in progress",
+    'invalid_input': "use format 'a2a3', 'a7a8q' if promoting a pawn, or 'd1a1' or 'd1h1' to castle",
+    'illegal_move': "the move is not legal in this position",
+    'csrf_failed': "playing the session's game needs the CSRF token, as play.html sends, or send a 'fen'",
+}
+
+
+def api_error(code, status=400):
+    """ returns a JSON error response with an explanation of the code """
+    return JsonResponse({'error': code, 'message': API_ERRORS[code]}, status=status)
+
+
+def passes_csrf_check(request):
+    """ applies CsrfViewMiddleware's check to a request to a csrf_exempt view.  /api/move only needs it when
+        it plays the session's game, as only then could another site use a player's cookie to move for them """
+    return CsrfViewMiddleware(lambda request: None).process_view(request, None, (), {}) is None
+
+
+def read_move_request(request):
+    """ returns (fen, move) from a JSON or form /api/move request, with fen None if not given """
+    if request.content_type == 'application/json':
+        try:
+            data = json.loads(request.body)
+        except ValueError:
+            data = None
+        if not isinstance(data, dict):
+            raise ValueError('request body is not a JSON object')
+    else:
+        data = request.POST
+
+    return data.get('fen'), data.get('move')
+
+
+def is_valid_fen(fen):
+    """ checks whether a FEN given to /api/move can be played from """
+    try:
+        ct.fen_to_one_hot(fen)
+        chess.Board(ct.swap_fen_colours(fen, turn='white'), chess960=True)
+    except (AttributeError, IndexError, KeyError, TypeError, ValueError):
+        return False
+
+    return True
+
+
+def api_move_result(session, move, result):
+    """ converts respond_to_move() output to a JSON response, recording the moves in the session if given """
+    if 'error' in result:
+        return api_error(result['error'])
+    ai_move = str(result['ai_move']) if result['ai_move'] is not None else None
+    if session is not None and not result['checkmate']:
+        record_moves(session, result['fen'], move.lower(), ai_move)
+
+    return JsonResponse({'fen': result['fen'], 'ai_move': ai_move, 'tag': result['tag'], 'checkmate': result['checkmate']})
+
+
+@csrf_exempt
+@require_POST
+def api_move(request):
+    """ called by urls.py for /api/move: plays a human move against the FEN posted, or the session's game,
+        and returns the ensemble's reply as JSON, without rendering the page or board image.  Requests with
+        a FEN need no CSRF token, as they do not use the session """
+    try:
+        fen, move = read_move_request(request)
+    except ValueError:
+        return api_error('invalid_request')
+    session = None
+    game_id, game = None, None
+    if fen is None:
+        if not passes_csrf_check(request):
+            return api_error('csrf_failed', status=403)
+        session = request.session
+        fen = session.get('session_fen')
+        if fen is None:
+            return api_error('no_game')
+        game_id, game = session_game(session, fen)
+    elif not is_valid_fen(fen):
+        return api_error('invalid_fen')
+    result = respond_to_move(fen, move, game)
+    keep_game(game_id, game, result)
+
+    return api_move_result(session, move, result)
+
+
+async def api_move_async(request):
+    """ as api_move(), for ASGI servers: the move is checked and solved in the move thread pool """
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    try:
+        fen, move = read_move_request(request)
+    except ValueError:
+        return api_error('invalid_request')
+    session = None
+    game_id, game = None, None
+    if fen is None:
+        if not await sync_to_async(passes_csrf_check)(request):
+            return api_error('csrf_failed', status=403)
+        session = request.session
+        fen = await sync_to_async(session.get)('session_fen')
+        if fen is None:
+            return api_error('no_game')
+        game_id, game = await sync_to_async(session_game)(session, fen)
+    elif not await run_cpu_bound(move_executor, is_valid_fen, fen):
+        return api_error('invalid_fen')
+    result = await run_cpu_bound(move_executor, respond_to_move, fen, move, game)
+    keep_game(game_id, game, result)
+
+    return api_move_result(session, move, result)
+
+api_move_async.csrf_exempt = True    # csrf_exempt() does not support async views in Django 4.2, see passes_csrf_check()
+
+
+def read_analysis_request(request):
+    """ returns [(fen, move or None), ...] from an /api/analyse request: a JSON list, or an object with
+        'positions', of FENs or {'fen': ..., 'move': ...} objects """
+    data = json.loads(request.body)
+    if isinstance(data, dict):
+        data = data.get('positions')
+    if not isinstance(data, list):
+        raise ValueError("expected a list of positions")
+    positions = []
+    for item in data:
+        if isinstance(item, str):
+            positions.append((item, None))
+        elif isinstance(item, dict):
+            positions.append((item.get('fen'), item.get('move')))
+        else:
+            raise ValueError("each position must be a FEN or an object with 'fen'")
+
+    return positions
+
+
+def analyse_positions(positions, first_index=0):
+    """ solves a chunk of (fen, move) positions with one model call, returns an NDJSON line for each """
+    lines = [None] * len(positions)
+    boards = []
+    board_indices = []
+    for i, (fen, move) in enumerate(positions):
+        if not is_valid_fen(fen):
+            error = 'invalid_fen'
+        elif move is None:
+            error, onehot = None, ct.fen_to_one_hot(fen)
+        else:
+            error, onehot = apply_human_move(fen, move)
+        if error is not None:
+            lines[i] = {'index': first_index + i, 'error': error, 'message': API_ERRORS[error]}
+        else:
+            boards.append(onehot.reshape(64,13))
+            board_indices.append(i)
+
+    if boards:
+        for i, result in zip(board_indices, es.ensemble_solver_many(boards)):
+            result = solver_result(result)
+            ai_move = str(result['ai_move']) if result['ai_move'] is not None else None
+            lines[i] = {'index': first_index + i, 'fen': result['fen'], 'ai_move': ai_move, 
+                        'tag': result['tag'], 'checkmate': result['checkmate']}
+
+    return ''.join(json.dumps(line) + '\n' for line in lines)
+
+
+def analysis_chunks(positions):
+    """ yields NDJSON results for each chunk of ANALYSIS_BATCH_SIZE positions, as each is solved """
+    size = settings.ANALYSIS_BATCH_SIZE
+    for start in range(0, len(positions), size):
+        yield analyse_positions(positions[start:start + size], start)
+
+
+async def analysis_chunks_async(positions):
+    """ as analysis_chunks(), solving each chunk in the move thread pool """
+    size = settings.ANALYSIS_BATCH_SIZE
+    for start in range(0, len(positions), size):
+        yield await run_cpu_bound(move_executor, analyse_positions, positions[start:start + size], start)
+
+
+def start_analysis(request):
+    """ reads an /api/analyse request, returns (positions, None), or (None, an error response) """
+    try:
+        positions = read_analysis_request(request)
+    except ValueError:
+        return None, JsonResponse({'error': 'invalid_request', 
+                                   'message': "send a JSON list of FENs, or of objects with 'fen' and optionally 'move'"}, status=400)
+    if len(positions) > settings.ANALYSIS_MAX_POSITIONS:
+        return None, JsonResponse({'error': 'too_many_positions', 
+                                   'message': f'send at most {settings.ANALYSIS_MAX_POSITIONS} positions per request'}, status=413)
+
+    return positions, None
+
+
+@csrf_exempt
+@require_POST
+def api_analyse(request):
+    """ called by urls.py for /api/analyse: solves many positions in batches, streaming one JSON line per
+        position, in order, as each batch completes.  Positions with a 'move' are solved after that human move """
+    positions, error_response = start_analysis(request)
+    if error_response is not None:
+        return error_response
 
-        # Get ensemble prediction of best computer move
-        onehot = np.array(onehot).reshape(1,64,13)
-        onehot, ai_move, tag, checkmate = es.ensemble_solver(onehot)
+    response = StreamingHttpResponse(analysis_chunks(positions), content_type='application/x-ndjson')
+    response['X-Accel-Buffering'] = 'no'    # nginx passes each batch on as it is solved
 
-        # Detect win condition
-        if checkmate == True:
+    return response
 
-            return HttpResponse("Checkmate!")
 
-        # Save updated FEN
-        fen = ct.one_hot_to_fen(onehot)
-        request.session['session_fen'] = fen
+async def api_analyse_async(request):
+    """ as api_analyse(), for ASGI servers: each batch is solved in the move thread pool """
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    positions, error_response = start_analysis(request)
+    if error_response is not None:
+        return error_response
 
-        # Convert onehot tensor to board image then convert image to string
-        image = ct.one_hot_to_png(onehot)
-        image64 = image_to_base64(image)
-        
-        return render(request, "play.html", {'ai_move': ai_move, 'move': move, 'image64': image64, 'fen': fen, 'tag': tag})
+    response = StreamingHttpResponse(analysis_chunks_async(positions), content_type='application/x-ndjson')
+    response['X-Accel-Buffering'] = 'no'    # nginx passes each batch on as it is solved
 
-    # Convert selected opening FEN to image string
-    board = ct.fen_to_ascii(fen)
-    onehot = ct.one_hot_encode(board)        
-    image = ct.one_hot_to_png(onehot)
-    image64 = image_to_base64(image)
+    return response
 
-    return render(request, "play.html", {'ai_move': ai_move, 'move': move, 'image64': image64})
\ No newline at end of file
+api_analyse_async.csrf_exempt = True
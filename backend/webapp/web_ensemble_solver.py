@@ -1,107 +1,214 @@
 """ ensemble solver function called by views.py """
 
+import os
+import time
+import chess
 import numpy as np
-from tensorflow import keras
+from django.conf import settings
 from . import chess_tools_local as ct
+from .ensemble_decision import adaptive_decide, decide
+from .inference_backends import load_backend
+from .inference_batcher import MicroBatcher
+from .metrics import record_adaptive, record_decision, stage
+from .model_registry import ModelRegistry
+from .move_cache import MoveCache, board_key
+from .position_book import PositionBook
+
+class Engine:
+    """ The inference backend chosen in settings.py for the models in a model registry config, with the
+        batcher, move cache and position book that depend on them.  Loading the models is slow, so an
+        engine is created by engine() when first needed, or by health.warm_up() before the server accepts
+        requests, rather than when this module is imported.  Each new set of models gets a new engine, so
+        moves cached for the previous set are dropped with it """
+
+    def __init__(self, config):
+        # Load models from chess_trainer.py with the inference backend chosen in settings.py
+        models = {'model_dir': config['model_dir'], 'member_names': config['member_names'], 'version': config['version']}
+        if settings.INFERENCE_BACKEND == 'tflite':
+            self.backend = load_backend('tflite', quantization=settings.INFERENCE_QUANTIZATION, **models)
+        elif settings.INFERENCE_BACKEND == 'remote':
+            self.backend = load_backend('remote', socket_path=settings.MODEL_SERVER_SOCKET)
+        else:
+            self.backend = load_backend(settings.INFERENCE_BACKEND, **models)
+
+        # Share model calls between concurrent requests, if enabled in settings.py
+        self.batcher = None
+        if settings.INFERENCE_BATCH_WINDOW_MS > 0:
+            self.batcher = MicroBatcher(self.backend.predict_batch,
+                                        window=settings.INFERENCE_BATCH_WINDOW_MS / 1000,
+                                        max_batch=settings.INFERENCE_MAX_BATCH)
+
+        # Members in the order the adaptive ensemble evaluates them, if enabled and the backend can run
+        # them one at a time.  Each member's model call is traced here, rather than on a player's move
+        self.adaptive_order = None
+        if settings.ADAPTIVE_ENSEMBLE and hasattr(self.backend, 'predict_members'):
+            names = list(self.backend.member_names)
+            first = [names.index(name) for name in settings.ADAPTIVE_ORDER if name in names]
+            self.adaptive_order = first + [i for i in range(len(names)) if i not in first]
+            self.backend.predict_members(np.zeros((1,64,13), dtype='float32'), self.adaptive_order)
+
+        # Remember moves already chosen, as the ensemble always plays the same move from the same board
+        self.move_cache = MoveCache(settings.MOVE_CACHE_SIZE, model_set=self.backend.model_set)
+
+        # Moves precomputed by 'manage.py build_position_book', if built for the current models
+        self.book = None
+        if os.path.exists(settings.POSITION_BOOK_PATH):
+            self.book = PositionBook(settings.POSITION_BOOK_PATH)
+            if self.book.members != self.backend.member_names or self.book.version != self.backend.version:
+                self.book = None
+
+    def predict_batch(self, onehot_board_tensors):
+        """ evaluates a stack of boards with every model, returns predictions [models, boards, 64, 13] """
+        return self.backend.predict_batch(onehot_board_tensors)
+
+    def ensemble_predict(self, onehot_board_tensor):
+        """ returns every model's prediction for a single board [models, 1, 64, 13] """
+        if self.batcher is not None:
+            return self.batcher.predict(onehot_board_tensor)
 
-# Load models from chess_trainer.py
-model_1 = keras.models.load_model('/services/backend/webapp/ml_models/general_solver_1')
-model_2 = keras.models.load_model('/services/backend/webapp/ml_models/general_solver_2')
-# model_3 = keras.models.load_model('/services/backend/webapp/ml_models/general_solver_3')
-# model_4 = keras.models.load_model('/services/backend/webapp/ml_models/general_solver_4')
-model_5 = keras.models.load_model('/services/backend/webapp/ml_models/whole_game_3')
-ensemble = [model_1, model_2, model_5]
-
-
-def ensemble_solver(onehot_board_tensor): 
-    """ predicts best move using an ensemble of neural networks """
-    raw_total = np.zeros((64,13), dtype=float)
-    legal_total = np.zeros((64,13), dtype=float)
-    max_lc_score = float('-inf')
-    legal_count = 0
-    tag = 'none'
-    checkmate = False
-    fen = ct.one_hot_to_fen(onehot_board_tensor)
-    allowed_tensors, allowed_moves = ct.find_legal_moves(fen)
-
-    # Evaluate board with every model
-    for model in ensemble:
-        y_predict = model(onehot_board_tensor)
-        y_predict = np.array(y_predict).reshape(1,64,13)
-        # Sum all predictions
-        raw_total = np.add(raw_total, y_predict)
-
-        # Compare prediction to all possible legal moves
-        y_predict_bool = ct.booleanise(y_predict)
-        for i, tensor in enumerate(allowed_tensors):
-            if np.all(y_predict_bool == tensor):
-                legal_total = np.add(legal_total, y_predict)
-                legal_count += 1
-
-            # Get confidence score and keep record of most confident legal prediction
-            c_score = ct.confidence_score(y_predict)
-            if c_score > max_lc_score:
-                mcf_leg_predict = y_predict
-                max_lc_score = c_score
-
-    # Find average of all predictions and all legal predictions 
-    avg_raw_predict = raw_total                                                 
-    avg_leg_predict = legal_total   # no need to divide due to later argmax()'s   
-
-    # Convert from probability vectors to one-hot vectors
-    avg_raw_bool = ct.booleanise(avg_raw_predict)  
-    avg_legal_bool = ct.booleanise(avg_leg_predict)   
-
-
-    # Apply decision criteria to choose best prediction
-    for i, tensor in enumerate(allowed_tensors):
-        if np.all(tensor == avg_raw_bool):
-            # Use average of all ensemble predictions
-            ensemble_predict = avg_raw_predict
-            tag = 'avrw'
-            ai_move = allowed_moves[i]
-            checkmate = False
-
-            return(ensemble_predict, ai_move, tag, checkmate)
-
-    for i, tensor in enumerate(allowed_tensors):
-        if np.all(tensor == avg_legal_bool):
-            # Use average of legal ensemble predictions
-            ensemble_predict = avg_leg_predict
-            tag = 'avlg'
-            ai_move = allowed_moves[i]
-            checkmate = False
-
-            return(ensemble_predict, ai_move, tag, checkmate)
-
-    if legal_count >= 1:
-        mcf_leg_bool = ct.booleanise(mcf_leg_predict)
-        for i, tensor in enumerate(allowed_tensors):
-            if np.all(tensor == mcf_leg_bool):
-                # Use most confident legal solo prediction
-                ensemble_predict = mcf_leg_predict
-                tag = 'mclg'
-                ai_move = allowed_moves[i]
-                checkmate = False
-
-                return(ensemble_predict, ai_move, tag, checkmate)
+        return self.predict_batch(onehot_board_tensor)
 
-    else:
-        try:
-            # Find most similar legal move to average of raw predictions
-            ensemble_predict, ai_move = ct.most_similar_move(allowed_tensors, avg_raw_predict, allowed_moves)
-            tag = 'mslm'
-            checkmate = False
+    def known_result(self, key):
+        """ returns the remembered or precomputed result for a board key, or None """
+        if self.move_cache.model_set != self.backend.model_set:
+            self.move_cache.invalidate(self.backend.model_set)
+        cached = self.move_cache.get(key)
+        if cached is not None:
+            return cached
+
+        if self.book is not None:
+            entry = self.book.lookup(key)
+            if entry is not None:
+                predicted_board, move, tag, checkmate = entry
+                return (predicted_board, chess.Move.from_uci(move) if move else None, tag, checkmate)
+
+        return None
+
+
+# The models in the registry config, replaced without a restart when it changes.  With the remote backend
+# the model server owns the models, and clients see its new set through the backend's model_set
+registry = ModelRegistry(None if settings.INFERENCE_BACKEND == 'remote' else settings.MODEL_REGISTRY_PATH,
+                         Engine, check_interval=settings.MODEL_REGISTRY_CHECK_SECONDS)
+
+
+def engine():
+    """ returns the Engine for the current models, loading them on first use """
+    return registry.get()
+
+
+def predict_batch(onehot_board_tensors):
+    """ evaluates a stack of boards with every model, returns predictions [models, boards, 64, 13] """
+    return engine().predict_batch(onehot_board_tensors)
+
+
+def compact_result(result):
+    """ keeps only the resulting one-hot board from a prediction, which is all that views.py needs """
+    predicted_board, ai_move, tag, checkmate = result
+    if predicted_board is not None:
+        predicted_board = ct.booleanise(predicted_board).reshape(1,64,13)
+        predicted_board.setflags(write=False)
+
+    return (predicted_board, ai_move, tag, checkmate)
+
+
+def solve_batch(onehot_board_tensors):
+    """ ensemble_solver() for a stack of boards, evaluating each model once for the whole stack """
+    boards = np.asarray(onehot_board_tensors).reshape(-1,64,13)
+
+    return decide_batch(boards, predict_batch(boards))
+
+
+def timed_decide(predictions, allowed_tensors, allowed_moves):
+    """ decide(), recording its time under the criterion that chose the move """
+    start = time.perf_counter()
+    result = decide(predictions, allowed_tensors, allowed_moves)
+    record_decision(result[2], time.perf_counter() - start)
+
+    return result
+
+
+def adaptive_solve(current, onehot_board_tensor, allowed_tensors, allowed_moves):
+    """ decide(), evaluating only as many of the engine's members as needed, see adaptive_decide() """
+    board = np.asarray(onehot_board_tensor, dtype='float32').reshape(1,64,13)
+    inference_seconds = []
+
+    def predict_member(i):
+        start = time.perf_counter()
+        with stage('inference'):
+            prediction = current.backend.predict_members(board, [i])[0, 0]
+        inference_seconds.append(time.perf_counter() - start)
+        return prediction
+
+    start = time.perf_counter()
+    result, evaluated = adaptive_decide(predict_member, current.adaptive_order, allowed_tensors, allowed_moves,
+                                        agreement=settings.ADAPTIVE_AGREEMENT)
+    record_decision(result[2], time.perf_counter() - start - sum(inference_seconds))
+    record_adaptive(evaluated, len(current.adaptive_order))
+
+    return result
 
-            return(ensemble_predict, ai_move, tag, checkmate)
 
-        except:
-            # No legal moves available
-            ensemble_predict = None
-            ai_move = None
-            tag = 'chkm'
-            checkmate = True
+def decide_batch(boards, predictions):
+    """ applies the decision criteria to each of a stack of boards [B, 64, 13], given predictions [M, B, 64, 13] """
+    results = []
+    for i, board in enumerate(boards):
+        with stage('legal_moves'):
+            allowed_tensors, allowed_moves = ct.find_legal_moves(ct.one_hot_to_fen(board))
+        results.append(compact_result(timed_decide(predictions[:, i], allowed_tensors, allowed_moves)))
 
-            return(ensemble_predict, ai_move, tag, checkmate)
+    return results
 
-    
\ No newline at end of file
+
+def is_playable(result, allowed_moves):
+    """ checks a remembered result is still right when the legal moves are known, eg. without castling rights """
+    ai_move, checkmate = result[1], result[3]
+
+    return ai_move in allowed_moves if not checkmate else not allowed_moves
+
+
+def ensemble_solver(onehot_board_tensor, legal=None):
+    """ predicts best move using an ensemble of neural networks.  legal is (candidate boards, moves) if
+        already known, eg. from the session's game, otherwise they are found from the board """
+    current = engine()    # the same models throughout, if they are replaced meanwhile
+    key = board_key(onehot_board_tensor)
+    with stage('cache'):
+        result = current.known_result(key)
+    if result is not None and (legal is None or is_playable(result, legal[1])):
+        return result
+
+    if legal is not None:
+        allowed_tensors, allowed_moves = legal
+    else:
+        with stage('legal_moves'):
+            fen = ct.one_hot_to_fen(onehot_board_tensor)
+            allowed_tensors, allowed_moves = ct.find_legal_moves(fen)
+
+    # Evaluate board with every model, then apply decision criteria to choose best prediction
+    if current.adaptive_order is not None:
+        result = compact_result(adaptive_solve(current, onehot_board_tensor, allowed_tensors, allowed_moves))
+    else:
+        with stage('inference'):
+            predictions = current.ensemble_predict(onehot_board_tensor).reshape(-1,64,13)
+        result = compact_result(timed_decide(predictions, allowed_tensors, allowed_moves))
+    current.move_cache.put(key, result)
+
+    return result
+
+
+def ensemble_solver_many(onehot_board_tensors):
+    """ ensemble_solver() for a stack of boards: known results are reused, and the remaining boards
+        are evaluated together by solve_batch() """
+    current = engine()
+    boards = np.asarray(onehot_board_tensors).reshape(-1,64,13)
+    keys = [board_key(board) for board in boards]
+    with stage('cache'):
+        results = [current.known_result(key) for key in keys]
+    unknown = [i for i, result in enumerate(results) if result is None]
+    if unknown:
+        with stage('inference'):
+            predictions = current.predict_batch(boards[unknown])
+        for i, result in zip(unknown, decide_batch(boards[unknown], predictions)):
+            current.move_cache.put(keys[i], result)
+            results[i] = result
+
+    return results